@@ -8,12 +8,16 @@ import platform
 import logging
 import zipfile
 import random
+import threading
 from datetime import datetime
-from config import server_ip, server_port, BLENDER_PATH
-from utils.render import render_blender
+from config import server_ip, server_port, BLENDER_PATH, HEARTBEAT_INTERVAL, EVENT_POLL_TIMEOUT, UPLOAD_CHUNK_SIZE, UPLOAD_PARALLELISM, STREAM_FRAME_UPLOADS, FRAME_UPLOAD_TIMEOUT, FRAME_UPLOAD_DRAIN_TIMEOUT
+from utils.render import render_blender, calibration_render
 from requests.exceptions import RequestException
 from utils.get_render_settings import get_render_settings, save_render_settings
-from utils.file_transfer import upload_file, download_file
+from utils.file_transfer import upload_file, download_file, upload_file_chunked, MultipartStream
+from utils.result_store import result_path
+from utils.frame_uploader import FrameUploader
+from utils.checksum import file_sha256
 
 BASE_URL = f"http://{server_ip}:{server_port}"
 
@@ -87,7 +91,7 @@ def upload_blend_file(room_id, blend_file_path):
     local_queue_dir = os.path.join("render", room_id, "queue")
     os.makedirs(local_queue_dir, exist_ok=True)
     local_blend_file = os.path.join(local_queue_dir, os.path.basename(blend_file_path))
-    shutil.copy(blend_file_path, local_blend_file)
+    shutil.copy2(blend_file_path, local_blend_file)  # 保留修改时间，重新上传时可以续传之前的分块
 
     # 获取渲染设置
     settings = get_render_settings(local_blend_file, room_id)  # 添加 room_id 参数
@@ -109,7 +113,13 @@ def upload_blend_file(room_id, blend_file_path):
     print(f"上传 Blender 文和渲染设置到服务器: {local_blend_file}, {render_settings_path}")
     print(f"房间号: {room_id}")
     # 上传 Blender 文和渲染设置到服务器
-    success = upload_file(local_blend_file, f"{BASE_URL}/upload", data={"room_id": room_id})
+    # 先按内容哈希查询，服务器已有相同文件（其他房间上传过）时直接引用，不再上传
+    if link_blend_file(room_id, local_blend_file):
+        print("Server already has this file, skipped upload")
+        success = True
+    else:
+        # blend 文件可能有几 GB，分块并行上传，中断后再次上传会从缺失的分块续传
+        success = upload_file_chunked(local_blend_file, BASE_URL, room_id, UPLOAD_CHUNK_SIZE, UPLOAD_PARALLELISM)
     if not success:
         print("Failed to upload Blender file")
         return False
@@ -132,6 +142,19 @@ def upload_blend_file(room_id, blend_file_path):
     download_room_settings(room_id)  # 更新 room_settings.json
     return True
 
+def link_blend_file(room_id, blend_file_path):
+    """让房间引用服务器上内容相同的 blend 文件，成功返回 True，服务器没有该文件时返回 False"""
+    try:
+        response = requests.post(f"{BASE_URL}/blobs/link", json={
+            "room_id": room_id,
+            "file_name": os.path.basename(blend_file_path),
+            "sha256": file_sha256(blend_file_path)
+        })
+    except RequestException as e:
+        logging.error(f"查询服务器文件失败: {str(e)}")
+        return False
+    return response.status_code == 200
+
 def trigger_rendering(room_id):
     response = requests.post(f"{BASE_URL}/trigger_rendering", json={"room_id": room_id})
     if response.status_code == 200:
@@ -189,23 +212,25 @@ def render_task(room_id, task, client_id):
     
     if isinstance(result, int):
         logging.info(f"Rendering completed. Last frame rendered: {result}")
-        for frame in range(task['start_frame'], min(result, task['end_frame']) + 1):
-            frame_info = {
-                "frame": frame,
-                "task_id": task['id'],
-                "client": client_id,
-                "blend_file": os.path.basename(task['file'])
-            }
-            try:
-                response = requests.post(f"{BASE_URL}/update_render_log", json={"room_id": room_id, "frame_info": frame_info})
-                response.raise_for_status()
-            except requests.RequestException as e:
-                logging.error(f"Failed to update render log: {e}")
+        report_render_log(room_id, task['id'], client_id, os.path.basename(task['file']),
+                          task['start_frame'], min(result, task['end_frame']))
         return True
     else:
         logging.error(f"Rendering failed: {result}")
         return False
 
+def report_render_log(room_id, task_id, client_id, blend_file, start_frame, end_frame):
+    """一次请求上报一段已渲染完成的帧"""
+    frames = [{"frame": frame, "task_id": task_id, "client": client_id, "blend_file": blend_file}
+              for frame in range(start_frame, end_frame + 1)]
+    if not frames:
+        return
+    try:
+        response = requests.post(f"{BASE_URL}/update_render_log_batch", json={"room_id": room_id, "frames": frames})
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logging.error(f"Failed to update render log: {e}")
+
 # 添加一个新函数来下载Blender文件
 def download_blend_file(room_id, file_path):
     file_name = os.path.basename(file_path)
@@ -230,16 +255,16 @@ def organize_results(room_id):
     response = requests.get(f"{BASE_URL}/get_render_log", params={"room_id": room_id})
     if response.status_code == 200:
         render_log = response.json()
-        blend_files = set(entry["blend_file"] for entry in render_log)
         
-        for blend_file in blend_files:
+        for blend_file, file_log in render_log["files"].items():
             output_dir = os.path.join("render", room_id, "render", blend_file.replace(".blend", ""))
             os.makedirs(output_dir, exist_ok=True)
             
-            for entry in render_log:
-                if entry["blend_file"] == blend_file:
-                    src = os.path.join("render", room_id, "results", entry["task_id"], f"frame_{entry['frame']:04d}.png")
-                    dst = os.path.join(output_dir, f"frame_{entry['frame']:04d}.png")
+            # runs 中每一项是 [起始帧, 结束帧, task_id, client]
+            for start_frame, end_frame, task_id, _ in file_log["runs"]:
+                for frame in range(start_frame, end_frame + 1):
+                    src = os.path.join("render", room_id, "results", task_id, f"frame_{frame:04d}.png")
+                    dst = os.path.join(output_dir, f"frame_{frame:04d}.png")
                     if os.path.exists(src):
                         shutil.move(src, dst)
         
@@ -277,7 +302,7 @@ def get_room_status(room_id):
         print(f"Response: {response.text}")
         return None
 
-def render_loop(room_id, client_id):
+def render_loop(room_id, client_id, idle_interval=HEARTBEAT_INTERVAL):
     print("尝试开始渲染...")
     
     # 检查房间状态
@@ -298,88 +323,352 @@ def render_loop(room_id, client_id):
             print("无法确定房主。请等待房间被触发。")
         return
 
-    # 尝试下载 tasks.json
-    tasks_file_path = f"./render/{room_id}/log/tasks.json"
-    if not download_file(f"{BASE_URL}/download_tasks?room_id={room_id}", tasks_file_path):
-        print("下载 tasks.json 失败。房间可能尚未被触发。")
-        return
+    # 还没有实测帧率时，服务器根据校准耗时决定给本机分多大的任务
+    report_calibration(room_id, client_id)
 
+    # 本地 tasks.json 由事件流增量更新，不再每个任务结束后重新下载
+    stop_mirror = start_task_mirror(room_id)
+
+    # 循环向服务器领取任务。暂时领不到任务时（剩下的任务都被其他成员租用）按退避间隔继续轮询，
+    # 直到房间没有未完成的任务：其他成员掉线后，回收的任务还需要有人领取
+    interval = 1
     try:
-        with open(tasks_file_path, 'r') as f:
-            tasks = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"读取 tasks.json 时出错：{e}")
+        while True:
+            task = request_next_task(room_id, client_id)
+            if task is not None:
+                interval = 1
+                process_task(room_id, task, client_id)
+                continue
+
+            status = get_room_status(room_id)
+            if status is None or status['status'] not in ('triggered', 'rendering') \
+                    or not status.get('unfinished_tasks'):
+                break
+            print(f"暂无可领取的任务，还有 {status['unfinished_tasks']} 个任务未完成，{interval} 秒后重试")
+            time.sleep(interval)
+            interval = min(interval * 2, idle_interval)
+    finally:
+        stop_mirror.set()
+
+    print("所有任务已完成。")
+
+
+def process_task(room_id, task, client_id):
+    """渲染一个已领取的任务：下载 blend 文件、渲染、上传结果并释放租约"""
+    print(f"处理任务：{task['id']}")
+
+    # 检查任务是否包含所需的所有键
+    required_keys = ['id', 'file_name', 'start_frame', 'end_frame']
+    if not all(key in task for key in required_keys):
+        print(f"任务 {task['id']} 缺少必要的信息。跳过此任务。")
+        print(f"任务详情：{task}")
+        update_task_status(room_id, task['id'], 'failed', client_id)
         return
 
-    available_tasks = [task for task in tasks if task['status'] == 'triggered' and task['client'] == client_id]
-    
-    if not available_tasks:
-        print("该客户端没有可用的任务。")
+    # 使用 'file_name' 而不是 'file'
+    blend_file = os.path.join("render", room_id, "queue", task['file_name'])
+    if not os.path.exists(blend_file) and not download_blend_file(room_id, task['file_name']):
+        print(f"下载 {task['file_name']} 失败，任务 {task['id']} 标记为失败")
+        update_task_status(room_id, task['id'], 'failed', client_id)
         return
 
-    for task in available_tasks:
-        print(f"处理任务：{task['id']}")
-        update_task_status(room_id, task['id'], 'rendering', client_id)
-        print(f"房间状态已经更改为渲染中")
-        
-        # 检查任务是否包含所需的所有键
-        required_keys = ['id', 'file_name', 'start_frame', 'end_frame']
-        if not all(key in task for key in required_keys):
-            print(f"任务 {task['id']} 缺少必要的信息。跳过此任务。")
-            print(f"任务详情：{task}")
-            continue
+    output_dir = os.path.join("render", room_id, "results", task['id'])
+    os.makedirs(output_dir, exist_ok=True)
 
-        # 使用 'file_name' 而不是 'file'
-        blend_file = os.path.join("render", room_id, "queue", task['file_name'])
-        output_dir = os.path.join("render", room_id, "results", task['id'])
-        os.makedirs(output_dir, exist_ok=True)
+    start_frame = task['start_frame']
+    end_frame = task['end_frame']
 
-        start_frame = task['start_frame']
-        end_frame = task['end_frame']
+    print(f"开始渲染 {blend_file}，帧范围：{start_frame}-{end_frame}")
+    cancel_event = threading.Event()
+    stop_heartbeat = start_heartbeat(room_id, task, client_id, cancel_event)
+    uploader = start_frame_uploader(room_id, task, client_id) if STREAM_FRAME_UPLOADS else None
+    frame_times = {}
+    try:
+        result = render_blender(blend_file, output_dir, start_frame, end_frame,
+                                on_frame=make_progress_reporter(room_id, task, client_id, frame_times),
+                                cancel_event=cancel_event,
+                                on_saved=uploader.put if uploader is not None else None,
+                                on_event=make_render_event_handler(task, frame_times),
+                                log_path=os.path.join("render", room_id, "log", "blender.log"))
+    finally:
+        stop_heartbeat.set()
+        # 等待已经写完的帧上传结束；即使渲染失败，这些帧也已保存在服务器上
+        streamed = uploader.close(FRAME_UPLOAD_DRAIN_TIMEOUT) if uploader is not None else {}
+
+    if task.get('lease_lost'):
+        print(f"任务 {task['id']} 的租约已被收回，放弃本次结果")
+        return
 
-        print(f"开始渲染 {blend_file}，帧范围：{start_frame}-{end_frame}")
-        result = render_blender(blend_file, output_dir, start_frame, end_frame)
+    # 任务可能在渲染过程中被分给其他客户端，end_frame 以服务器最新返回为准
+    end_frame = task['end_frame']
+    if isinstance(result, int) and result == end_frame:
+        print(f"任务 {task['id']} 渲染成功完成")
 
-        if isinstance(result, int) and result == end_frame:
-            print(f"任务 {task['id']} 渲染成功完成")
-            update_task_status(room_id, task['id'], 'done', client_id)
-            
-            # 准备上传文件
-            final_dir = os.path.join("render", room_id, "final")
-            # 创建final目录
-            os.makedirs(final_dir, exist_ok=True)
-            # 将渲染结果移动到final目录
-            move_results_to_final(room_id, task['id'])
-            
-            # 准备上传文件  
-            files_to_upload = [os.path.join(final_dir, f) for f in os.listdir(final_dir) if os.path.isfile(os.path.join(final_dir, f))]
-            
-            # 使用upload_batch端点上传文件
-            files = [('files', (os.path.basename(f), open(f, 'rb'))) for f in files_to_upload]
-            data = {'room_id': room_id,"task_id":task['id']}
-            response = requests.post(f"{BASE_URL}/upload_batch", files=files, data=data)
-            
-            if response.status_code == 200:
-                print(f"成功上传任务 {task['id']} 的渲染结果")
-            else:
-                print(f"上传任务 {task['id']} 的渲染结果失败：{response.text}")
+        # 只上传本任务渲染出的帧（边渲染边上传过的帧跳过），然后再移动到本地 final 目录
+        if not upload_task_results(room_id, task['id'], client_id, output_dir,
+                                   skip={os.path.basename(path) for path in streamed.values()}):
+            # 不释放租约：心跳已停止，租约过期后服务器只把没有上传的帧放回队列
+            print(f"上传任务 {task['id']} 的渲染结果失败，等待租约过期后由其他客户端重新渲染缺失的帧")
+            return
+        print(f"成功上传任务 {task['id']} 的渲染结果")
+        move_results_to_final(room_id, task['id'], task['file_name'])
 
-            
-            # 尝试下载 tasks.json
-            tasks_file_path = f"./render/{room_id}/log/tasks.json"
-            if not download_file(f"{BASE_URL}/download_tasks?room_id={room_id}", tasks_file_path):
-                print("下载 tasks.json 失败。房间可能尚未被触发。")
-            
-        else:
-            print(f"任务 {task['id']} 渲染失败")
-            update_task_status(room_id, task['id'], 'failed', client_id)
-            # 尝试下载 tasks.json
-            tasks_file_path = f"./render/{room_id}/log/tasks.json"
+        # 结果上传后再释放租约
+        complete_task(room_id, task['id'], client_id)
+
+    else:
+        print(f"任务 {task['id']} 渲染失败")
+        update_task_status(room_id, task['id'], 'failed', client_id)
+
+_calibration_seconds = None
+
+def report_calibration(room_id, client_id):
+    """渲染一次内置校准场景（每个进程只渲染一次）并上报耗时"""
+    global _calibration_seconds
+    if _calibration_seconds is None:
+        print("正在进行校准渲染...")
+        _calibration_seconds = calibration_render(os.path.join("render", "calibration"))
+        if _calibration_seconds is None:
+            return
+    try:
+        response = requests.post(f"{BASE_URL}/report_calibration", json={
+            "room_id": room_id,
+            "client_id": client_id,
+            "seconds": _calibration_seconds
+        })
+        if response.status_code != 200:
+            logging.error(f"Failed to report calibration: {response.text}")
+    except RequestException as e:
+        logging.error(f"Failed to report calibration: {e}")
+
+def pool_loop(client_id, idle_interval=HEARTBEAT_INTERVAL):
+    """登记到共享渲染池，持续领取服务器分配的任意房间的任务，按 Ctrl+C 退出"""
+    response = requests.post(f"{BASE_URL}/register_worker", json={"client_id": client_id})
+    if response.status_code != 200:
+        print(f"加入渲染池失败：{response.text}")
+        return
+    print(f"已加入渲染池，client_id: {client_id}")
+    calibrated_rooms = set()
+    try:
+        while True:
+            try:
+                response = requests.get(f"{BASE_URL}/get_pool_task", params={"client_id": client_id})
+            except RequestException as e:
+                print(f"领取任务失败：{e}")
+                time.sleep(idle_interval)
+                continue
+            if response.status_code != 200:
+                print(f"领取任务失败：{response.text}")
+                return
+            room_id, task = response.json().get("room_id"), response.json().get("task")
+            if task is None:
+                time.sleep(idle_interval)
+                continue
+            create_local_room_structure(room_id)
+            if room_id not in calibrated_rooms:
+                report_calibration(room_id, client_id)
+                calibrated_rooms.add(room_id)
+            process_task(room_id, task, client_id)
+    except KeyboardInterrupt:
+        print("退出渲染池")
+    finally:
+        requests.post(f"{BASE_URL}/unregister_worker", json={"client_id": client_id})
+
+def watch_room_events(room_id, on_event, stop):
+    """长轮询 /events/poll，把房间事件依次交给 on_event，直到 stop 被 set。
+
+    取得初始游标后会先收到一个 reset 事件，订阅方在此时拉取一次完整状态。
+    """
+    since = None
+    while not stop.is_set():
+        params = {"room_id": room_id}
+        if since is not None:
+            params["since"] = since
+        try:
+            response = requests.get(f"{BASE_URL}/events/poll", params=params, timeout=EVENT_POLL_TIMEOUT + 10)
+        except RequestException as e:
+            logging.error(f"Failed to poll room events: {e}")
+            stop.wait(HEARTBEAT_INTERVAL)
+            continue
+        if response.status_code != 200:
+            logging.error(f"Failed to poll room events: {response.text}")
+            stop.wait(HEARTBEAT_INTERVAL)
+            continue
+        body = response.json()
+        events = body["events"]
+        if since is None:
+            events = [{"id": body["last_id"], "type": "reset", "data": {}}]
+        since = body["last_id"]
+        for event in events:
+            on_event(event)
+
+def start_task_mirror(room_id):
+    """在后台根据房间事件维护本地的 tasks.json（web 界面读取它），返回用于停止的 Event"""
+    stop = threading.Event()
+    tasks_file_path = f"./render/{room_id}/log/tasks.json"
+    tasks = {}
+
+    def on_event(event):
+        if event["type"] == "reset":
             if not download_file(f"{BASE_URL}/download_tasks?room_id={room_id}", tasks_file_path):
                 print("下载 tasks.json 失败。房间可能尚未被触发。")
+                return
+            with open(tasks_file_path, 'r') as f:
+                tasks.clear()
+                tasks.update((task['id'], task) for task in json.load(f))
+        elif event["type"] == "task":
+            tasks[event["data"]["id"]] = event["data"]
+            with open(tasks_file_path, 'w') as f:
+                json.dump(list(tasks.values()), f, indent=2)
+
+    threading.Thread(target=watch_room_events, args=(room_id, on_event, stop),
+                     name=f"task-mirror-{room_id}", daemon=True).start()
+    return stop
+
+_response_cache = {}  # (路径, 查询参数) -> (ETag, 响应内容)
+
+def get_versioned(path, params):
+    """带上次的 ETag 发起 GET，房间没有变化时服务器返回 304，直接使用缓存的内容"""
+    key = (path, tuple(sorted(params.items())))
+    etag, body = _response_cache.get(key, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        response = requests.get(f"{BASE_URL}{path}", params=params, headers=headers)
+    except RequestException as e:
+        logging.error(f"Failed to get {path}: {e}")
+        return body
+    if response.status_code == 304:
+        return body
+    if response.status_code != 200:
+        return None
+    body = response.json()
+    if response.headers.get("ETag"):
+        _response_cache[key] = (response.headers["ETag"], body)
+    return body
+
+def fetch_tasks(room_id, status=None, client_id=None, file_name=None):
+    """获取房间的任务，可按状态（逗号分隔）、客户端、blend 文件过滤，自动翻页"""
+    params = {"room_id": room_id, "limit": 500}
+    for key, value in (("status", status), ("client_id", client_id), ("file_name", file_name)):
+        if value:
+            params[key] = value
+    tasks = []
+    while True:
+        body = get_versioned("/get_tasks", params)
+        if body is None:
+            return None
+        tasks.extend(body["tasks"])
+        if body.get("next_cursor") is None:
+            return tasks
+        params = dict(params, cursor=body["next_cursor"])
+
+def fetch_task_stats(room_id):
+    """按 blend 文件和客户端汇总的任务数和帧数，不需要下载任务列表"""
+    return get_versioned("/task_stats", {"room_id": room_id})
+
+def request_next_task(room_id, client_id):
+    """向服务器领取下一个任务，没有可领取的任务时返回 None"""
+    try:
+        response = requests.get(f"{BASE_URL}/get_next_task", params={"room_id": room_id, "client_id": client_id})
+    except RequestException as e:
+        print(f"领取任务失败：{e}")
+        return None
+    if response.status_code != 200:
+        print(f"领取任务失败：{response.text}")
+        return None
+    return response.json().get("task")
 
-    print("所有任务已完成。")
+def make_progress_reporter(room_id, task, client_id, frame_times=None):
+    """返回传给 render_blender 的 on_frame 回调：上报进度并取回服务器上最新的 end_frame。
+
+    frame_times 中有这一帧的渲染耗时时一并上报，服务器据此更新本机的帧率。
+    """
+    def on_frame(frame):
+        try:
+            response = requests.post(f"{BASE_URL}/task_progress", json={
+                "room_id": room_id,
+                "task_id": task['id'],
+                "client_id": client_id,
+                "last_frame": frame,
+                "frame_seconds": frame_times.pop(frame, None) if frame_times is not None else None
+            })
+        except RequestException as e:
+            logging.error(f"Failed to report progress: {e}")
+            return None
+        if response.status_code == 409:
+            # 租约已转给其他客户端，渲染完当前帧就停止
+            task['lease_lost'] = True
+            return frame
+        if response.status_code != 200:
+            logging.error(f"Failed to report progress: {response.text}")
+            return None
+        server_task = response.json()["task"]
+        if server_task['end_frame'] < task['end_frame']:
+            print(f"任务 {task['id']} 的剩余帧已分给其他客户端，新的结束帧：{server_task['end_frame']}")
+        task['end_frame'] = server_task['end_frame']
+        return task['end_frame']
+    return on_frame
+
+def make_render_event_handler(task, frame_times):
+    """返回传给 render_blender 的 on_event 回调：显示采样进度，记录每帧耗时供进度上报使用"""
+    def on_event(event):
+        if event["type"] == "progress" and event["sample"] is not None:
+            logging.debug(f"任务 {task['id']} 第 {event['frame']} 帧：采样 {event['sample']}/{event['samples']}，"
+                          f"剩余 {event['remaining']} 秒")
+        elif event["type"] == "frame_done":
+            if event["seconds"] is not None:
+                frame_times[event["frame"]] = event["seconds"]
+                print(f"任务 {task['id']} 第 {event['frame']} 帧渲染完成，耗时 {event['seconds']:.1f} 秒")
+    return on_event
+
+def start_frame_uploader(room_id, task, client_id):
+    """启动后台上传线程：Blender 每写完一帧就上传，不等整个任务渲染完。渲染日志由服务器在保存结果时记录"""
+    def upload(path):
+        with open(path, 'rb') as file:
+            response = requests.post(f"{BASE_URL}/upload_result",
+                                     files={'file': (os.path.basename(path), file)},
+                                     data={"room_id": room_id, "task_id": task['id'], "client_id": client_id,
+                                           "sha256": file_sha256(path)},
+                                     timeout=FRAME_UPLOAD_TIMEOUT)
+        return response.status_code == 200
+
+    return FrameUploader(upload)
+
+def start_heartbeat(room_id, task, client_id, cancel_event):
+    """渲染期间在后台定期续租，租约被服务器收回时 set cancel_event。返回用于停止心跳的 Event"""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                response = requests.post(f"{BASE_URL}/heartbeat", json={
+                    "room_id": room_id,
+                    "task_id": task['id'],
+                    "client_id": client_id
+                })
+            except RequestException as e:
+                logging.error(f"Heartbeat failed: {e}")
+                continue
+            if response.status_code == 409:
+                logging.warning(f"Lease of task {task['id']} was revoked, stopping render")
+                task['lease_lost'] = True
+                cancel_event.set()
+                return
+            if response.status_code == 200:
+                task['end_frame'] = min(task['end_frame'], response.json()["task"]['end_frame'])
 
+    threading.Thread(target=run, name=f"heartbeat-{task['id']}", daemon=True).start()
+    return stop
+
+def complete_task(room_id, task_id, client_id):
+    response = requests.post(f"{BASE_URL}/complete_task", json={
+        "room_id": room_id,
+        "task_id": task_id,
+        "client_id": client_id
+    })
+    if response.status_code != 200:
+        print(f"Failed to complete task: {response.text}")
+    return response.status_code
 
 def update_task_status(room_id, task_id, status, client_id):
     response = requests.post(f"{BASE_URL}/update_task", json={
@@ -392,12 +681,63 @@ def update_task_status(room_id, task_id, status, client_id):
         print(f"Failed to update task status: {response.text}")
     return response.status_code
 
-def move_results_to_final(room_id, task_id):
+def move_results_to_final(room_id, task_id, blend_file=None):
+    """把任务的结果移动到本地 final/<blend 文件名>/，与服务器上的结果路径一致"""
     source_dir = os.path.join("render", room_id, "results", task_id)
-    target_dir = os.path.join("render", room_id, "final")
-    os.makedirs(target_dir, exist_ok=True)
+    final_dir = os.path.join("render", room_id, "final")
     for file in os.listdir(source_dir):
-        shutil.move(os.path.join(source_dir, file), os.path.join(target_dir, file))
+        target = os.path.join(final_dir, result_path(file, blend_file))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(os.path.join(source_dir, file), target)
+
+def upload_task_results(room_id, task_id, client_id, results_dir, retries=3, skip=()):
+    """把一个任务的结果作为一个流式批次上传，附带每个文件的 SHA-256。
+
+    服务器逐个文件确认；失败重试前先查询任务清单，已保存且校验和一致的文件不再重传。
+    skip 是已经确认上传过的文件名。
+    """
+    paths = [os.path.join(results_dir, f) for f in sorted(os.listdir(results_dir))
+             if os.path.isfile(os.path.join(results_dir, f)) and f not in skip]
+    checksums = {os.path.basename(path): file_sha256(path) for path in paths}
+    pending = paths
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(5)
+            try:
+                response = requests.get(f"{BASE_URL}/task_manifest", params={"room_id": room_id, "task_id": task_id})
+                stored = response.json()["files"] if response.status_code == 200 else {}
+            except RequestException:
+                stored = {}
+            pending = [path for path in pending
+                       if stored.get(os.path.basename(path), {}).get("sha256") != checksums[os.path.basename(path)]]
+        if not pending:
+            return True
+        body = MultipartStream({"room_id": room_id, "task_id": task_id, "client_id": client_id,
+                                "checksums": json.dumps({os.path.basename(path): checksums[os.path.basename(path)]
+                                                         for path in pending})},
+                               [("files", path) for path in pending])
+        try:
+            response = requests.post(f"{BASE_URL}/upload_batch", data=body,
+                                     headers={"Content-Type": body.content_type})
+        except RequestException as e:
+            print(f"上传任务 {task_id} 的结果中断：{str(e)}")
+            continue
+        finally:
+            body.close()
+        if response.status_code == 404:
+            # 任务已不在房间中（例如 blend 文件被移除），重试也不会被接受
+            print(f"任务 {task_id} 已不存在，放弃上传：{response.text}")
+            return False
+        if response.status_code != 200:
+            print(f"上传任务 {task_id} 的结果失败：{response.text}")
+            continue
+        acks = response.json().get("acks", {})
+        pending = [path for path in pending
+                   if acks.get(os.path.basename(path), {}).get("status") not in ("stored", "exists", "duplicate")]
+        if not pending:
+            return True
+        print(f"{len(pending)} 个文件未被服务器确认，重试 ({attempt + 1}/{retries})")
+    return False
 
 def upload_results(room_id, task_id):
     final_dir = os.path.join("render", room_id, "final")
@@ -432,20 +772,20 @@ def download_render_results(room_id):
     logging.info(f"Downloading render results for room {room_id}")
     
     # 获取服务器上 final 文件夹中的文件列表
-    response = requests.get(f"{BASE_URL}/list_final_files", params={"room_id": room_id})
+    response = requests.get(f"{BASE_URL}/list_final_files", params={"room_id": room_id, "details": 1})
     if response.status_code != 200:
         logging.error("Failed to get final files list from server")
         return
     
-    server_files = response.json()["files"]
+    # 服务器索引中的路径形如 <blend 文件名>/frame_0001.png
+    server_entries = response.json().get("entries") or {f: {} for f in response.json()["files"]}
     
-    # 检查本地 final 文件夹中的文件
+    # 本地已有且大小一致的文件不再下载
     local_final_dir = os.path.join("render", room_id, "final")
     os.makedirs(local_final_dir, exist_ok=True)
-    local_files = set(os.listdir(local_final_dir))
-    
-    # 确需要下载的文件
-    files_to_download = [f for f in server_files if f not in local_files]
+    files_to_download = [path for path, entry in sorted(server_entries.items())
+                         if not os.path.exists(os.path.join(local_final_dir, path))
+                         or ("size" in entry and os.path.getsize(os.path.join(local_final_dir, path)) != entry["size"])]
     
     # 下载缺失的文件
     for file in files_to_download:
@@ -456,20 +796,14 @@ def download_render_results(room_id):
         else:
             logging.error(f"Failed to download {file}")
     
-    # 检查任务状态
-    response = requests.get(f"{BASE_URL}/get_tasks", params={"room_id": room_id})
-    if response.status_code != 200:
+    # 只查询未完成的任务，推测执行中落败被取消的副本不计入
+    missing_tasks = fetch_tasks(room_id, status="triggered,rendering,failed")
+    if missing_tasks is None:
         logging.error("Failed to get tasks from server")
         return
     
-    tasks = response.json()["tasks"]
-    
-    # 检查任务状态
-    all_done = all(task["status"] == "done" for task in tasks)
-    missing_tasks = [task for task in tasks if task["status"] != "done"]
-    
     result = {
-        "result": "done" if all_done else "incomplete",
+        "result": "incomplete" if missing_tasks else "done",
         "missing": {task["id"]: task["status"] for task in missing_tasks}
     }
     
@@ -512,7 +846,8 @@ def main():
     print("1. Create a room")
     print("2. Join a room")
     print("3. Load a room")
-    choice = input("Enter your choice (1, 2, or 3): ")
+    print("4. Join the worker pool")
+    choice = input("Enter your choice (1, 2, 3, or 4): ")
 
     if choice == "1":
         room_id, client_id = create_room()
@@ -532,6 +867,8 @@ def main():
             client_id = f"loader_{int(time.time())}"
             requests.post(f"{BASE_URL}/join_room", json={"room_id": room_id, "client_id": client_id})
             handle_room_actions(room_id, client_id)
+    elif choice == "4":
+        pool_loop(get_client_id())
     else:
         print("Invalid choice")
 
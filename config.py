@@ -19,6 +19,64 @@ IS_SERVER = platform.system() == "Linux"  # 假设服务器运行在 Linux 上
 UPLOAD_FOLDER = user_config['UPLOAD_FOLDER']
 ROOMS_FOLDER = user_config['ROOMS_FOLDER']
 
+# 按内容寻址的 blend 文件存储，各房间 queue 目录中的文件是指向这里的硬链接，需与 ROOMS_FOLDER 在同一文件系统
+BLOB_FOLDER = user_config.get('BLOB_FOLDER', os.path.join(ROOMS_FOLDER, "blobs"))
+
+# 任务租约时长（秒），客户端渲染期间每 HEARTBEAT_INTERVAL 秒发送心跳续约；
+# 服务器每 REAPER_INTERVAL 秒把租约过期的任务放回待渲染队列
+TASK_LEASE_SECONDS = user_config.get('TASK_LEASE_SECONDS', 90)
+HEARTBEAT_INTERVAL = user_config.get('HEARTBEAT_INTERVAL', 15)
+REAPER_INTERVAL = user_config.get('REAPER_INTERVAL', 10)
+
+# 推测执行：队列为空时为最慢的任务启动副本，先完成者胜出。可在创建房间时按房间开启
+SPECULATIVE_EXECUTION = user_config.get('SPECULATIVE_EXECUTION', False)
+
+# 共享渲染池：登记到池中的客户端可以领取任意渲染中房间的任务。
+# 按 "room"（每个房间）或 "owner"（房主名下所有房间）计算加权公平份额
+FAIR_SHARE_BY = user_config.get('FAIR_SHARE_BY', 'room')
+
+# 任务排序：最早截止时间优先；待领取任务每等待 TASK_AGING_SECONDS 秒优先级加一，
+# 等待超过 TASK_MAX_WAIT_SECONDS 秒的任务排到最前面
+TASK_AGING_SECONDS = user_config.get('TASK_AGING_SECONDS', 600)
+TASK_MAX_WAIT_SECONDS = user_config.get('TASK_MAX_WAIT_SECONDS', 3600)
+
+# /events：SSE 连接每隔 EVENT_KEEPALIVE_SECONDS 秒发送一次保活注释；长轮询最多等待 EVENT_POLL_TIMEOUT 秒
+EVENT_KEEPALIVE_SECONDS = user_config.get('EVENT_KEEPALIVE_SECONDS', 15)
+EVENT_POLL_TIMEOUT = user_config.get('EVENT_POLL_TIMEOUT', 25)
+
+# 任务切块：每块的目标耗时、最小耗时（秒），以及没有实测数据时的单帧耗时估计
+CHUNK_TARGET_SECONDS = user_config.get('CHUNK_TARGET_SECONDS', 300)
+CHUNK_MIN_SECONDS = user_config.get('CHUNK_MIN_SECONDS', 60)
+DEFAULT_SECONDS_PER_FRAME = user_config.get('DEFAULT_SECONDS_PER_FRAME', 30)
+
+# 每个客户端每个 blend 文件的渲染速度按指数滑动平均统计，新样本的权重
+THROUGHPUT_SMOOTHING = user_config.get('THROUGHPUT_SMOOTHING', 0.3)
+
+# 分块上传：每块大小（字节）、客户端并行上传的块数，以及未完成的上传会话保留多久（秒）
+UPLOAD_CHUNK_SIZE = user_config.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+UPLOAD_PARALLELISM = user_config.get('UPLOAD_PARALLELISM', 4)
+UPLOAD_SESSION_TTL = user_config.get('UPLOAD_SESSION_TTL', 24 * 3600)
+
+# 渲染时每写完一帧立即在后台上传，而不是等整个任务渲染完再上传
+STREAM_FRAME_UPLOADS = user_config.get('STREAM_FRAME_UPLOADS', True)
+# 单个结果文件上传请求的超时（秒）；任务渲染结束后最多等待后台上传多久，超时未上传的帧随任务结果一起补传
+FRAME_UPLOAD_TIMEOUT = user_config.get('FRAME_UPLOAD_TIMEOUT', 300)
+FRAME_UPLOAD_DRAIN_TIMEOUT = user_config.get('FRAME_UPLOAD_DRAIN_TIMEOUT', 600)
+
+# Blender 原始输出写入按大小轮转的日志文件（单个文件字节数、保留的旧文件数），内存中只保留最后若干行用于报错
+BLENDER_LOG_MAX_BYTES = user_config.get('BLENDER_LOG_MAX_BYTES', 10 * 1024 * 1024)
+BLENDER_LOG_BACKUPS = user_config.get('BLENDER_LOG_BACKUPS', 3)
+BLENDER_LOG_TAIL_LINES = user_config.get('BLENDER_LOG_TAIL_LINES', 200)
+
+# 状态变化先追加到每个房间的 journal，再按此间隔（秒）折叠成快照；读请求全部由内存提供
+STATE_FLUSH_DELAY = user_config.get('STATE_FLUSH_DELAY', 10.0)
+
+# journal 批量 fsync 的间隔（秒）
+JOURNAL_FSYNC_INTERVAL = user_config.get('JOURNAL_FSYNC_INTERVAL', 0.05)
+
+# 状态存储后端："json"（ROOMS_FOLDER 下的 JSON 文件）或 "sqlite"（ROOMS_FOLDER/state.db）
+STATE_BACKEND = user_config.get('STATE_BACKEND', 'json')
+
 # CONFIG程序处理
 BLENDER_PATH = get_blender_path()
 BLENDER_PYTHON_PATH = get_blender_python_path()
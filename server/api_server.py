@@ -4,18 +4,23 @@
 
 import sys
 import os
-import shutil
 
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, request, send_file, jsonify
-from utils.room_manager import RoomManager
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context, make_response
+from utils.room_manager import RoomManager, TaskConflictError
+from utils.blender_output import frame_number_from_filename
+from utils.zip_stream import stream_zip, parse_frame_ranges, frame_in_ranges
+from utils.checksum import file_sha256
+from utils.upload_session import UploadSessionStore, IncompleteUploadError
+from utils.blob_store import BlobStore
+from utils.result_store import ResultStore, result_path, valid_task_id
+from utils.schedule import deadline_timestamp
 import random
+import hashlib
 import string
-import io
-import zipfile
-import os
+import atexit
 import logging
 import json
 from werkzeug.utils import secure_filename
@@ -23,9 +28,14 @@ from datetime import datetime
 
 app = Flask(__name__)
 room_manager = RoomManager()
+room_manager.start_reaper()
+upload_sessions = UploadSessionStore()
+blob_store = BlobStore()
+result_store = ResultStore()
+atexit.register(result_store.close)
 
 # 调用config.py中的UPLOAD_FOLDER和ROOMS_FOLDER
-from config import UPLOAD_FOLDER, ROOMS_FOLDER
+from config import UPLOAD_FOLDER, ROOMS_FOLDER, EVENT_KEEPALIVE_SECONDS, EVENT_POLL_TIMEOUT
 
 def generate_room_id():
     return ''.join(random.choices(string.digits, k=6))
@@ -44,6 +54,16 @@ def create_room():
             "members": [{"id": client_id, "order": 0}],  # 确保这行存在
             "blender_files": []
         }
+        if 'speculative' in request.json:
+            room_settings['speculative'] = bool(request.json['speculative'])
+        # 共享渲染池中的调度参数：优先级、公平份额权重、是否接受池中的客户端
+        for key, cast in (('priority', int), ('share_weight', float), ('pool', bool)):
+            if key in request.json:
+                room_settings[key] = cast(request.json[key])
+        if 'deadline' in request.json:
+            # 截止时间可以是 ISO 8601 字符串或 Unix 时间戳，原样保存，格式错误时返回 400
+            deadline_timestamp(request.json['deadline'])
+            room_settings['deadline'] = request.json['deadline']
         room_manager.create_room(room_id, room_settings)
         return jsonify({"success": True, "room_id": room_id})
     except ValueError as e:
@@ -67,20 +87,43 @@ def join_room():
         return jsonify({"success": False, "error": str(e)}), 400
     
 
+def room_etag(room_id, version, variant=None):
+    """variant 区分同一房间版本下不同查询的结果（例如 /get_tasks 的过滤和分页参数）"""
+    if variant:
+        return f"{room_id}-{version}-{variant}"
+    return f"{room_id}-{version}"
+
+def not_modified(room_id, version, variant=None):
+    """If-None-Match 与房间当前版本一致时返回 304 响应，否则返回 None"""
+    etag = room_etag(room_id, version, variant)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def versioned_json(room_id, version, payload, variant=None):
+    response = jsonify(payload)
+    response.set_etag(room_etag(room_id, version, variant))
+    response.headers['X-Room-Version'] = str(version)
+    return response
+
 @app.route('/download_room_settings', methods=['GET'])
 def download_room_settings():
     room_id = request.args.get('room_id')
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    room_settings_path = os.path.join(ROOMS_FOLDER, room_id, "log", "room_settings.json")
-    if not os.path.exists(room_settings_path):
+    try:
+        version = room_manager.room_version(room_id)
+        cached = not_modified(room_id, version)
+        if cached is not None:
+            return cached
+        room_settings = room_manager.get_room_settings(room_id)
+    except ValueError:
         return jsonify({"error": "Room settings file not found"}), 404
     
-    with open(room_settings_path, 'r') as f:
-        room_settings = json.load(f)
-    
-    return jsonify(room_settings)
+    return versioned_json(room_id, version, room_settings)
 
 
 @app.route('/download_tasks', methods=['GET'])
@@ -89,11 +132,30 @@ def download_tasks():
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    tasks_file_path = os.path.join(ROOMS_FOLDER, room_id, "log", "tasks.json")
-    if not os.path.exists(tasks_file_path):
+    try:
+        version, tasks = room_manager.get_tasks_versioned(room_id)
+    except ValueError:
+        return jsonify({"error": "Tasks file not found"}), 404
+    if not tasks:
         return jsonify({"error": "Tasks file not found"}), 404
+    cached = not_modified(room_id, version)
+    if cached is not None:
+        return cached
     
-    return send_file(tasks_file_path, as_attachment=True)
+    return versioned_json(room_id, version, tasks)
+
+@app.route('/tasks/changes', methods=['GET'])
+def task_changes():
+    """返回版本号 since 之后变化过的任务；reset 为 true 时 tasks 是完整列表"""
+    room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+    try:
+        since = int(request.args.get('since', 0))
+        changes = room_manager.get_task_changes(room_id, since)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return versioned_json(room_id, changes['version'], dict(changes, success=True))
 
 @app.route('/leave_room', methods=['POST'])
 def leave_room():
@@ -121,14 +183,8 @@ def add_blend_file():
         
         file_settings = render_settings[file_name]
         
-        blender_file_info = {
-            "file_name": file_name,
-            "upload_order": len(room_settings["blender_files"]),
-            "render_settings": file_settings
-        }
-        room_settings["blender_files"].append(blender_file_info)
-        
-        room_manager.update_room_settings(room_id, room_settings)
+        room_manager.add_blend_file(room_id, file_name, file_settings,
+                                    request.json.get('priority'), request.json.get('deadline'))
         return jsonify({"success": True})
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
@@ -136,15 +192,31 @@ def add_blend_file():
         app.logger.error(f"Unexpected error in add_blend_file: {str(e)}")
         return jsonify({"success": False, "error": "An unexpected error occurred"}), 500
 
+@app.route('/set_schedule', methods=['POST'])
+def set_schedule():
+    room_id = request.json['room_id']
+    try:
+        schedule = room_manager.set_schedule(room_id, request.json.get('file_name'),
+                                             request.json.get('priority'), request.json.get('deadline'))
+        return jsonify({"success": True, "priority": schedule.get('priority'), "deadline": schedule.get('deadline')})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
 @app.route('/remove_blend_file', methods=['POST'])
 def remove_blend_file():
     room_id = request.json['room_id']
     file_name = request.json['file_name']
     try:
         room_manager.remove_blend_file(room_id, file_name)
-        return jsonify({"success": True})
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
+    # 房间中已经没有这个文件，删除 queue 中的硬链接并释放对 blob 的引用（最后一个引用释放时删除 blob）
+    file_name = os.path.basename(file_name)
+    queue_path = os.path.join(ROOMS_FOLDER, room_id, "queue", file_name)
+    if os.path.exists(queue_path):
+        os.remove(queue_path)
+    refs = blob_store.release(room_id, file_name)
+    return jsonify({"success": True, "blob_refs": refs})
 
 @app.route('/get_next_task', methods=['GET'])
 def get_next_task():
@@ -156,16 +228,140 @@ def get_next_task():
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+@app.route('/register_worker', methods=['POST'])
+def register_worker():
+    client_id = request.json['client_id']
+    worker = room_manager.register_worker(client_id)
+    return jsonify({"success": True, "worker": worker})
+
+@app.route('/unregister_worker', methods=['POST'])
+def unregister_worker():
+    room_manager.unregister_worker(request.json['client_id'])
+    return jsonify({"success": True})
+
+@app.route('/get_pool_task', methods=['GET'])
+def get_pool_task():
+    client_id = request.args.get('client_id')
+    try:
+        room_id, task = room_manager.get_next_pool_task(client_id)
+        return jsonify({"success": True, "room_id": room_id, "task": task})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
 @app.route('/complete_task', methods=['POST'])
 def complete_task():
     room_id = request.json['room_id']
     task_id = request.json['task_id']
+    client_id = request.json.get('client_id')
     try:
-        room_manager.complete_task(room_id, task_id)
+        # 按清单核对结果，缺帧时不完成任务：租约过期后回收任务只会重新排队没有上传的帧
+        manifest = result_store.check_task(room_id, room_manager.get_task(room_id, task_id))
+        if manifest["missing_frames"]:
+            return jsonify({"success": False, "error": "Results are missing for some frames",
+                            "manifest": manifest}), 409
+        room_manager.complete_task(room_id, task_id, client_id)
+        return jsonify({"success": True, "manifest": manifest})
+    except TaskConflictError as e:
+        return jsonify({"success": False, "error": str(e), "task": e.task}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/task_progress', methods=['POST'])
+def task_progress():
+    room_id = request.json['room_id']
+    task_id = request.json['task_id']
+    client_id = request.json['client_id']
+    last_frame = request.json['last_frame']
+    try:
+        task = room_manager.report_progress(room_id, task_id, client_id, last_frame, request.json.get('frame_seconds'))
+        return jsonify({"success": True, "task": task})
+    except TaskConflictError as e:
+        return jsonify({"success": False, "error": str(e), "task": e.task}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    room_id = request.json['room_id']
+    task_id = request.json['task_id']
+    client_id = request.json['client_id']
+    last_frame = request.json.get('last_frame')
+    try:
+        task = room_manager.heartbeat(room_id, task_id, client_id, last_frame)
+        return jsonify({"success": True, "task": task})
+    except TaskConflictError as e:
+        return jsonify({"success": False, "error": str(e), "task": e.task}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+@app.route('/report_calibration', methods=['POST'])
+def report_calibration():
+    room_id = request.json['room_id']
+    client_id = request.json['client_id']
+    seconds = request.json['seconds']
+    try:
+        room_manager.report_calibration(room_id, client_id, seconds)
         return jsonify({"success": True})
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+def record_uploaded_frame(room_id, task_id, filename):
+    """记录已上传的帧，租约过期回收任务时这些帧不会重新渲染。
+
+    返回 False 表示这一帧已由推测执行的另一方上传、已不在本任务的范围内（或本任务已被取消），不需要再保存。
+    """
+    frame = frame_number_from_filename(filename)
+    if room_id and task_id and frame is not None:
+        try:
+            return room_manager.record_result(room_id, task_id, frame)
+        except ValueError as e:
+            app.logger.warning(f"Failed to record uploaded frame {filename}: {str(e)}")
+    return True
+
+def record_render_log(room_id, task_id, client_id, entry):
+    """结果保存后在服务器端直接记入渲染日志，客户端不需要为每一帧再发一次请求"""
+    if entry["frame"] is None or not entry.get("blend_file"):
+        return
+    try:
+        room_manager.update_render_log(room_id, {"frame": entry["frame"], "task_id": task_id,
+                                                 "client": client_id, "blend_file": entry["blend_file"]})
+    except ValueError as e:
+        app.logger.warning(f"Failed to update render log for {entry['path']}: {str(e)}")
+
+def store_result(room_id, task_id, file, client_id=None, sha256=None):
+    """把上传的结果写入 final/<blend 文件>/ 并记入清单和索引，返回对这个文件的确认。
+
+    status 为 stored（已保存）、exists（服务器已有校验和相同的文件，未重复写入）、
+    duplicate（推测执行的另一方已上传这一帧、这一帧已被其他客户端窃取或本任务已被取消，未保存）、checksum_mismatch（内容与校验和不符，未保存）
+    或 not_found（房间中没有这个任务，未保存）。
+    先接收到临时文件并校验，再记录已上传的帧，只有被接受的帧才就位，落败方不会覆盖先完成的一方。
+    """
+    file_name = secure_filename(file.filename)
+    if not valid_task_id(task_id):
+        return {"status": "not_found", "error": f"Invalid task id: {task_id!r}"}
+    try:
+        blend_file = room_manager.get_task(room_id, task_id)['file_name']
+    except ValueError as e:
+        return {"status": "not_found", "error": str(e)}
+    existing = result_store.get(room_id, result_path(file_name, blend_file))
+    if sha256 and existing is not None and existing["sha256"] == sha256.lower():
+        if record_uploaded_frame(room_id, task_id, file_name):
+            record_render_log(room_id, task_id, client_id, existing)
+        return {"status": "exists", "path": existing["path"], "sha256": existing["sha256"]}
+    try:
+        staged = result_store.receive(room_id, file_name, file.stream, blend_file, sha256)
+    except ValueError as e:
+        return {"status": "checksum_mismatch", "error": str(e)}
+    ack = {"path": staged["path"], "sha256": staged["sha256"], "size": staged["size"]}
+    if not record_uploaded_frame(room_id, task_id, file_name):
+        result_store.discard(staged)
+        return dict(ack, status="duplicate")
+    entry = result_store.commit(staged, task_id, client_id)
+    record_render_log(room_id, task_id, client_id, entry)
+    room_manager.events.publish(room_id, 'result', {"file_name": entry["file_name"], "path": entry["path"],
+                                                    "task_id": task_id})
+    return dict(ack, status="stored")
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -179,10 +375,95 @@ def upload_file():
         upload_dir = os.path.join(ROOMS_FOLDER, room_id, "queue" if filename.endswith('.blend') else "log")
         os.makedirs(upload_dir, exist_ok=True)
         file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+        if filename.endswith('.blend'):
+            # queue 中的 blend 文件是共享 blob 的硬链接，不能原地覆盖写入
+            tmp_path = f"{file_path}.upload.tmp"
+            file.save(tmp_path)
+            blob_store.adopt(room_id, filename, tmp_path, upload_dir)
+        else:
+            file.save(file_path)
         return jsonify({"message": "File uploaded successfully", "path": file_path}), 200
     return jsonify({"error": "Invalid request"}), 400
 
+# 分块上传：initiate -> PUT 各分块（可并行、可重传）-> 查询缺失分块 -> commit 校验并拼接
+@app.route('/upload_session', methods=['POST'])
+def initiate_upload():
+    room_id = request.json.get('room_id')
+    file_name = secure_filename(request.json.get('file_name') or '')
+    if not room_id or not file_name or 'size' not in request.json:
+        return jsonify({"error": "room_id, file_name and size are required"}), 400
+    try:
+        room_manager.get_room_settings(room_id)
+    except ValueError:
+        return jsonify({"error": "Room not found"}), 404
+    try:
+        session = upload_sessions.create(room_id, file_name, request.json['size'], request.json.get('chunk_size'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(session), 200
+
+@app.route('/blobs/link', methods=['POST'])
+def link_blob():
+    """按 SHA-256 引用服务器上已有的 blend 文件，命中时不需要再上传；404 表示需要上传"""
+    room_id = request.json.get('room_id')
+    file_name = secure_filename(request.json.get('file_name') or '')
+    sha256 = (request.json.get('sha256') or '').lower()
+    if not room_id or not file_name.endswith('.blend') or not sha256:
+        return jsonify({"error": "room_id, a .blend file_name and sha256 are required"}), 400
+    try:
+        room_manager.get_room_settings(room_id)
+    except ValueError:
+        return jsonify({"error": "Room not found"}), 404
+    try:
+        path = blob_store.link(room_id, file_name, sha256, os.path.join(ROOMS_FOLDER, room_id, "queue"))
+    except KeyError:
+        return jsonify({"error": "Blob not found"}), 404
+    return jsonify({"message": "File linked", "path": path, "refs": blob_store.refcount(sha256)}), 200
+
+@app.route('/upload_session/<upload_id>', methods=['GET'])
+def upload_session_status(upload_id):
+    try:
+        return jsonify(upload_sessions.get(request.args.get('room_id', ''), upload_id)), 200
+    except KeyError:
+        return jsonify({"error": "Upload session not found"}), 404
+
+@app.route('/upload_session/<upload_id>/chunk/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        size = upload_sessions.write_chunk(request.args.get('room_id', ''), upload_id, index, request.stream,
+                                           request.headers.get('X-Checksum-SHA256'))
+    except KeyError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"index": index, "size": size}), 200
+
+@app.route('/upload_session/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    room_id = request.json.get('room_id', '')
+    try:
+        session = upload_sessions.get(room_id, upload_id)
+        is_blend = session["file_name"].endswith('.blend')
+        target_dir = os.path.join(ROOMS_FOLDER, room_id, "queue" if is_blend else "log")
+        file_path = upload_sessions.commit(room_id, upload_id, target_dir, request.json.get('sha256'))
+        if is_blend:
+            blob_store.adopt(room_id, session["file_name"], file_path, target_dir, request.json.get('sha256'))
+    except KeyError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except IncompleteUploadError as e:
+        return jsonify({"error": str(e), "missing": e.missing}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": "File uploaded successfully", "path": file_path}), 200
+
+@app.route('/upload_session/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    try:
+        upload_sessions.abort(request.args.get('room_id', ''), upload_id)
+    except KeyError:
+        return jsonify({"error": "Upload session not found"}), 404
+    return jsonify({"success": True}), 200
+
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     return send_file(os.path.join(UPLOAD_FOLDER, filename), as_attachment=True)
@@ -195,14 +476,36 @@ def upload_batch():
     if not files:
         return 'No selected files', 400
     
-    uploaded_files = []
+    room_id = request.form.get('room_id')
+    task_id = request.form.get('task_id')
+    if not (room_id and task_id):
+        for file in files:
+            if file.filename:
+                file.save(os.path.join(UPLOAD_FOLDER, secure_filename(file.filename)))
+        return jsonify({'message': 'Files uploaded successfully', 'files': [f.filename for f in files if f.filename]}), 200
+    
+    # checksums 是 {文件名: SHA-256} 的 JSON，每个文件单独确认，客户端重试时只重传没有确认的文件
+    try:
+        checksums = json.loads(request.form.get('checksums') or '{}')
+    except ValueError:
+        return jsonify({"error": "Invalid checksums"}), 400
+    acks = {}
     for file in files:
         if file.filename:
-            filename = os.path.join(UPLOAD_FOLDER, file.filename)
-            file.save(filename)
-            uploaded_files.append(file.filename)
+            acks[file.filename] = store_result(room_id, task_id, file, request.form.get('client_id'),
+                                               checksums.get(file.filename))
+            if acks[file.filename]['status'] == 'not_found':
+                # 任务不存在时同一批的文件都不会被接受
+                return jsonify({'error': acks[file.filename]['error']}), 404
     
-    return jsonify({'message': 'Files uploaded successfully', 'files': uploaded_files}), 200
+    return jsonify({'message': 'Files uploaded successfully', 'acks': acks,
+                    'files': [name for name, ack in acks.items() if ack['status'] == 'stored'],
+                    'duplicates': [name for name, ack in acks.items() if ack['status'] == 'duplicate']}), 200
+
+def zip_response(entries, download_name):
+    """以流的方式返回 ZIP，文件边读边发送，不在内存中生成整个压缩包"""
+    return Response(stream_with_context(stream_zip(entries)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={download_name}'})
 
 @app.route('/download_batch', methods=['POST'])
 def download_batch():
@@ -210,15 +513,9 @@ def download_batch():
     if not filenames:
         return 'No files specified', 400
     
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w') as zf:
-        for filename in filenames:
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            if os.path.exists(file_path):
-                zf.write(file_path, filename)
-    
-    memory_file.seek(0)
-    return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name='batch_download.zip')
+    entries = [(os.path.join(UPLOAD_FOLDER, filename), filename) for filename in filenames
+               if os.path.exists(os.path.join(UPLOAD_FOLDER, filename))]
+    return zip_response(entries, 'batch_download.zip')
 
 @app.route('/start_rendering', methods=['POST'])
 def start_rendering():
@@ -257,23 +554,33 @@ def upload_result():
         return jsonify({"success": False, "error": "No selected file"}), 400
     if file:
         try:
-            # 首先保存到 results 文件夹
-            results_dir = os.path.join(ROOMS_FOLDER, room_id, "results", task_id)
-            os.makedirs(results_dir, exist_ok=True)
-            temp_filename = os.path.join(results_dir, file.filename)
-            file.save(temp_filename)
-
-            # 然后移动到 final 文件夹
-            final_dir = os.path.join(ROOMS_FOLDER, room_id, "final")
-            os.makedirs(final_dir, exist_ok=True)
-            final_filename = os.path.join(final_dir, file.filename)
-            shutil.move(temp_filename, final_filename)
-
-            return jsonify({"success": True, "message": "Result file uploaded and moved to final folder successfully"}), 200
+            # 直接写入 final 目录（临时文件 + 原子重命名），并记入任务清单
+            ack = store_result(room_id, task_id, file, request.form.get('client_id'), request.form.get('sha256'))
+            if ack["status"] == "checksum_mismatch":
+                return jsonify({"success": False, "error": ack["error"]}), 400
+            if ack["status"] == "not_found":
+                return jsonify({"success": False, "error": ack["error"]}), 404
+            if ack["status"] == "duplicate":
+                # 推测执行的另一方已经上传过这一帧
+                return jsonify({"success": True, "duplicate": True, "message": "Frame already uploaded"}), 200
+
+            return jsonify({"success": True, "message": "Result file uploaded successfully", "file": ack}), 200
         except Exception as e:
             app.logger.error(f"Error processing uploaded file: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/task_manifest', methods=['GET'])
+def task_manifest():
+    """任务已保存的结果 {文件名: {path, size, sha256, ...}}，客户端重试上传前用它跳过已保存的文件"""
+    room_id = request.args.get('room_id')
+    task_id = request.args.get('task_id')
+    if not room_id or not task_id:
+        return jsonify({"error": "Missing room_id or task_id"}), 400
+    try:
+        return jsonify({"files": result_store.manifest(room_id, task_id)}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/update_render_log', methods=['POST'])
 def update_render_log():
     room_id = request.json['room_id']
@@ -281,15 +588,33 @@ def update_render_log():
     try:
         room_manager.update_render_log(room_id, frame_info)
         return jsonify({"success": True})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         app.logger.error(f"Error updating render log: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/update_render_log_batch', methods=['POST'])
+def update_render_log_batch():
+    room_id = request.json['room_id']
+    frames = request.json.get('frames', [])
+    if not isinstance(frames, list):
+        return jsonify({"success": False, "error": "frames must be a list"}), 400
+    try:
+        added = room_manager.update_render_log_batch(room_id, frames)
+        return jsonify({"success": True, "added": added})
+    except (ValueError, KeyError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
 @app.route('/get_render_log', methods=['GET'])
 def get_render_log():
     room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+    blend_file = request.args.get('blend_file')
+    include_runs = request.args.get('runs', '1') != '0'
     try:
-        render_log = room_manager.get_render_log(room_id)
+        render_log = room_manager.get_render_log(room_id, blend_file, include_runs)
         return jsonify(render_log)
     except Exception as e:
         app.logger.error(f"Error getting render log: {str(e)}")
@@ -315,30 +640,89 @@ def update_task():
     task_id = request.json['task_id']
     status = request.json['status']
     client_id = request.json['client_id']
+    expected_version = request.json.get('expected_version')
     try:
-        room_manager.update_task(room_id, task_id, status, client_id)
-        
-        # 如果任务状态为 'done'，确保所有相关文件都被移动到 final 文件夹
+        # 结果在上传时已经写入 final，完成时按清单核对帧是否齐全，缺帧时拒绝
         if status == 'done':
-            results_dir = os.path.join(ROOMS_FOLDER, room_id, "results", task_id)
-            final_dir = os.path.join(ROOMS_FOLDER, room_id, "final")
-            os.makedirs(final_dir, exist_ok=True)
-            
-            for file in os.listdir(results_dir):
-                src = os.path.join(results_dir, file)
-                dst = os.path.join(final_dir, file)
-                shutil.move(src, dst)
-            
-            # 可选：删除空的 results 子文件夹
-            shutil.rmtree(results_dir)
-        
-        return jsonify({"success": True})
+            manifest = result_store.check_task(room_id, room_manager.get_task(room_id, task_id))
+            if manifest["missing_frames"]:
+                return jsonify({"success": False, "error": "Results are missing for some frames",
+                                "manifest": manifest}), 409
+            task = room_manager.update_task(room_id, task_id, status, client_id, expected_version)
+            return jsonify({"success": True, "task": task, "manifest": manifest})
+
+        task = room_manager.update_task(room_id, task_id, status, client_id, expected_version)
+        return jsonify({"success": True, "task": task})
+    except TaskConflictError as e:
+        return jsonify({"success": False, "error": str(e), "task": e.task}), 409
     except ValueError as e:
         return jsonify({"success": False, "error": str(e)}), 400
 
+def parse_event_id(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+@app.route('/events', methods=['GET'])
+def events():
+    """Server-Sent Events：推送房间内的任务变化、成员加入、状态变化和新的结果文件。
+
+    断线重连时浏览器会带上 Last-Event-ID，也可以用 ?since= 指定；
+    收到 reset 事件时应重新拉取完整的任务列表。
+    """
+    room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+    try:
+        room_manager.get_room_settings(room_id)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    last_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    if last_id is None:
+        last_id = room_manager.events.last_id(room_id)
+
+    def stream():
+        nonlocal last_id
+        yield f"retry: 3000\nid: {last_id}\n\n"
+        while True:
+            batch = room_manager.events.wait(room_id, last_id, EVENT_KEEPALIVE_SECONDS)
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+            for event in batch:
+                last_id = event['id']
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/events/poll', methods=['GET'])
+def poll_events():
+    """长轮询：返回序号大于 since 的事件，没有新事件时最多等待 timeout 秒"""
+    room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+    try:
+        room_manager.get_room_settings(room_id)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    since = parse_event_id(request.args.get('since'))
+    try:
+        timeout = min(float(request.args.get('timeout', EVENT_POLL_TIMEOUT)), EVENT_POLL_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "Invalid timeout"}), 400
+    if since is None:
+        # 首次请求只返回当前序号，之后用它继续轮询
+        return jsonify({"success": True, "events": [], "last_id": room_manager.events.last_id(room_id)})
+    batch = room_manager.events.wait(room_id, since, timeout)
+    return jsonify({"success": True, "events": batch, "last_id": batch[-1]['id'] if batch else since})
+
 @app.route('/room_status', methods=['GET'])
 def room_status():
     room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
     try:
         status = room_manager.get_room_status(room_id)
         return jsonify(status)
@@ -349,6 +733,13 @@ def room_status():
         app.logger.error(f"Unexpected error getting room status: {str(e)}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
+def send_file_resumable(path, sha256=None):
+    """发送文件并支持 Range 请求（206 部分内容），X-Checksum-SHA256 是整个文件的校验和，
+    客户端续传完成后用它校验。sha256 取自结果索引或 blob 名称，不知道时才计算（有缓存）"""
+    response = send_file(path, as_attachment=True, conditional=True)
+    response.headers['X-Checksum-SHA256'] = sha256 or file_sha256(path)
+    return response
+
 @app.route('/download_blend_file', methods=['GET'])
 def download_blend_file():
     room_id = request.args.get('room_id')
@@ -367,7 +758,7 @@ def download_blend_file():
         return jsonify({"error": "File not found"}), 404
     
     app.logger.info(f"Sending file: {full_path}")
-    return send_file(full_path, as_attachment=True)
+    return send_file_resumable(full_path, blob_store.lookup(room_id, os.path.basename(file_path), full_path))
 
 @app.route('/list_room_files', methods=['GET'])
 def list_room_files():
@@ -388,20 +779,30 @@ def download_render_results():
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    room_results_path = os.path.join(ROOMS_FOLDER, room_id, "results")
-    if not os.path.exists(room_results_path):
+    task_ids = result_store.task_ids(room_id)
+    if not task_ids:
         return jsonify({"error": "Room results not found"}), 404
     
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w') as zf:
-        for root, dirs, files in os.walk(room_results_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, room_results_path)
-                zf.write(file_path, arcname)
+    # 可选：files 为逗号分隔的压缩包内路径，frames 为帧范围，例如 1-100,150
+    selected_files = set(filter(None, request.args.get('files', '').split(',')))
+    try:
+        frame_ranges = parse_frame_ranges(request.args['frames']) if request.args.get('frames') else None
+    except ValueError:
+        return jsonify({"error": "Invalid frames"}), 400
     
-    memory_file.seek(0)
-    return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name=f'room_{room_id}_results.zip')
+    # 按任务清单列出文件，压缩包内路径为 <task_id>/<file_name>
+    entries = []
+    for task_id in task_ids:
+        for file_name, entry in sorted(result_store.manifest(room_id, task_id).items()):
+            arcname = f"{task_id}/{file_name}"
+            if selected_files and arcname not in selected_files:
+                continue
+            if frame_ranges is not None and not frame_in_ranges(entry["frame"], frame_ranges):
+                continue
+            file_path = result_store.full_path(room_id, entry.get("path", file_name))
+            if os.path.exists(file_path):
+                entries.append((file_path, arcname))
+    return zip_response(entries, f'room_{room_id}_results.zip')
 
 @app.route('/download_task_file', methods=['GET'])
 def download_task_file():
@@ -409,15 +810,17 @@ def download_task_file():
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    task_file_path = os.path.join(ROOMS_FOLDER, room_id, "log", "tasks.json")
-    if not os.path.exists(task_file_path):
+    tasks = room_manager.get_tasks(room_id)
+    if not tasks:
         return jsonify({"error": "Task file not found"}), 404
     
-    return send_file(task_file_path, as_attachment=True)
+    return jsonify(tasks)
 
 @app.route('/check_room_status', methods=['GET'])
 def check_room_status():
     room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
     try:
         status = room_manager.get_room_status(room_id)
         return jsonify(status)
@@ -431,12 +834,12 @@ def list_final_files():
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    final_dir = os.path.join(ROOMS_FOLDER, room_id, "final")
-    if not os.path.exists(final_dir):
-        return jsonify({"files": []}), 200
-    
-    files = os.listdir(final_dir)
-    return jsonify({"files": files}), 200
+    # 读结果索引而不是扫描目录；details=1 时附带每个文件的 blend 文件、帧号、大小、校验和和客户端
+    index = result_store.files(room_id)
+    response = {"files": sorted(index)}
+    if request.args.get('details') == '1':
+        response["entries"] = index
+    return jsonify(response), 200
 
 @app.route('/download_final_file', methods=['GET'])
 def download_final_file():
@@ -445,11 +848,16 @@ def download_final_file():
     if not room_id or not file_name:
         return jsonify({"error": "Missing room_id or file_name"}), 400
     
-    file_path = os.path.join(ROOMS_FOLDER, room_id, "final", file_name)
-    if not os.path.exists(file_path):
+    # 只提供索引中的路径；没有索引条目的旧结果按文件名在 final 根目录查找
+    entry = result_store.get(room_id, file_name)
+    if entry is not None:
+        file_path = result_store.full_path(room_id, file_name)
+    else:
+        file_path = os.path.join(ROOMS_FOLDER, room_id, "final", os.path.basename(file_name))
+    if not os.path.isfile(file_path):
         return jsonify({"error": "File not found"}), 404
     
-    return send_file(file_path, as_attachment=True)
+    return send_file_resumable(file_path, entry["sha256"] if entry is not None else None)
 
 @app.route('/get_tasks', methods=['GET'])
 def get_tasks():
@@ -457,8 +865,41 @@ def get_tasks():
     if not room_id:
         return jsonify({"error": "Missing room_id"}), 400
     
-    tasks = room_manager.get_tasks(room_id)
-    return jsonify({"tasks": tasks}), 200
+    # 可选过滤：status 可用逗号分隔多个状态，client_id 为 unassigned 表示未领取的任务
+    status = request.args.get('status')
+    statuses = sorted(set(status.split(','))) if status else None
+    client = request.args.get('client_id')
+    file_name = request.args.get('file_name')
+    try:
+        cursor = request.args.get('cursor', type=int)
+        limit = request.args.get('limit', type=int)
+        result = room_manager.query_tasks(room_id, status=statuses, client=client, file_name=file_name,
+                                          cursor=cursor, limit=limit)
+    except ValueError:
+        return jsonify({"tasks": []}), 200
+    # 同一版本下不同的过滤和分页参数返回不同的结果，ETag 带上规范化后查询参数的摘要
+    query = json.dumps([statuses, client, file_name, cursor, limit])
+    variant = hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]
+    cached = not_modified(room_id, result['version'], variant)
+    if cached is not None:
+        return cached
+    return versioned_json(room_id, result['version'], result, variant), 200
+
+@app.route('/task_stats', methods=['GET'])
+def task_stats():
+    """按 blend 文件和客户端汇总的任务数、已完成帧数和剩余帧数，用于绘制进度"""
+    room_id = request.args.get('room_id')
+    if not room_id:
+        return jsonify({"error": "Missing room_id"}), 400
+    try:
+        stats = room_manager.get_task_stats(room_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    cached = not_modified(room_id, stats['version'])
+    if cached is not None:
+        return cached
+    return versioned_json(room_id, stats['version'], stats)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5801)  # 移除 ssl_context='adhoc'
\ No newline at end of file
+    # RoomManager 按房间加锁，可以多线程处理请求
+    app.run(host='0.0.0.0', port=5801, threaded=True)  # 移除 ssl_context='adhoc'
\ No newline at end of file
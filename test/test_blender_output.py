@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.blender_output import BlenderOutputParser, BlenderLog, parse_duration
+
+OUTPUT = """Blender 3.6.0
+Fra:1 Mem:85.21M (Peak 120.50M) | Time:00:00.50 | Mem:0.00M, Peak:0.00M | Scene, ViewLayer | Synchronizing object
+Fra:1 Mem:90.00M (Peak 130.25M) | Time:00:02.10 | Remaining:00:06.30 | Mem:10.00M | Scene, ViewLayer | Rendering 32 / 128 samples
+Fra:1 Mem:90.00M (Peak 130.25M) | Time:00:08.40 | Mem:10.00M | Scene, ViewLayer | Sample 128/128
+Saved: '/tmp/render/frame_0001.png'
+ Time: 00:08.62 (Saving: 00:00.22)
+
+Fra:2 Mem:85.21M (Peak 120.50M) | Time:00:00.40 | Scene, ViewLayer | Synchronizing object
+Saved: '/tmp/render/frame_0002.png'
+"""
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestBlenderOutputParser(unittest.TestCase):
+    def parse(self, clock=None):
+        parser = BlenderOutputParser(clock or FakeClock())
+        events = []
+        for line in OUTPUT.splitlines(keepends=True):
+            events.extend(parser.feed(line))
+        events.extend(parser.finish())
+        return events
+
+    def test_progress_events(self):
+        progress = [event for event in self.parse() if event["type"] == "progress" and event["frame"] == 1]
+        self.assertEqual([(event["sample"], event["samples"]) for event in progress],
+                         [(None, None), (32, 128), (128, 128)])
+        self.assertEqual(progress[1]["remaining"], 6.3)
+        self.assertEqual(progress[1]["peak_memory"], 130.25)
+
+    def test_frame_done_uses_time_summary(self):
+        done = [event for event in self.parse() if event["type"] == "frame_done"]
+        self.assertEqual(done[0], {"type": "frame_done", "frame": 1, "path": "/tmp/render/frame_0001.png",
+                                   "seconds": 8.62, "saving_seconds": 0.22})
+
+    def test_frame_without_summary_is_finished_at_end_of_output(self):
+        clock = FakeClock()
+        parser = BlenderOutputParser(clock)
+        parser.feed("Fra:2 Mem:85.21M | Time:00:00.40 | Scene\n")
+        clock.now += 3
+        events = parser.feed("Saved: '/tmp/render/frame_0002.png'\n")
+        self.assertEqual([event["type"] for event in events], ["saved"])
+        done = parser.finish()
+        self.assertEqual((done[0]["frame"], done[0]["seconds"]), (2, 3))
+        self.assertEqual(parser.finish(), [])
+
+    def test_event_order(self):
+        types = [(event["type"], event["frame"]) for event in self.parse() if event["type"] != "progress"]
+        self.assertEqual(types, [("frame_started", 1), ("saved", 1), ("frame_done", 1),
+                                 ("frame_started", 2), ("saved", 2), ("frame_done", 2)])
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("01:02:03.5"), 3723.5)
+        self.assertEqual(parse_duration("00:08.62"), 8.62)
+
+class TestBlenderLog(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "log", "blender.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_rotates_and_keeps_bounded_tail(self):
+        log = BlenderLog(self.path, max_bytes=1000, backups=2, tail_lines=5)
+        for index in range(305):
+            log.write(f"line {index:04d}\n")
+        log.close()
+        self.assertEqual(log.tail().splitlines(), [f"line {index:04d}" for index in range(300, 305)])
+        files = sorted(os.listdir(os.path.dirname(self.path)))
+        self.assertEqual(files, ["blender.log", "blender.log.1", "blender.log.2"])
+        for name in files:
+            self.assertLessEqual(os.path.getsize(os.path.join(os.path.dirname(self.path), name)), 1000)
+        with open(self.path) as f:
+            self.assertTrue(f.read().endswith("line 0304\n"))
+
+    def test_without_path_only_keeps_tail(self):
+        log = BlenderLog(None, tail_lines=2)
+        for line in ("a\n", "b\n", "c\n"):
+            log.write(line)
+        log.close()
+        self.assertEqual(log.tail(), "b\nc\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.blob_store import BlobStore
+from utils.checksum import file_sha256
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        self.store = BlobStore(os.path.join(self.rooms_folder, "blobs"))
+
+    def tearDown(self):
+        shutil.rmtree(self.rooms_folder)
+
+    def queue(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "queue")
+
+    def upload(self, room_id, data, file_name="scene.blend"):
+        os.makedirs(self.queue(room_id), exist_ok=True)
+        path = os.path.join(self.queue(room_id), file_name + ".upload.tmp")
+        with open(path, 'wb') as f:
+            f.write(data)
+        return self.store.adopt(room_id, file_name, path, self.queue(room_id))
+
+    def test_same_content_is_stored_once(self):
+        sha256 = self.upload("111111", b"scene data")
+        self.assertEqual(self.upload("222222", b"scene data"), sha256)
+        first = os.path.join(self.queue("111111"), "scene.blend")
+        second = os.path.join(self.queue("222222"), "scene.blend")
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(self.store.refcount(sha256), 2)
+        self.assertEqual(sorted(os.listdir(self.queue("111111"))), ["scene.blend"])
+
+    def test_lookup_uses_blob_name_only_for_linked_files(self):
+        sha256 = self.upload("111111", b"scene data")
+        path = os.path.join(self.queue("111111"), "scene.blend")
+        self.assertEqual(self.store.lookup("111111", "scene.blend", path), sha256)
+        # 绕过存储直接写入的文件不再是 blob 的硬链接，校验和需要重新计算
+        os.remove(path)
+        with open(path, 'wb') as f:
+            f.write(b"other data")
+        self.assertIsNone(self.store.lookup("111111", "scene.blend", path))
+
+    def test_link_existing_blob_without_upload(self):
+        sha256 = self.upload("111111", b"scene data")
+        path = self.store.link("333333", "copy.blend", sha256, self.queue("333333"))
+        self.assertEqual(file_sha256(path), sha256)
+        with self.assertRaises(KeyError):
+            self.store.link("333333", "other.blend", "0" * 64, self.queue("333333"))
+
+    def test_blob_removed_with_last_reference(self):
+        sha256 = self.upload("111111", b"scene data")
+        self.upload("222222", b"scene data")
+        self.assertEqual(self.store.release("111111", "scene.blend"), 1)
+        self.assertTrue(self.store.has(sha256))
+        self.assertEqual(self.store.release("222222", "scene.blend"), 0)
+        self.assertFalse(self.store.has(sha256))
+        self.assertIsNone(self.store.release("222222", "scene.blend"))
+
+    def test_replacing_a_file_releases_the_old_blob(self):
+        old = self.upload("111111", b"version 1")
+        new = self.upload("111111", b"version 2")
+        self.assertFalse(self.store.has(old))
+        self.assertTrue(self.store.has(new))
+        self.assertEqual(self.store.refcount(new), 1)
+
+    def test_refs_survive_restart(self):
+        sha256 = self.upload("111111", b"scene data")
+        store = BlobStore(self.store.root)
+        self.assertEqual(store.refcount(sha256), 1)
+
+if __name__ == '__main__':
+    unittest.main()
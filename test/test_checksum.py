@@ -0,0 +1,50 @@
+import unittest
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.checksum as checksum_module
+from utils.checksum import file_sha256
+from unittest.mock import patch
+
+class TestChecksum(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "scene.blend")
+        with open(self.path, 'wb') as f:
+            f.write(b"blend" * 100000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_matches_hashlib(self):
+        with open(self.path, 'rb') as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(file_sha256(self.path, chunk_size=4096), expected)
+
+    def test_changed_file_is_rehashed(self):
+        before = file_sha256(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b"more")
+        self.assertNotEqual(file_sha256(self.path), before)
+
+    def test_cache_is_bounded(self):
+        paths = []
+        for index in range(3):
+            path = os.path.join(self.folder, f"frame_{index}.png")
+            with open(path, 'wb') as f:
+                f.write(bytes([index]))
+            paths.append(path)
+        with patch.object(checksum_module, 'CACHE_SIZE', 2):
+            for path in paths:
+                file_sha256(path)
+            cached = [key[0] for key in checksum_module._cache]
+        self.assertEqual(cached, [os.path.abspath(path) for path in paths[1:]])
+
+if __name__ == '__main__':
+    unittest.main()
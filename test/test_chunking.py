@@ -0,0 +1,69 @@
+import unittest
+import os
+import sys
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chunking import plan_chunks
+from utils.throughput import record_sample, record_calibration, client_seconds_per_frame
+
+def segment(start_frame, end_frame, seconds_per_frame, file_name="scene.blend"):
+    return {"file_name": file_name, "start_frame": start_frame, "end_frame": end_frame,
+            "seconds_per_frame": seconds_per_frame}
+
+class TestChunking(unittest.TestCase):
+    def assert_covers(self, chunks, start_frame, end_frame):
+        frames = [frame for _, start, end in chunks for frame in range(start, end + 1)]
+        self.assertEqual(frames, list(range(start_frame, end_frame + 1)))
+
+    def test_short_job_is_split_across_members(self):
+        chunks = plan_chunks([segment(1, 20, 30)], member_count=8, target_seconds=300, min_seconds=60)
+        self.assert_covers(chunks, 1, 20)
+        self.assertGreaterEqual(len(chunks), 8)
+
+    def test_cheap_frames_get_large_chunks(self):
+        chunks = plan_chunks([segment(1, 10000, 2)], member_count=4, target_seconds=300, min_seconds=60)
+        self.assert_covers(chunks, 1, 10000)
+        self.assertLess(len(chunks), 200)
+        self.assertEqual(chunks[0][2] - chunks[0][1] + 1, 150)
+
+    def test_chunks_shrink_toward_the_end(self):
+        chunks = plan_chunks([segment(1, 2000, 10)], member_count=4, target_seconds=600, min_seconds=30)
+        sizes = [end - start + 1 for _, start, end in chunks]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertLess(sizes[-1], sizes[0])
+
+    def test_multiple_files_keep_their_ranges(self):
+        chunks = plan_chunks([segment(1, 50, 5, "a.blend"), segment(100, 140, 20, "b.blend")], member_count=2)
+        self.assert_covers([chunk for chunk in chunks if chunk[0] == "a.blend"], 1, 50)
+        self.assert_covers([chunk for chunk in chunks if chunk[0] == "b.blend"], 100, 140)
+
+class TestThroughput(unittest.TestCase):
+    def setUp(self):
+        self.room_settings = {"blender_files": []}
+        self.blender_file = {"file_name": "scene.blend", "render_settings": {"seconds_per_frame": 30}}
+
+    def test_measured_rate_is_smoothed(self):
+        record_sample(self.room_settings, "alice", "scene.blend", 10, 10)
+        record_sample(self.room_settings, "alice", "scene.blend", 10, 20, smoothing=0.5)
+        self.assertAlmostEqual(self.room_settings["throughput"]["alice"]["scene.blend"], 0.75)
+        self.assertAlmostEqual(client_seconds_per_frame(self.room_settings, "alice", self.blender_file), 1 / 0.75)
+
+    def test_unknown_client_has_no_estimate(self):
+        self.assertIsNone(client_seconds_per_frame(self.room_settings, "alice", self.blender_file))
+
+    def test_calibration_scales_from_measured_peer(self):
+        record_calibration(self.room_settings, "alice", 10)
+        record_calibration(self.room_settings, "bob", 40)
+        record_sample(self.room_settings, "alice", "scene.blend", 1, 5)
+        # bob 的校准耗时是 alice 的 4 倍
+        self.assertAlmostEqual(client_seconds_per_frame(self.room_settings, "bob", self.blender_file), 20)
+
+    def test_calibration_scales_file_estimate_without_history(self):
+        record_calibration(self.room_settings, "alice", 10)
+        record_calibration(self.room_settings, "bob", 30)
+        self.assertAlmostEqual(client_seconds_per_frame(self.room_settings, "alice", self.blender_file), 15)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import os
+import sys
+import threading
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.event_bus import EventBus
+
+class TestEventBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = EventBus(history=3)
+
+    def test_events_after_cursor_are_returned(self):
+        first = self.bus.publish("123456", "task", {"id": "t1"})
+        self.bus.publish("123456", "member_joined", {"client_id": "bob"})
+        events = self.bus.since("123456", first)
+        self.assertEqual([event["type"] for event in events], ["member_joined"])
+        self.assertEqual(self.bus.since("123456", self.bus.last_id("123456")), [])
+
+    def test_stale_cursor_gets_reset(self):
+        for index in range(5):
+            self.bus.publish("123456", "task", {"id": f"t{index}"})
+        self.assertEqual([event["type"] for event in self.bus.since("123456", 0)], ["reset"])
+        # 服务器重启后序号重新开始
+        self.assertEqual([event["type"] for event in self.bus.since("654321", 10)], ["reset"])
+
+    def test_wait_wakes_up_on_publish(self):
+        timer = threading.Timer(0.05, self.bus.publish, args=("123456", "result", {"file_name": "frame_0001.png"}))
+        timer.start()
+        events = self.bus.wait("123456", 0, timeout=5)
+        timer.join()
+        self.assertEqual(events[0]["data"]["file_name"], "frame_0001.png")
+
+    def test_wait_times_out_without_events(self):
+        self.assertEqual(self.bus.wait("123456", None, timeout=0.01), [])
+
+if __name__ == '__main__':
+    unittest.main()
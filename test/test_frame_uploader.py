@@ -0,0 +1,67 @@
+import unittest
+import os
+import sys
+import threading
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.frame_uploader import FrameUploader
+
+class TestFrameUploader(unittest.TestCase):
+    def test_frames_upload_while_rendering_continues(self):
+        started = threading.Event()
+        release = threading.Event()
+        uploads = []
+
+        def upload(path):
+            uploads.append(path)
+            started.set()
+            release.wait(5)
+            return True
+
+        reported = []
+        uploader = FrameUploader(upload, reported.append)
+        uploader.put(1, "frame_0001.png")
+        # 第一帧的上传在后台进行，put 不会阻塞渲染
+        self.assertTrue(started.wait(5))
+        uploader.put(2, "frame_0002.png")
+        release.set()
+        self.assertEqual(uploader.close(5), {1: "frame_0001.png", 2: "frame_0002.png"})
+        self.assertEqual(uploads, ["frame_0001.png", "frame_0002.png"])
+        self.assertEqual(reported, [1, 2])
+
+    def test_failed_uploads_are_retried_then_given_up(self):
+        attempts = {"frame_0001.png": 0, "frame_0002.png": 0}
+
+        def upload(path):
+            attempts[path] += 1
+            if path == "frame_0002.png":
+                raise IOError("connection reset")
+            return attempts[path] > 1
+
+        uploader = FrameUploader(upload, retries=2, backoff=0)
+        uploader.put(1, "frame_0001.png")
+        uploader.put(2, "frame_0002.png")
+        self.assertEqual(uploader.close(5), {1: "frame_0001.png"})
+        self.assertEqual(uploader.failed, {2: "frame_0002.png"})
+        self.assertEqual(attempts, {"frame_0001.png": 2, "frame_0002.png": 3})
+
+    def test_close_gives_up_after_timeout(self):
+        release = threading.Event()
+
+        def upload(path):
+            release.wait(5)
+            return True
+
+        uploader = FrameUploader(upload)
+        uploader.put(1, "frame_0001.png")
+        uploader.put(2, "frame_0002.png")
+        # 上传卡住时 close 按超时返回，不会一直阻塞任务
+        self.assertEqual(uploader.close(0.1), {})
+        release.set()
+        uploader._thread.join(5)
+        self.assertEqual(uploader.uploaded, {1: "frame_0001.png"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.state_store import JsonStateStore
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        # 把压缩间隔设得很长，模拟快照还没来得及写就崩溃
+        self.store = JsonStateStore(self.rooms_folder, flush_delay=3600)
+        self.room_id = "123456"
+        self.tasks = [
+            {"id": "t1", "file_name": "a.blend", "start_frame": 1, "end_frame": 10, "status": "triggered", "client": None},
+            {"id": "t2", "file_name": "a.blend", "start_frame": 11, "end_frame": 20, "status": "triggered", "client": None},
+        ]
+        self.store.save_room(self.room_id, {"room_id": self.room_id, "status": "triggered", "members": []})
+        self.store.save_tasks(self.room_id, self.tasks)
+        self.tasks[0].update(status="done", client="alice")
+        self.store.save_task(self.room_id, self.tasks[0])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.rooms_folder)
+
+    def test_recover_from_journal_without_snapshot(self):
+        self.store._journal.sync()
+        self.assertFalse(os.path.exists(os.path.join(self.rooms_folder, self.room_id, "log", "tasks.json")))
+
+        recovered = JsonStateStore(self.rooms_folder, flush_delay=3600)
+        try:
+            self.assertEqual(recovered.load_room(self.room_id)["status"], "triggered")
+            tasks = recovered.load_tasks(self.room_id)
+            self.assertEqual([task["status"] for task in tasks], ["done", "triggered"])
+        finally:
+            recovered.close()
+
+    def test_torn_tail_record_is_ignored(self):
+        self.store._journal.sync()
+        with open(self.store._journal.path(self.room_id), 'a') as f:
+            f.write('{"op": "task", "task": {"id": "t2", "sta')
+
+        recovered = JsonStateStore(self.rooms_folder, flush_delay=3600)
+        try:
+            tasks = recovered.load_tasks(self.room_id)
+            self.assertEqual(tasks[1]["status"], "triggered")
+        finally:
+            recovered.close()
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        self.store.flush()
+        self.assertEqual(os.path.getsize(self.store._journal.path(self.room_id)), 0)
+
+        recovered = JsonStateStore(self.rooms_folder, flush_delay=3600)
+        try:
+            self.assertEqual(recovered.load_tasks(self.room_id)[0]["client"], "alice")
+        finally:
+            recovered.close()
+
+if __name__ == '__main__':
+    unittest.main()
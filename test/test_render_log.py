@@ -0,0 +1,78 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.render_log import FrameBitmap, RenderLogStore
+
+class TestFrameBitmap(unittest.TestCase):
+    def test_done_and_missing_ranges(self):
+        bitmap = FrameBitmap(1, 100000)
+        for frame in list(range(1, 50001)) + [70000]:
+            bitmap.add(frame)
+        self.assertEqual(bitmap.count(), 50001)
+        self.assertEqual(bitmap.done_ranges(), [[1, 50000], [70000, 70000]])
+        self.assertEqual(bitmap.missing_ranges(), [[50001, 69999], [70001, 100000]])
+        self.assertIn(70000, bitmap)
+        self.assertNotIn(70001, bitmap)
+
+    def test_duplicate_frame_is_not_counted_twice(self):
+        bitmap = FrameBitmap(10, 12)
+        self.assertTrue(bitmap.add(11))
+        self.assertFalse(bitmap.add(11))
+        self.assertEqual(bitmap.missing_ranges(), [[10, 10], [12, 12]])
+        with self.assertRaises(ValueError):
+            bitmap.add(9)
+
+    def test_round_trip(self):
+        bitmap = FrameBitmap(5, 20)
+        bitmap.add(7)
+        restored = FrameBitmap.from_dict(bitmap.to_dict())
+        self.assertEqual(restored.done_ranges(), [[7, 7]])
+
+class TestRenderLogStore(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        self.store = RenderLogStore(self.rooms_folder, flush_delay=3600)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.rooms_folder)
+
+    def test_batch_is_merged_into_runs_and_persisted(self):
+        records = [{"frame": frame, "task_id": "t1", "client": "alice", "blend_file": "a.blend"} for frame in range(1, 6)]
+        records.append({"frame": 6, "task_id": "t2", "client": "bob", "blend_file": "a.blend"})
+        self.assertEqual(self.store.add_frames("123456", records, {"a.blend": (1, 10)}), 6)
+        self.assertEqual(self.store.add_frames("123456", records[:1], {"a.blend": (1, 10)}), 0)
+        self.store.close()
+
+        reloaded = RenderLogStore(self.rooms_folder, flush_delay=3600)
+        try:
+            summary = reloaded.summary("123456")["files"]["a.blend"]
+            self.assertEqual(summary["runs"], [[1, 5, "t1", "alice"], [6, 6, "t2", "bob"]])
+            self.assertEqual(summary["missing_ranges"], [[7, 10]])
+            self.assertEqual(summary["done"], 6)
+        finally:
+            reloaded.close()
+
+    def test_invalid_record_rejects_whole_batch(self):
+        self.store.add_frames("123456", [{"frame": 3, "blend_file": "a.blend"}], {"a.blend": (3, 10)})
+        valid = {"frame": 4, "task_id": "t1", "client": "alice", "blend_file": "a.blend"}
+        for invalid in ({"blend_file": "a.blend"}, {"frame": None, "blend_file": "a.blend"},
+                        {"frame": "x", "blend_file": "a.blend"}, {"frame": 5}, None,
+                        {"frame": 2, "blend_file": "a.blend"}):
+            with self.assertRaises(ValueError):
+                self.store.add_frames("123456", [valid, invalid], {"a.blend": (3, 10)})
+        self.assertEqual(self.store.summary("123456")["files"]["a.blend"]["done_ranges"], [[3, 3]])
+
+    def test_new_bitmap_covers_frames_before_the_range(self):
+        records = [{"frame": frame, "blend_file": "b.blend"} for frame in (5, 2)]
+        self.assertEqual(self.store.add_frames("123456", records, {"b.blend": (3, 10)}), 2)
+        self.assertEqual(self.store.summary("123456")["files"]["b.blend"]["done_ranges"], [[2, 2], [5, 5]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import os
+import io
+import sys
+import shutil
+import hashlib
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.result_store import ResultStore
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        self.store = ResultStore(self.rooms_folder, flush_delay=60)
+        self.task = {"id": "scene_1_3", "start_frame": 1, "end_frame": 3}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.rooms_folder)
+
+    def test_ingest_writes_once_into_final(self):
+        data = os.urandom(5000)
+        entry = self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(data), "alice")
+        final_dir = os.path.join(self.rooms_folder, "123456", "final")
+        self.assertEqual(os.listdir(final_dir), ["frame_0001.png"])
+        self.assertFalse(os.path.exists(os.path.join(self.rooms_folder, "123456", "results")))
+        self.assertEqual(entry["sha256"], hashlib.sha256(data).hexdigest())
+        self.assertEqual((entry["frame"], entry["size"], entry["client"]), (1, 5000, "alice"))
+
+    def test_manifest_checks_task_frames(self):
+        self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(b"a"))
+        self.store.ingest("123456", "scene_1_3", "frame_0003.png", io.BytesIO(b"bb"))
+        self.store.ingest("123456", "scene_1_3", "frame_0003.png", io.BytesIO(b"ccc"))
+        result = self.store.check_task("123456", self.task)
+        self.assertEqual(result, {"files": 2, "bytes": 4, "missing_frames": [2]})
+        self.assertEqual(self.store.task_ids("123456"), ["scene_1_3"])
+
+    def test_frames_uploaded_by_peer_are_not_missing(self):
+        self.store.ingest("123456", "scene_1_3~spec", "frame_0002.png", io.BytesIO(b"a"), blend_file="scene.blend")
+        task = dict(self.task, file_name="scene.blend")
+        self.assertEqual(self.store.check_task("123456", task)["missing_frames"], [1, 3])
+
+    def test_truncated_manifest_line_is_ignored(self):
+        self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(b"a"))
+        with open(os.path.join(self.rooms_folder, "123456", "manifests", "scene_1_3.jsonl"), 'a') as f:
+            f.write('{"file_name": "frame_00')
+        self.assertEqual(list(self.store.manifest("123456", "scene_1_3")), ["frame_0001.png"])
+
+    def test_task_id_cannot_escape_manifests(self):
+        for task_id in ("../scene_1_3", "a/b", ".hidden", ""):
+            with self.assertRaises(ValueError):
+                self.store.ingest("123456", task_id, "frame_0001.png", io.BytesIO(b"a"))
+            with self.assertRaises(ValueError):
+                self.store.manifest("123456", task_id)
+        self.store.ingest("123456", "123456_scene.blend_1~spec2", "frame_0001.png", io.BytesIO(b"a"))
+        self.assertEqual(self.store.task_ids("123456"), ["123456_scene.blend_1~spec2"])
+
+    def test_checksum_mismatch_keeps_previous_result(self):
+        self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(b"good"))
+        with self.assertRaises(ValueError):
+            self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(b"corrupt"), sha256="0" * 64)
+        with open(self.store.full_path("123456", "frame_0001.png"), 'rb') as f:
+            self.assertEqual(f.read(), b"good")
+        self.assertEqual(self.store.manifest("123456", "scene_1_3")["frame_0001.png"]["size"], 4)
+        self.assertEqual(os.listdir(os.path.join(self.rooms_folder, "123456", "final")), ["frame_0001.png"])
+
+    def test_discarded_result_does_not_replace_winner(self):
+        self.store.ingest("123456", "scene_1_3", "frame_0001.png", io.BytesIO(b"winner"), "alice")
+        staged = self.store.receive("123456", "frame_0001.png", io.BytesIO(b"loser"))
+        self.store.discard(staged)
+        with open(self.store.full_path("123456", "frame_0001.png"), 'rb') as f:
+            self.assertEqual(f.read(), b"winner")
+        self.assertEqual(self.store.get("123456", "frame_0001.png")["client"], "alice")
+        self.assertEqual(os.listdir(os.path.join(self.rooms_folder, "123456", "final")), ["frame_0001.png"])
+        self.assertEqual(self.store.task_ids("123456"), ["scene_1_3"])
+
+    def test_blend_files_do_not_collide(self):
+        first = self.store.ingest("123456", "a_1_3", "frame_0001.png", io.BytesIO(b"a"), "alice", "a.blend")
+        second = self.store.ingest("123456", "b_1_3", "frame_0001.png", io.BytesIO(b"bb"), "bob", "b.blend")
+        self.assertEqual((first["path"], second["path"]), ("a/frame_0001.png", "b/frame_0001.png"))
+        self.assertEqual(sorted(self.store.files("123456")), ["a/frame_0001.png", "b/frame_0001.png"])
+        self.assertEqual(self.store.lookup("123456", "b.blend", 1)["client"], "bob")
+        self.assertIsNone(self.store.lookup("123456", "b.blend", 2))
+        with open(self.store.full_path("123456", "a/frame_0001.png"), 'rb') as f:
+            self.assertEqual(f.read(), b"a")
+
+    def test_index_is_restored_from_snapshot_and_manifest_tail(self):
+        self.store.ingest("123456", "a_1_3", "frame_0001.png", io.BytesIO(b"a"), "alice", "a.blend")
+        self.store.flush()
+        self.store.ingest("123456", "a_1_3", "frame_0002.png", io.BytesIO(b"b"), "alice", "a.blend")
+        # 第二帧还没有写进 index.json，重启后从清单尾部补上
+        with open(os.path.join(self.rooms_folder, "123456", "final", "index.json")) as f:
+            self.assertNotIn("a/frame_0002.png", f.read())
+        restarted = ResultStore(self.rooms_folder)
+        self.assertEqual(sorted(restarted.files("123456")), ["a/frame_0001.png", "a/frame_0002.png"])
+        self.assertEqual(restarted.lookup("123456", "a.blend", 2)["task_id"], "a_1_3")
+        restarted.close()
+
+if __name__ == '__main__':
+    unittest.main()
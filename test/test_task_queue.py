@@ -0,0 +1,523 @@
+import unittest
+import os
+import json
+import sys
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.room_manager as room_manager_module
+import utils.schedule as schedule_module
+from utils.room_manager import RoomManager, TaskConflictError
+from utils.sqlite_store import SqliteStateStore
+from utils.task_index import TaskIndex
+
+class TestTaskQueue(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        self.patcher = patch.object(room_manager_module, 'ROOMS_FOLDER', self.rooms_folder)
+        self.patcher.start()
+
+        self.room_manager = self.create_room_manager()
+        self.room_id = "123456"
+        self.room_manager.create_room(self.room_id, {
+            "room_id": self.room_id,
+            "create_time": "2024-01-01T00:00:00",
+            "status": "waiting",
+            "members": [{"id": "alice", "order": 0}],
+            "blender_files": [{
+                "file_name": "scene.blend",
+                "upload_order": 0,
+                "render_settings": {"start_frame": 1, "end_frame": 3, "seconds_per_frame": 100}
+            }]
+        })
+        self.room_manager.join_room(self.room_id, "bob")
+        self.room_manager.trigger_rendering(self.room_id)
+
+    def create_room_manager(self):
+        return RoomManager()
+
+    def tearDown(self):
+        self.room_manager.close()
+        self.patcher.stop()
+        shutil.rmtree(self.rooms_folder)
+
+    def test_room_settings_are_copy_on_write(self):
+        room_settings = self.room_manager.get_room_settings(self.room_id)
+        snapshot = json.dumps(room_settings, sort_keys=True)
+        self.room_manager.set_schedule(self.room_id, "scene.blend", priority=5)
+        self.room_manager.report_calibration(self.room_id, "alice", 2)
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        self.room_manager.report_progress(self.room_id, task["id"], "alice", task["start_frame"], frame_seconds=4.0)
+        # 已经交出去的字典不会被原地修改，可以在锁外安全地序列化
+        self.assertEqual(json.dumps(room_settings, sort_keys=True), snapshot)
+        latest = self.room_manager.get_room_settings(self.room_id)
+        self.assertEqual(latest["blender_files"][0]["priority"], 5)
+        self.assertEqual(latest["calibration"], {"alice": 2.0})
+
+    def test_tasks_are_created_unassigned(self):
+        tasks = self.room_manager.get_tasks(self.room_id)
+        self.assertEqual(len(tasks), 3)
+        self.assertTrue(all(task["client"] is None for task in tasks))
+        self.assertTrue(all(task["status"] == "triggered" for task in tasks))
+
+    def test_fast_client_pulls_remaining_tasks(self):
+        first = self.room_manager.get_next_task(self.room_id, "alice")
+        second = self.room_manager.get_next_task(self.room_id, "bob")
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(first["status"], "rendering")
+        self.assertIsNotNone(first["lease_expires"])
+
+        # alice 先完成，继续领取剩余任务
+        self.room_manager.complete_task(self.room_id, first["id"], "alice")
+        third = self.room_manager.get_next_task(self.room_id, "alice")
+        self.assertNotIn(third["id"], (first["id"], second["id"]))
+        self.assertIsNone(self.room_manager.get_next_task(self.room_id, "alice"))
+
+        done = [task for task in self.room_manager.get_tasks(self.room_id) if task["status"] == "done"]
+        self.assertEqual([task["id"] for task in done], [first["id"]])
+        self.assertIsNone(done[0]["lease_expires"])
+
+    def test_room_status_counts_unfinished_tasks(self):
+        tasks = [self.room_manager.get_next_task(self.room_id, client) for client in ("alice", "bob", "alice")]
+        # 所有任务都被租用时领不到任务，但房间仍有未完成的任务，客户端应继续等待
+        self.assertIsNone(self.room_manager.get_next_task(self.room_id, "bob"))
+        self.assertEqual(self.room_manager.get_room_status(self.room_id)["unfinished_tasks"], 3)
+        for task in tasks:
+            self.room_manager.complete_task(self.room_id, task["id"], task["client"])
+        self.assertEqual(self.room_manager.get_room_status(self.room_id)["unfinished_tasks"], 0)
+
+    def test_expired_lease_is_reassigned(self):
+        with patch.object(room_manager_module, 'TASK_LEASE_SECONDS', -1):
+            task = self.room_manager.get_next_task(self.room_id, "alice")
+        reassigned = self.room_manager.get_next_task(self.room_id, "bob")
+        self.assertEqual(reassigned["id"], task["id"])
+        self.assertEqual(reassigned["client"], "bob")
+
+    def test_stale_holder_cannot_fail_reassigned_task(self):
+        with patch.object(room_manager_module, 'TASK_LEASE_SECONDS', -1):
+            task = self.room_manager.get_next_task(self.room_id, "alice")
+        reassigned = self.room_manager.get_next_task(self.room_id, "bob")
+        self.assertEqual(reassigned["id"], task["id"])
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.update_task(self.room_id, task["id"], "failed", "alice")
+        current = self.room_manager.get_task(self.room_id, task["id"])
+        self.assertEqual((current["status"], current["client"]), ("rendering", "bob"))
+        self.room_manager.update_task(self.room_id, task["id"], "failed", "bob")
+
+    def test_complete_task_rejects_other_client(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        with self.assertRaises(ValueError):
+            self.room_manager.complete_task(self.room_id, task["id"], "bob")
+
+    def test_concurrent_pulls_never_share_a_task(self):
+        granted = []
+        def pull(client_id):
+            task = self.room_manager.get_next_task(self.room_id, client_id)
+            if task is not None:
+                granted.append(task["id"])
+
+        threads = [threading.Thread(target=pull, args=("alice" if i % 2 else "bob",)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(granted), 3)
+        self.assertEqual(len(set(granted)), 3)
+
+    def test_transition_is_compare_and_swap(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        updated = self.room_manager.update_task(self.room_id, task["id"], "rendering", "alice", task["version"])
+        self.assertEqual(updated["version"], task["version"] + 1)
+
+        # 过期的版本号和非租约持有者都会冲突
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.update_task(self.room_id, task["id"], "done", "alice", task["version"])
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.update_task(self.room_id, task["id"], "rendering", "bob")
+        self.assertEqual(self.room_manager.get_task(self.room_id, task["id"])["client"], "alice")
+
+    def create_single_chunk_room(self, room_id, start_frame, end_frame, speculative=False):
+        self.room_manager.create_room(room_id, {
+            "room_id": room_id, "status": "waiting", "members": [{"id": "alice", "order": 0}],
+            "speculative": speculative,
+            "blender_files": [{"file_name": "scene.blend", "upload_order": 0,
+                               "render_settings": {"start_frame": start_frame, "end_frame": end_frame}}]
+        })
+        self.room_manager.join_room(room_id, "bob")
+        with patch.object(room_manager_module, 'plan_chunks', return_value=[("scene.blend", start_frame, end_frame)]):
+            self.room_manager.trigger_rendering(room_id)
+
+    def test_idle_client_steals_half_of_remaining_frames(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 2)
+        stolen = self.room_manager.get_next_task(room_id, "bob")
+        self.assertEqual((stolen["start_frame"], stolen["end_frame"]), (7, 10))
+        self.assertEqual(stolen["client"], "bob")
+
+        # alice 下次上报进度时得知新的结束帧
+        updated = self.room_manager.report_progress(room_id, task["id"], "alice", 3)
+        self.assertEqual(updated["end_frame"], 6)
+
+    def test_frame_beyond_stolen_range_is_not_recorded(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 2)
+        stolen = self.room_manager.get_next_task(room_id, "bob")
+
+        # alice 还没得知新的结束帧，已经渲染出的第 8 帧属于 bob，不能记入 alice 的任务
+        self.assertFalse(self.room_manager.record_result(room_id, task["id"], 8))
+        self.assertTrue(self.room_manager.record_result(room_id, task["id"], 3))
+        self.assertTrue(self.room_manager.record_result(room_id, stolen["id"], 8))
+        self.assertEqual(self.room_manager.get_task(room_id, task["id"])["uploaded_frames"], [3])
+
+    def test_heartbeat_renews_lease(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        renewed = self.room_manager.heartbeat(self.room_id, task["id"], "alice")
+        self.assertGreaterEqual(renewed["lease_expires"], task["lease_expires"])
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.heartbeat(self.room_id, task["id"], "bob")
+
+    def test_reaper_requeues_only_frames_not_uploaded(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        for frame in (1, 2, 3, 5):
+            self.room_manager.record_result(room_id, task["id"], frame)
+
+        requeued = self.room_manager.reap_expired_leases(now=task["lease_expires"] + 1)
+        self.assertEqual([t["id"] for t in requeued], [task["id"]])
+        self.assertEqual(requeued[0]["status"], "triggered")
+        self.assertEqual(requeued[0]["start_frame"], 4)
+
+        # 掉线的客户端不能再续租，任务可以被其他成员领取
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.heartbeat(room_id, task["id"], "alice")
+        self.assertEqual(self.room_manager.get_next_task(room_id, "bob")["id"], task["id"])
+
+    def test_straggler_is_duplicated_only_when_speculative(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 9)
+        self.assertIsNone(self.room_manager.get_next_task(room_id, "bob"))
+
+        room_id = "654322"
+        self.create_single_chunk_room(room_id, 1, 10, speculative=True)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 9)
+        copy = self.room_manager.get_next_task(room_id, "bob")
+        self.assertEqual(copy["speculative_of"], task["id"])
+        self.assertEqual((copy["start_frame"], copy["end_frame"]), (10, 10))
+        # 每个任务最多一个副本
+        self.assertIsNone(self.room_manager.get_next_task(room_id, "bob"))
+
+    def test_first_speculative_finisher_wins(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10, speculative=True)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 9)
+        copy = self.room_manager.get_next_task(room_id, "bob")
+
+        # 同一帧只保存先上传的一份
+        self.assertTrue(self.room_manager.record_result(room_id, copy["id"], 10))
+        self.assertFalse(self.room_manager.record_result(room_id, task["id"], 10))
+
+        self.room_manager.complete_task(room_id, copy["id"], "bob")
+        original = self.room_manager.get_task(room_id, task["id"])
+        self.assertEqual((original["status"], original["end_frame"]), ("rendering", 9))
+        self.assertIsNone(original.get("speculated_by"))
+
+    def test_losing_speculative_copy_is_cancelled(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10, speculative=True)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 9)
+        copy = self.room_manager.get_next_task(room_id, "bob")
+
+        self.room_manager.complete_task(room_id, task["id"], "alice")
+        self.assertEqual(self.room_manager.get_task(room_id, copy["id"])["status"], "cancelled")
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.heartbeat(room_id, copy["id"], "bob")
+        with self.assertRaises(TaskConflictError):
+            self.room_manager.complete_task(room_id, copy["id"], "bob")
+
+    def test_straggler_is_speculated_again_after_cancelled_copy(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10, speculative=True)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.room_manager.report_progress(room_id, task["id"], "alice", 9)
+        with patch.object(room_manager_module, 'TASK_LEASE_SECONDS', -1):
+            first = self.room_manager.get_next_task(room_id, "bob")
+
+        # 副本的租约过期后被取消，再次推测时得到新的 ID
+        second = self.room_manager.get_next_task(room_id, "bob")
+        self.assertNotEqual(second["id"], first["id"])
+        self.assertEqual(self.room_manager.get_task(room_id, first["id"])["status"], "cancelled")
+        self.assertEqual(second["speculative_of"], task["id"])
+        cancelled = self.room_manager.query_tasks(room_id, status="cancelled")["tasks"]
+        self.assertEqual([t["id"] for t in cancelled], [first["id"]])
+        stats = self.room_manager.get_task_stats(room_id)["clients"]["bob"]["tasks"]
+        self.assertEqual(stats, {"cancelled": 1, "rendering": 1})
+
+    def test_fast_client_gets_merged_chunk(self):
+        self.room_manager.report_calibration(self.room_id, "alice", 1)
+        self.room_manager.report_calibration(self.room_id, "bob", 9)
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        self.assertEqual((task["start_frame"], task["end_frame"]), (1, 3))
+        merged = [t for t in self.room_manager.get_tasks(self.room_id) if t.get("merged_into") == task["id"]]
+        self.assertEqual(len(merged), 2)
+        self.assertTrue(all(t["status"] == "cancelled" for t in merged))
+
+    def test_slow_client_gets_small_chunk(self):
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+        self.room_manager.report_calibration(room_id, "alice", 1)
+        task = self.room_manager.get_next_task(room_id, "alice")
+        self.assertEqual((task["start_frame"], task["end_frame"]), (1, 2))
+        remainder = self.room_manager.get_next_task(room_id, "bob")
+        self.assertEqual((remainder["start_frame"], remainder["end_frame"]), (3, 10))
+
+    def test_completion_records_client_throughput(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        self.room_manager.complete_task(self.room_id, task["id"], "alice")
+        rates = self.room_manager.get_room_settings(self.room_id)["throughput"]["alice"]
+        self.assertGreater(rates["scene.blend"], 0)
+
+    def test_frame_timings_feed_throughput(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        room_version = self.room_manager.get_room_settings(self.room_id)["room_version"]
+        self.room_manager.report_progress(self.room_id, task["id"], "alice", task["start_frame"], frame_seconds=4.0)
+        rates = self.room_manager.get_room_settings(self.room_id)["throughput"]["alice"]
+        self.assertAlmostEqual(rates["scene.blend"], 0.25)
+        # 逐帧的帧率只更新内存，不重写房间设置
+        self.assertEqual(self.room_manager.get_room_settings(self.room_id)["room_version"], room_version)
+        # 已经按帧计入的任务完成时不再按整个任务的耗时计入
+        self.room_manager.complete_task(self.room_id, task["id"], "alice")
+        self.assertAlmostEqual(rates["scene.blend"], 0.25)
+        self.room_manager.close()
+        self.room_manager = self.create_room_manager()
+        rates = self.room_manager.get_room_settings(self.room_id)["throughput"]["alice"]
+        self.assertAlmostEqual(rates["scene.blend"], 0.25)
+
+    def test_pool_worker_is_served_by_fair_share(self):
+        with self.assertRaises(ValueError):
+            self.room_manager.get_next_pool_task("carol")
+        self.room_manager.register_worker("carol")
+
+        other_room = "654321"
+        self.create_single_chunk_room(other_room, 1, 10)
+        self.room_manager.get_next_task(self.room_id, "alice")
+
+        # self.room_id 已有一个任务在渲染，池中的客户端先被分到另一个房间
+        room_id, task = self.room_manager.get_next_pool_task("carol")
+        self.assertEqual(room_id, other_room)
+        self.assertEqual(task["client"], "carol")
+        room_id, task = self.room_manager.get_next_pool_task("carol")
+        self.assertEqual(room_id, self.room_id)
+
+    def test_pool_prefers_higher_priority_room(self):
+        self.room_manager.register_worker("carol")
+        room_id = "654321"
+        self.create_single_chunk_room(room_id, 1, 10)
+        self.room_manager.set_schedule(room_id, priority=5)
+        self.room_manager.get_next_task(room_id, "alice")
+        self.assertEqual(self.room_manager.get_next_pool_task("carol")[0], room_id)
+
+    def create_two_file_room(self, room_id):
+        self.room_manager.create_room(room_id, {
+            "room_id": room_id, "status": "waiting", "members": [{"id": "alice", "order": 0}],
+            "blender_files": [
+                {"file_name": "plate.blend", "upload_order": 0,
+                 "render_settings": {"start_frame": 1, "end_frame": 2, "seconds_per_frame": 100}},
+                {"file_name": "review.blend", "upload_order": 1,
+                 "render_settings": {"start_frame": 1, "end_frame": 2, "seconds_per_frame": 100}}]
+        })
+        self.room_manager.trigger_rendering(room_id)
+
+    def test_earliest_deadline_is_rendered_first(self):
+        room_id = "654321"
+        self.create_two_file_room(room_id)
+        self.room_manager.set_schedule(room_id, "review.blend", deadline="2999-01-01T18:00:00")
+        self.assertEqual(self.room_manager.get_next_task(room_id, "alice")["file_name"], "review.blend")
+
+        status = self.room_manager.get_room_status(room_id)
+        self.assertEqual([report["file_name"] for report in status["deadlines"]], ["review.blend"])
+        self.assertTrue(status["deadlines"][0]["reachable"])
+
+    def test_priority_and_starvation_protection(self):
+        room_id = "654321"
+        self.create_two_file_room(room_id)
+        self.room_manager.set_schedule(room_id, "review.blend", priority=10)
+        self.assertEqual(self.room_manager.get_next_task(room_id, "alice")["file_name"], "review.blend")
+
+        # 等待太久的低优先级任务排到最前面
+        plate = [task for task in self.room_manager.get_tasks(room_id) if task["file_name"] == "plate.blend"][0]
+        self.room_manager.transition_task(room_id, plate["id"], {}, {"queued_at": 0})
+        self.assertEqual(self.room_manager.get_next_task(room_id, "alice")["id"], plate["id"])
+
+    def test_requeued_task_waits_behind_starving_file(self):
+        room_id = "654321"
+        with patch.object(room_manager_module.time, 'time', return_value=1000.0):
+            self.create_two_file_room(room_id)
+            self.room_manager.set_schedule(room_id, "review.blend", priority=10)
+            self.assertEqual(self.room_manager.get_next_task(room_id, "alice")["file_name"], "review.blend")
+            self.assertEqual(self.room_manager.get_next_task(room_id, "alice")["file_name"], "review.blend")
+
+        # 两个 review 任务的租约过期后重新入队，入队时间从头算；plate 从一开始就在等待，已经等待太久
+        later = 1000.0 + room_manager_module.TASK_LEASE_SECONDS + schedule_module.TASK_MAX_WAIT_SECONDS + 1
+        with patch.object(room_manager_module.time, 'time', return_value=later):
+            task = self.room_manager.get_next_task(room_id, "alice")
+        self.assertEqual(task["file_name"], "plate.blend")
+        requeued = [task for task in self.room_manager.get_tasks(room_id) if task["file_name"] == "review.blend"]
+        self.assertEqual({task["queued_at"] for task in requeued}, {later})
+
+    def test_remove_blend_file_drops_its_tasks(self):
+        room_id = "654321"
+        self.create_two_file_room(room_id)
+        with self.assertRaises(ValueError):
+            self.room_manager.remove_blend_file(room_id, "missing.blend")
+        self.room_manager.remove_blend_file(room_id, "plate.blend")
+
+        for room_manager in (self.room_manager, self.create_room_manager()):
+            self.assertEqual([task["file_name"] for task in room_manager.get_tasks(room_id)],
+                             ["review.blend", "review.blend"])
+            self.assertEqual(room_manager.query_tasks(room_id, file_name="plate.blend")["tasks"], [])
+            self.assertEqual([(blender_file["file_name"], blender_file["upload_order"])
+                              for blender_file in room_manager.get_room_settings(room_id)["blender_files"]],
+                             [("review.blend", 0)])
+            if room_manager is not self.room_manager:
+                room_manager.close()
+
+    def test_unreachable_deadline_is_reported(self):
+        room_id = "654321"
+        self.create_two_file_room(room_id)
+        self.room_manager.set_schedule(room_id, deadline="2000-01-01T00:00:00")
+        # Unix 时间戳同样可以作为截止时间
+        self.room_manager.set_schedule(room_id, "review.blend", deadline=946684800)
+        for deadline in ("tomorrow", [2000, 1, 1]):
+            with self.assertRaises(ValueError):
+                self.room_manager.set_schedule(room_id, deadline=deadline)
+        deadlines = self.room_manager.get_room_status(room_id)["deadlines"]
+        self.assertEqual(len(deadlines), 2)
+        self.assertFalse(any(report["reachable"] for report in deadlines))
+
+    def test_task_transitions_are_published(self):
+        last_id = self.room_manager.events.last_id(self.room_id)
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        events = self.room_manager.events.since(self.room_id, last_id)
+        self.assertEqual(events[-1]["type"], "task")
+        self.assertEqual(events[-1]["data"]["id"], task["id"])
+        self.assertEqual(events[-1]["data"]["status"], "rendering")
+
+    def test_task_changes_since_version(self):
+        version, tasks = self.room_manager.get_tasks_versioned(self.room_id)
+        self.assertEqual(self.room_manager.get_task_changes(self.room_id, version)["tasks"], [])
+
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        changes = self.room_manager.get_task_changes(self.room_id, version)
+        self.assertFalse(changes["reset"])
+        self.assertGreater(changes["version"], version)
+        self.assertEqual([t["id"] for t in changes["tasks"]], [task["id"]])
+
+        # 早于任务列表生成时的版本号需要重新拉取完整列表
+        changes = self.room_manager.get_task_changes(self.room_id, 0)
+        self.assertTrue(changes["reset"])
+        self.assertEqual(len(changes["tasks"]), len(tasks))
+
+    def test_room_version_survives_restart(self):
+        self.room_manager.get_next_task(self.room_id, "alice")
+        version = self.room_manager.room_version(self.room_id)
+        self.room_manager.close()
+
+        restarted = self.create_room_manager()
+        try:
+            self.assertEqual(restarted.room_version(self.room_id), version)
+        finally:
+            restarted.close()
+
+    def test_query_tasks_filters_and_paginates(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        mine = self.room_manager.query_tasks(self.room_id, status=["rendering"], client="alice")
+        self.assertEqual([t["id"] for t in mine["tasks"]], [task["id"]])
+
+        page = self.room_manager.query_tasks(self.room_id, client="unassigned", limit=1)
+        self.assertEqual(len(page["tasks"]), 1)
+        rest = self.room_manager.query_tasks(self.room_id, client="unassigned", cursor=page["next_cursor"])
+        self.assertEqual(len(rest["tasks"]), 1)
+        self.assertIsNone(rest["next_cursor"])
+        self.assertNotEqual(page["tasks"][0]["id"], rest["tasks"][0]["id"])
+
+    def test_task_stats_are_maintained_incrementally(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        self.room_manager.complete_task(self.room_id, task["id"], "alice")
+        stats = self.room_manager.get_task_stats(self.room_id)
+        self.assertEqual(stats["files"]["scene.blend"]["tasks"], {"done": 1, "triggered": 2})
+        self.assertEqual(stats["files"]["scene.blend"]["frames_done"], 1)
+        self.assertEqual(stats["files"]["scene.blend"]["frames_remaining"], 2)
+        self.assertEqual(stats["clients"]["alice"]["frames_done"], 1)
+
+        rebuilt = TaskIndex(self.room_manager.get_tasks(self.room_id)).stats()
+        self.assertEqual({key: stats[key] for key in ("files", "clients")}, rebuilt)
+
+    def test_state_survives_restart_after_flush(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        self.room_manager.close()
+
+        restarted = self.create_room_manager()
+        try:
+            self.assertEqual(restarted.get_room_settings(self.room_id)["status"], "triggered")
+            reloaded = [t for t in restarted.get_tasks(self.room_id) if t["id"] == task["id"]][0]
+            self.assertEqual(reloaded["client"], "alice")
+        finally:
+            restarted.close()
+
+    def test_non_member_cannot_pull(self):
+        with self.assertRaises(ValueError):
+            self.room_manager.get_next_task(self.room_id, "mallory")
+
+class TestTaskQueueSqlite(TestTaskQueue):
+    def create_room_manager(self):
+        return RoomManager(store=SqliteStateStore(os.path.join(self.rooms_folder, "state.db")))
+
+    def test_task_update_is_single_row(self):
+        task = self.room_manager.get_next_task(self.room_id, "alice")
+        store = SqliteStateStore(os.path.join(self.rooms_folder, "state.db"))
+        try:
+            rows = store._conn.execute(
+                "SELECT task_id, status, client FROM tasks WHERE room_id = ? AND status = 'rendering'",
+                (self.room_id,)).fetchall()
+            self.assertEqual(rows, [(task["id"], "rendering", "alice")])
+            self.assertEqual([member["id"] for member in store.load_room(self.room_id)["members"]], ["alice", "bob"])
+        finally:
+            store.close()
+
+    def test_room_without_tasks_is_cached(self):
+        self.room_manager.create_room("654321", {
+            "room_id": "654321", "status": "waiting", "members": [{"id": "alice", "order": 0}], "blender_files": []})
+        self.room_manager.close()
+        self.room_manager = self.create_room_manager()
+        self.assertEqual(self.room_manager.get_tasks("654321"), [])
+        with patch.object(self.room_manager._store, 'load_tasks', side_effect=AssertionError("queried again")):
+            self.assertEqual(self.room_manager.get_tasks("654321"), [])
+
+    def test_schedule_survives_restart(self):
+        self.room_manager.set_schedule(self.room_id, "scene.blend", priority=5, deadline="2030-01-01T00:00:00")
+        self.room_manager.close()
+        self.room_manager = self.create_room_manager()
+
+        blend_file = self.room_manager.get_room_settings(self.room_id)["blender_files"][0]
+        self.assertEqual(blend_file["priority"], 5)
+        self.assertEqual(blend_file["deadline"], "2030-01-01T00:00:00")
+        self.assertEqual(blend_file["render_settings"]["seconds_per_frame"], 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import os
+import io
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.upload_session import UploadSessionStore, IncompleteUploadError
+
+class TestUploadSession(unittest.TestCase):
+    def setUp(self):
+        self.rooms_folder = tempfile.mkdtemp()
+        self.store = UploadSessionStore(self.rooms_folder, ttl=3600)
+        self.data = os.urandom(2500)
+        self.session = self.store.create("123456", "scene.blend", len(self.data), chunk_size=1000)
+        self.target = os.path.join(self.rooms_folder, "123456", "queue")
+
+    def tearDown(self):
+        shutil.rmtree(self.rooms_folder)
+
+    def upload(self, index):
+        chunk = self.data[index * 1000:(index + 1) * 1000]
+        return self.store.write_chunk("123456", self.session["upload_id"], index, io.BytesIO(chunk))
+
+    def test_chunks_in_any_order_assemble_atomically(self):
+        self.assertEqual(self.session["total_chunks"], 3)
+        for index in (2, 0, 1):
+            self.upload(index)
+        path = self.store.commit("123456", self.session["upload_id"], self.target,
+                                 hashlib.sha256(self.data).hexdigest())
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(self.target), ["scene.blend"])
+        with self.assertRaises(KeyError):
+            self.store.get("123456", self.session["upload_id"])
+
+    def test_commit_does_not_block_other_sessions(self):
+        other = self.store.create("123456", "shot.blend", 3)
+        self.store.write_chunk("123456", other["upload_id"], 0, io.BytesIO(b"abc"))
+        # 另一个会话正在提交（持有它自己的锁）时，这个会话的提交不需要等待
+        with self.store._session_lock(self.session["upload_id"]):
+            committed = []
+            thread = threading.Thread(target=lambda: committed.append(
+                self.store.commit("123456", other["upload_id"], self.target)))
+            thread.start()
+            thread.join(5)
+        self.assertEqual(committed, [os.path.join(self.target, "shot.blend")])
+
+    def test_missing_chunks_are_reported(self):
+        self.upload(1)
+        session = self.store.get("123456", self.session["upload_id"])
+        self.assertEqual(session["missing"], [0, 2])
+        self.assertEqual(session["received_bytes"], 1000)
+        with self.assertRaises(IncompleteUploadError) as ctx:
+            self.store.commit("123456", self.session["upload_id"], self.target)
+        self.assertEqual(ctx.exception.missing, [0, 2])
+
+    def test_wrong_length_and_checksum_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.store.write_chunk("123456", self.session["upload_id"], 0, io.BytesIO(b"short"))
+        with self.assertRaises(ValueError):
+            self.store.write_chunk("123456", self.session["upload_id"], 0, io.BytesIO(self.data[:1000]),
+                                   checksum=hashlib.sha256(b"other").hexdigest())
+        with self.assertRaises(ValueError):
+            self.store.write_chunk("123456", self.session["upload_id"], 3, io.BytesIO(b""))
+        self.assertEqual(self.store.get("123456", self.session["upload_id"])["missing"], [0, 1, 2])
+
+    def test_checksum_mismatch_leaves_no_file(self):
+        for index in range(3):
+            self.upload(index)
+        with self.assertRaises(ValueError):
+            self.store.commit("123456", self.session["upload_id"], self.target, "0" * 64)
+        self.assertEqual(os.listdir(self.target), [])
+        self.assertEqual(self.store.get("123456", self.session["upload_id"])["missing"], [])
+
+    def test_unknown_or_malformed_session(self):
+        with self.assertRaises(KeyError):
+            self.store.get("123456", "../../etc")
+        with self.assertRaises(KeyError):
+            self.store.get("123456", "0" * 32)
+
+    def test_expired_sessions_are_removed(self):
+        self.store.cleanup_expired("123456", now=os.path.getmtime(self.rooms_folder) + 7200)
+        with self.assertRaises(KeyError):
+            self.store.get("123456", self.session["upload_id"])
+
+if __name__ == '__main__':
+    unittest.main()
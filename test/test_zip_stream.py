@@ -0,0 +1,49 @@
+import unittest
+import os
+import io
+import sys
+import shutil
+import zipfile
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.zip_stream import stream_zip, parse_frame_ranges, frame_in_ranges
+
+class TestZipStream(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.png = os.path.join(self.folder, "frame_0001.png")
+        self.log = os.path.join(self.folder, "render.log")
+        with open(self.png, 'wb') as f:
+            f.write(os.urandom(300000))
+        with open(self.log, 'w') as f:
+            f.write("Saved: frame_0001.png\n" * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_archive_is_streamed_in_chunks(self):
+        chunks = list(stream_zip([(self.png, "task/frame_0001.png"), (self.log, "render.log")], chunk_size=65536))
+        self.assertGreater(len(chunks), 3)
+        self.assertTrue(all(len(chunk) < 200000 for chunk in chunks))
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.getinfo("task/frame_0001.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("render.log").compress_type, zipfile.ZIP_DEFLATED)
+            with open(self.png, 'rb') as f:
+                self.assertEqual(zf.read("task/frame_0001.png"), f.read())
+
+    def test_frame_ranges(self):
+        ranges = parse_frame_ranges("1-10, 15")
+        self.assertEqual(ranges, [(1, 10), (15, 15)])
+        self.assertTrue(frame_in_ranges(15, ranges))
+        self.assertFalse(frame_in_ranges(11, ranges))
+        self.assertFalse(frame_in_ranges(None, ranges))
+        with self.assertRaises(ValueError):
+            parse_frame_ranges("a-b")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import re
+import time
+from collections import deque
+
+# Blender 每写完一帧输出一行 Saved: '/path/frame_0001.png'
+SAVED_LINE = re.compile(r"Saved:\s*['\"]?(?P<path>[^'\"]+)['\"]?")
+FRAME_FILE = re.compile(r"frame_(\d+)\.")
+# Fra:12 Mem:85.21M (Peak 120.50M) | Time:00:03.21 | Remaining:00:10.40 | ... | Sample 32/128
+FRA_LINE = re.compile(r"^Fra:(?P<frame>\d+)\b")
+ELAPSED = re.compile(r"\|\s*Time:(?P<time>[\d:.]+)")
+REMAINING = re.compile(r"Remaining:(?P<time>[\d:.]+)")
+PEAK_MEMORY = re.compile(r"Peak\s+(?P<memory>[\d.]+)M")
+# Cycles 2.8x/4.x 输出 "Sample 32/128"，Cycles 3.x 和 Eevee 输出 "Rendering 32 / 128 samples"
+SAMPLE = re.compile(r"(?:Sample (?P<a>\d+)/(?P<b>\d+))|(?:Rendering (?P<c>\d+) / (?P<d>\d+) samples)")
+# 每帧保存后的汇总行： Time: 00:05.30 (Saving: 00:00.18)
+TIME_LINE = re.compile(r"^\s*Time:\s*(?P<time>[\d:.]+)(?:\s*\(Saving:\s*(?P<saving>[\d:.]+)\))?")
+
+def parse_saved_frame(line):
+    """从 Blender 的 Saved: 行中解析帧号，不是 Saved 行时返回 None"""
+    match = SAVED_LINE.search(line)
+    if not match:
+        return None
+    return frame_number_from_filename(match.group("path").strip())
+
+def frame_number_from_filename(filename):
+    """frame_0012.png -> 12，不是帧文件时返回 None"""
+    match = FRAME_FILE.search(os.path.basename(filename))
+    return int(match.group(1)) if match else None
+
+def parse_duration(value):
+    """"01:02:03.45" / "02:03.45" / "3.45" -> 秒"""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+class BlenderOutputParser:
+    """逐行解析 Blender 的标准输出，产生结构化事件：
+
+    - frame_started {frame}
+    - progress {frame, sample, samples, elapsed, remaining, peak_memory}
+    - saved {frame, path}
+    - frame_done {frame, path, seconds, saving_seconds}
+
+    frame_done 在 Saved 之后的 Time: 汇总行产生；没有汇总行的版本在下一帧开始或输出结束时产生，
+    耗时按该帧第一行输出到保存之间的时间估计。
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._frame = None
+        self._frame_started_at = None
+        self._saved = None
+
+    def feed(self, line):
+        events = []
+        fra = FRA_LINE.match(line)
+        if fra:
+            frame = int(fra.group("frame"))
+            if frame != self._frame:
+                events.extend(self._finish_saved())
+                self._frame = frame
+                self._frame_started_at = self._clock()
+                events.append({"type": "frame_started", "frame": frame})
+            sample = SAMPLE.search(line)
+            elapsed = ELAPSED.search(line)
+            remaining = REMAINING.search(line)
+            peak = PEAK_MEMORY.search(line)
+            if sample or elapsed:
+                events.append({
+                    "type": "progress",
+                    "frame": frame,
+                    "sample": int(sample.group("a") or sample.group("c")) if sample else None,
+                    "samples": int(sample.group("b") or sample.group("d")) if sample else None,
+                    "elapsed": parse_duration(elapsed.group("time")) if elapsed else None,
+                    "remaining": parse_duration(remaining.group("time")) if remaining else None,
+                    "peak_memory": float(peak.group("memory")) if peak else None
+                })
+            return events
+
+        saved = SAVED_LINE.search(line)
+        if saved:
+            path = saved.group("path").strip()
+            frame = frame_number_from_filename(path)
+            if frame is None:
+                return events
+            events.extend(self._finish_saved())
+            self._saved = {"frame": frame, "path": path, "saved_at": self._clock()}
+            events.append({"type": "saved", "frame": frame, "path": path})
+            return events
+
+        summary = TIME_LINE.match(line)
+        if summary and self._saved is not None:
+            saved, self._saved = self._saved, None
+            events.append({"type": "frame_done", "frame": saved["frame"], "path": saved["path"],
+                           "seconds": parse_duration(summary.group("time")),
+                           "saving_seconds": parse_duration(summary.group("saving")) if summary.group("saving") else None})
+        return events
+
+    def finish(self):
+        """输出结束时调用，补发最后一帧的 frame_done"""
+        return self._finish_saved()
+
+    def _finish_saved(self):
+        if self._saved is None:
+            return []
+        saved, self._saved = self._saved, None
+        seconds = None
+        if self._frame == saved["frame"] and self._frame_started_at is not None:
+            seconds = saved["saved_at"] - self._frame_started_at
+        return [{"type": "frame_done", "frame": saved["frame"], "path": saved["path"],
+                 "seconds": seconds, "saving_seconds": None}]
+
+class BlenderLog:
+    """Blender 原始输出的去处：写入按大小轮转的日志文件，内存中只保留最后 tail_lines 行。
+
+    path 为 None 时不写文件，只保留末尾若干行用于报错。
+    """
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024, backups=3, tail_lines=200):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._tail = deque(maxlen=tail_lines)
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, line):
+        self._tail.append(line)
+        if self._file is None:
+            return
+        self._file.write(line)
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def tail(self):
+        return "".join(self._tail)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
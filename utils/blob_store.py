@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import threading
+from config import BLOB_FOLDER
+from utils.checksum import file_sha256
+
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+class BlobStore:
+    """按 SHA-256 寻址的 blend 文件存储，相同内容在所有房间中只保存一份。
+
+    文件保存为 <root>/<前两位>/<sha256>，房间的 queue/<file_name> 是指向它的硬链接，
+    其余读取 queue 目录的代码不需要改动。refs.json 记录每个 blob 被哪些
+    "<room_id>/<file_name>" 引用，最后一个引用释放时删除 blob。
+    """
+
+    def __init__(self, root=None):
+        self.root = root or BLOB_FOLDER
+        self._lock = threading.Lock()
+        self._refs = None
+
+    def has(self, sha256):
+        return bool(_SHA256.match(sha256 or "")) and os.path.exists(self._blob_path(sha256))
+
+    def link(self, room_id, file_name, sha256, target_dir):
+        """让 target_dir/file_name 引用已有的 blob，blob 不存在时抛出 KeyError"""
+        with self._lock:
+            if not self.has(sha256):
+                raise KeyError(f"Blob {sha256} not found")
+            self._link(room_id, file_name, sha256, target_dir)
+            return os.path.join(target_dir, file_name)
+
+    def adopt(self, room_id, file_name, path, target_dir, sha256=None):
+        """把刚上传的文件收入存储并链接到 target_dir/file_name，返回 sha256。
+
+        已有相同内容的 blob 时直接删除上传的文件。path 需要和存储在同一个文件系统上。
+        """
+        sha256 = (sha256 or file_sha256(path)).lower()
+        with self._lock:
+            blob_path = self._blob_path(sha256)
+            if os.path.exists(blob_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+            self._link(room_id, file_name, sha256, target_dir)
+        return sha256
+
+    def release(self, room_id, file_name):
+        """释放房间对文件的引用，返回该 blob 剩余的引用数（没有引用时为 None）"""
+        with self._lock:
+            refs = self._load_refs()
+            ref = f"{room_id}/{file_name}"
+            for sha256, owners in refs.items():
+                if ref in owners:
+                    owners.remove(ref)
+                    if not owners:
+                        del refs[sha256]
+                        if os.path.exists(self._blob_path(sha256)):
+                            os.remove(self._blob_path(sha256))
+                    self._save_refs()
+                    return len(owners)
+            return None
+
+    def lookup(self, room_id, file_name, path):
+        """返回房间中 path（queue/<file_name>）引用的 blob 的 sha256，不是该 blob 的硬链接时返回 None"""
+        with self._lock:
+            ref = f"{room_id}/{file_name}"
+            sha256 = next((sha256 for sha256, owners in self._load_refs().items() if ref in owners), None)
+        if sha256 is None:
+            return None
+        try:
+            return sha256 if os.path.samefile(path, self._blob_path(sha256)) else None
+        except OSError:
+            return None
+
+    def refcount(self, sha256):
+        with self._lock:
+            return len(self._load_refs().get(sha256, []))
+
+    def _link(self, room_id, file_name, sha256, target_dir):
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, file_name)
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(self._blob_path(sha256), tmp_path)
+        except OSError:
+            # 不支持硬链接的文件系统上退回到复制
+            shutil.copyfile(self._blob_path(sha256), tmp_path)
+        os.replace(tmp_path, target)
+
+        refs = self._load_refs()
+        ref = f"{room_id}/{file_name}"
+        for other, owners in list(refs.items()):
+            if ref in owners and other != sha256:
+                owners.remove(ref)
+                if not owners:
+                    del refs[other]
+                    os.remove(self._blob_path(other))
+        owners = refs.setdefault(sha256, [])
+        if ref not in owners:
+            owners.append(ref)
+        self._save_refs()
+
+    def _load_refs(self):
+        if self._refs is None:
+            path = os.path.join(self.root, "refs.json")
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self._refs = json.load(f)
+            else:
+                self._refs = {}
+        return self._refs
+
+    def _save_refs(self):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, "refs.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._refs, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
@@ -0,0 +1,30 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+CHUNK_SIZE = 1024 * 1024
+CACHE_SIZE = 1024
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    """计算文件的 SHA-256（十六进制）。按路径、大小和修改时间缓存最近用到的 CACHE_SIZE 个文件，
+    文件不变时不会重复计算"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    with _cache_lock:
+        _cache[key] = digest.hexdigest()
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return digest.hexdigest()
@@ -0,0 +1,39 @@
+import math
+from config import CHUNK_TARGET_SECONDS, CHUNK_MIN_SECONDS, DEFAULT_SECONDS_PER_FRAME
+
+def estimate_seconds_per_frame(blender_file):
+    """优先使用实测的单帧耗时，其次是渲染设置里的估计值，最后用默认值"""
+    for value in (blender_file.get("seconds_per_frame"),
+                  blender_file.get("render_settings", {}).get("seconds_per_frame")):
+        if value:
+            return float(value)
+    return float(DEFAULT_SECONDS_PER_FRAME)
+
+def plan_chunks(segments, member_count, target_seconds=CHUNK_TARGET_SECONDS, min_seconds=CHUNK_MIN_SECONDS):
+    """按预计耗时把帧范围切成任务块。
+
+    segments 是按渲染顺序排列的 {"file_name", "start_frame", "end_frame", "seconds_per_frame"}。
+    每块的预计耗时取剩余总工作量的 1/(2*成员数)，上限 target_seconds，下限 min_seconds：
+    前面的块较大以减少任务开销，越接近结尾块越小，避免最后几个任务让其他成员空等。
+    返回 (file_name, start_frame, end_frame) 列表。
+    """
+    member_count = max(1, member_count)
+    remaining_seconds = sum((segment["end_frame"] - segment["start_frame"] + 1) * segment["seconds_per_frame"]
+                            for segment in segments)
+    chunks = []
+    for segment in segments:
+        seconds_per_frame = max(segment["seconds_per_frame"], 1e-6)
+        frame = segment["start_frame"]
+        while frame <= segment["end_frame"]:
+            size = chunk_frames(seconds_per_frame, remaining_seconds, member_count, target_seconds, min_seconds)
+            end_frame = min(frame + size - 1, segment["end_frame"])
+            chunks.append((segment["file_name"], frame, end_frame))
+            remaining_seconds -= (end_frame - frame + 1) * seconds_per_frame
+            frame = end_frame + 1
+    return chunks
+
+def chunk_frames(seconds_per_frame, remaining_seconds, member_count,
+                 target_seconds=CHUNK_TARGET_SECONDS, min_seconds=CHUNK_MIN_SECONDS):
+    """按剩余总工作量计算下一块的帧数，seconds_per_frame 可以是某个客户端的实测值"""
+    chunk_seconds = min(target_seconds, max(min_seconds, remaining_seconds / (2 * max(1, member_count))))
+    return max(1, math.floor(chunk_seconds / max(seconds_per_frame, 1e-6)))
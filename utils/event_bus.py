@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import deque
+
+class EventBus:
+    """按房间分发状态变化事件，供 SSE 和长轮询使用。
+
+    每个房间的事件带有递增的序号并保留最近 history 条。订阅方用最后收到的序号
+    调用 wait()；序号早于保留范围（或服务器重启后序号重新开始）时返回一个 reset 事件，
+    订阅方应重新拉取完整状态。
+    """
+
+    def __init__(self, history=1000):
+        self._history = history
+        self._rooms = {}
+        self._guard = threading.Lock()
+
+    def publish(self, room_id, event_type, data):
+        room = self._room(room_id)
+        with room["cond"]:
+            room["seq"] += 1
+            room["events"].append({"id": room["seq"], "type": event_type, "time": time.time(), "data": data})
+            room["cond"].notify_all()
+            return room["seq"]
+
+    def last_id(self, room_id):
+        room = self._room(room_id)
+        with room["cond"]:
+            return room["seq"]
+
+    def since(self, room_id, last_id):
+        """返回序号大于 last_id 的事件，last_id 为 None 表示只关心之后的新事件"""
+        room = self._room(room_id)
+        with room["cond"]:
+            return self._since(room, last_id)
+
+    def wait(self, room_id, last_id, timeout):
+        """阻塞直到有序号大于 last_id 的事件或超时，返回事件列表（超时时为空）"""
+        room = self._room(room_id)
+        deadline = time.monotonic() + timeout
+        with room["cond"]:
+            if last_id is None:
+                last_id = room["seq"]
+            while True:
+                events = self._since(room, last_id)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                room["cond"].wait(remaining)
+
+    def _since(self, room, last_id):
+        if last_id is None or last_id == room["seq"]:
+            return []
+        events = room["events"]
+        oldest = events[0]["id"] if events else room["seq"] + 1
+        if last_id > room["seq"] or last_id < oldest - 1:
+            return [{"id": room["seq"], "type": "reset", "time": time.time(), "data": {}}]
+        return [event for event in events if event["id"] > last_id]
+
+    def _room(self, room_id):
+        with self._guard:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = {"seq": 0, "events": deque(maxlen=self._history),
+                                               "cond": threading.Condition()}
+            return room
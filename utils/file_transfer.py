@@ -4,7 +4,12 @@ import os
 from tqdm import tqdm
 import zipfile
 import io
+import json
+import uuid
+import hashlib
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from utils.checksum import file_sha256
 
 async def upload_batch(url, file_paths):
     async with aiohttp.ClientSession() as session:
@@ -52,6 +57,61 @@ async def main():
 if __name__ == "__main__":
     asyncio.run(main())
 
+class MultipartStream:
+    """按顺序读取的 multipart/form-data 请求体，文件内容在发送时才逐块从磁盘读出。
+
+    实现了 __len__，requests 会带上 Content-Length 直接流式发送，而不是先在内存中拼出整个请求体。
+    """
+
+    def __init__(self, fields, files, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self._parts = []
+        for name, value in fields.items():
+            self._parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                               f'{value}\r\n'.encode("utf-8"))
+        for name, path in files:
+            self._parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                               f'filename="{os.path.basename(path)}"\r\n'
+                               f'Content-Type: application/octet-stream\r\n\r\n'.encode("utf-8"))
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode("utf-8"))
+        self._length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self._parts)
+        self._index = 0
+        self._current = None
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size if size is not None and size >= 0 else None
+        while remaining is None or remaining > 0:
+            if self._current is None:
+                if self._index >= len(self._parts):
+                    break
+                part = self._parts[self._index]
+                self._index += 1
+                self._current = io.BytesIO(part) if isinstance(part, bytes) else open(part, 'rb')
+            data = self._current.read(-1 if remaining is None else remaining)
+            if not data:
+                self._current.close()
+                self._current = None
+                continue
+            chunks.append(data)
+            if remaining is not None:
+                remaining -= len(data)
+        return b"".join(chunks)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
 def upload_file(file_path, url, data=None):
     try:
         with open(file_path, 'rb') as file:
@@ -62,16 +122,117 @@ def upload_file(file_path, url, data=None):
         print(f"Error uploading file: {str(e)}")
         return False
 
-def download_file(url, local_path):
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            with open(local_path, 'wb') as file:
-                file.write(response.content)
-            return True
-        else:
-            print(f"Failed to download file. Status code: {response.status_code}")
+def download_file(url, local_path, retries=3, chunk_size=1024 * 1024):
+    """下载到 local_path.part，连接中断后用 Range 请求从已下载的位置续传。
+
+    服务器返回 X-Checksum-SHA256 时，完成后校验整个文件，不一致则删除 .part 重新下载。
+    校验通过后把 .part 原子地重命名为 local_path。
+    """
+    directory = os.path.dirname(local_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    part_path = local_path + ".part"
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+                checksum = response.headers.get("X-Checksum-SHA256")
+                if response.status_code == 416:
+                    # .part 已经完整（或比服务器上的文件还大），没有校验和可以确认时从头下载
+                    if not checksum:
+                        os.remove(part_path)
+                        continue
+                elif response.status_code in (200, 206):
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    with open(part_path, mode) as file:
+                        for chunk in response.iter_content(chunk_size):
+                            file.write(chunk)
+                else:
+                    print(f"Failed to download file. Status code: {response.status_code}")
+                    return False
+        except requests.RequestException as e:
+            print(f"Download interrupted ({str(e)}), resuming ({attempt + 1}/{retries})")
+            continue
+        except Exception as e:
+            print(f"Error downloading file: {str(e)}")
             return False
-    except Exception as e:
-        print(f"Error downloading file: {str(e)}")
-        return False
\ No newline at end of file
+
+        if checksum and file_sha256(part_path) != checksum:
+            print(f"Checksum mismatch for {local_path}, downloading again")
+            os.remove(part_path)
+            continue
+        os.replace(part_path, local_path)
+        return True
+    print(f"Failed to download {url} after {retries + 1} attempts")
+    return False
+
+def upload_file_chunked(file_path, base_url, room_id, chunk_size=None, parallelism=4, retries=3):
+    """通过分块上传会话上传大文件，分块并行发送，失败的分块单独重试。
+
+    会话 ID 保存在 <file_path>.upload 中，上传被中断后再次调用只补传服务器缺失的分块；
+    文件内容变化（大小或修改时间不同）时重新开始。全部分块完成后带着 SHA-256 提交。
+    """
+    state_path = file_path + ".upload"
+    stat = os.stat(file_path)
+    session = _resume_upload_session(state_path, stat, base_url, room_id)
+    if session is None:
+        payload = {"room_id": room_id, "file_name": os.path.basename(file_path), "size": stat.st_size}
+        if chunk_size:
+            payload["chunk_size"] = chunk_size
+        response = requests.post(f"{base_url}/upload_session", json=payload)
+        if response.status_code != 200:
+            print(f"Failed to start upload session: {response.text}")
+            return False
+        session = response.json()
+        session["missing"] = list(range(session["total_chunks"]))
+        with open(state_path, 'w') as f:
+            json.dump({"upload_id": session["upload_id"], "size": stat.st_size, "mtime": stat.st_mtime}, f)
+
+    upload_id = session["upload_id"]
+
+    def send_chunk(index):
+        with open(file_path, 'rb') as f:
+            f.seek(index * session["chunk_size"])
+            data = f.read(session["chunk_size"])
+        headers = {"X-Checksum-SHA256": hashlib.sha256(data).hexdigest()}
+        for attempt in range(retries + 1):
+            try:
+                response = requests.put(f"{base_url}/upload_session/{upload_id}/chunk/{index}",
+                                        params={"room_id": room_id}, data=data, headers=headers, timeout=300)
+                if response.status_code == 200:
+                    return True
+                print(f"Chunk {index} rejected: {response.text}")
+            except requests.RequestException as e:
+                print(f"Chunk {index} failed ({str(e)}), retrying ({attempt + 1}/{retries})")
+        return False
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        if not all(tqdm(executor.map(send_chunk, session["missing"]), total=len(session["missing"]),
+                        desc=f"Uploading {os.path.basename(file_path)}", unit="chunk")):
+            print("Upload incomplete, run again to resume")
+            return False
+
+    response = requests.post(f"{base_url}/upload_session/{upload_id}/commit",
+                             json={"room_id": room_id, "sha256": file_sha256(file_path)})
+    if response.status_code != 200:
+        print(f"Failed to commit upload: {response.text}")
+        if response.status_code in (400, 404):
+            os.remove(state_path)
+        return False
+    os.remove(state_path)
+    return True
+
+def _resume_upload_session(state_path, stat, base_url, room_id):
+    """读取本地保存的会话，文件未变化且服务器上会话仍存在时返回会话信息（含缺失分块）"""
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+    if state.get("size") != stat.st_size or state.get("mtime") != stat.st_mtime:
+        return None
+    try:
+        response = requests.get(f"{base_url}/upload_session/{state['upload_id']}", params={"room_id": room_id})
+    except requests.RequestException:
+        return None
+    return response.json() if response.status_code == 200 else None
@@ -0,0 +1,65 @@
+import queue
+import logging
+import threading
+
+class FrameUploader:
+    """后台上传线程：渲染过程中每写完一帧就放入队列立即上传，渲染和上传同时进行。
+
+    upload_func(path) 返回是否上传成功，失败的帧最多重试 retries 次，第 n 次重试前等待
+    backoff * 2**(n-1) 秒；成功后调用 on_uploaded(frame)。客户端在任务中途掉线时，
+    已经上传的帧保存在服务器上，任务被回收后不会重新渲染。
+    """
+
+    def __init__(self, upload_func, on_uploaded=None, retries=3, backoff=1.0):
+        self._upload_func = upload_func
+        self._on_uploaded = on_uploaded
+        self._retries = retries
+        self._backoff = backoff
+        self._stop = threading.Event()
+        self._queue = queue.Queue()
+        self.uploaded = {}
+        self.failed = {}
+        self._thread = threading.Thread(target=self._run, name="frame-uploader", daemon=True)
+        self._thread.start()
+
+    def put(self, frame, path):
+        self._queue.put((frame, path))
+
+    def close(self, timeout=None):
+        """等待队列中的帧全部处理完，返回 {帧号: 路径}（已上传的帧）。
+
+        timeout 秒后仍未处理完时不再等待，后台线程做完当前这一帧后放弃剩下的帧，
+        没有出现在返回值中的帧由调用方自己补传。
+        """
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(f"Frame uploads did not finish within {timeout}s, leaving the rest to the batch upload")
+            self._stop.set()
+        return dict(self.uploaded)
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self._queue.get()
+            if item is None:
+                return
+            frame, path = item
+            for attempt in range(self._retries + 1):
+                try:
+                    if self._upload_func(path):
+                        break
+                except Exception as e:
+                    logging.error(f"Failed to upload frame {frame}: {str(e)}")
+                if attempt < self._retries:
+                    logging.warning(f"Retrying upload of frame {frame} ({attempt + 1}/{self._retries})")
+                    if self._stop.wait(self._backoff * 2 ** attempt):
+                        return
+            else:
+                self.failed[frame] = path
+                continue
+            self.uploaded[frame] = path
+            if self._on_uploaded is not None:
+                try:
+                    self._on_uploaded(frame)
+                except Exception as e:
+                    logging.error(f"Failed to report uploaded frame {frame}: {str(e)}")
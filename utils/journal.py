@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import logging
+import threading
+
+class RoomJournal:
+    """每个房间一个只追加的 journal.jsonl，记录状态变化。
+
+    append() 只写入操作系统缓冲区，fsync 由后台线程按 fsync_interval 批量执行，
+    多次追加共享一次 fsync。compact() 在持有房间锁的情况下写快照并清空日志。
+    """
+
+    def __init__(self, rooms_folder, fsync_interval=0.05):
+        self.rooms_folder = rooms_folder
+        self._fsync_interval = fsync_interval
+        self._files = {}
+        self._locks = {}
+        self._unsynced = set()
+        self._guard = threading.Lock()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def path(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "log", "journal.jsonl")
+
+    def read(self, room_id):
+        """按顺序返回日志中的记录，忽略崩溃时写了一半的最后一行"""
+        path = self.path(room_id)
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping torn journal record in {path}")
+        return records
+
+    def append(self, room_id, record):
+        line = json.dumps(record) + "\n"
+        with self._lock(room_id):
+            f = self._file(room_id)
+            f.write(line)
+            f.flush()
+        with self._cond:
+            self._unsynced.add(room_id)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="journal-fsync", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def compact(self, room_id, write_snapshot):
+        """调用 write_snapshot() 写出完整快照，成功后清空该房间的日志"""
+        with self._lock(room_id):
+            write_snapshot()
+            if os.path.exists(self.path(room_id)):
+                f = self._file(room_id)
+                f.truncate(0)
+                os.fsync(f.fileno())
+
+    def sync(self):
+        with self._cond:
+            room_ids, self._unsynced = self._unsynced, set()
+        for room_id in room_ids:
+            with self._lock(room_id):
+                f = self._files.get(room_id)
+                if f is not None and not f.closed:
+                    os.fsync(f.fileno())
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.sync()
+        if self._thread is not None:
+            self._thread.join(timeout=self._fsync_interval + 5)
+        with self._guard:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    def _lock(self, room_id):
+        with self._guard:
+            return self._locks.setdefault(room_id, threading.Lock())
+
+    def _file(self, room_id):
+        f = self._files.get(room_id)
+        if f is None or f.closed:
+            os.makedirs(os.path.dirname(self.path(room_id)), exist_ok=True)
+            f = open(self.path(room_id), 'a')
+            self._files[room_id] = f
+        return f
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._unsynced and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # 组提交：等待一小段时间，让这期间的追加共享一次 fsync
+                deadline = time.monotonic() + self._fsync_interval
+                while not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error(f"Journal fsync failed: {str(e)}")
@@ -2,6 +2,8 @@ import subprocess
 import os
 import sys
 import json
+import time
+import threading
 import argparse
 import platform
 import logging
@@ -10,13 +12,26 @@ from datetime import datetime
 # 添加项目根目录到 Python 路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import BLENDER_PATH, BLENDER_PYTHON_PATH
+from config import BLENDER_PATH, BLENDER_PYTHON_PATH, BLENDER_LOG_MAX_BYTES, BLENDER_LOG_BACKUPS, BLENDER_LOG_TAIL_LINES
 from utils.get_render_settings import get_render_settings
+from utils.blender_output import BlenderOutputParser, BlenderLog, frame_number_from_filename
 
 # Import logging for error handling
 import logging
 
-def render_blender(blend_file, output_dir, start_frame, end_frame):
+def render_blender(blend_file, output_dir, start_frame, end_frame, on_frame=None, cancel_event=None, on_saved=None,
+                   on_event=None, log_path=None):
+    """渲染 start_frame 到 end_frame，返回最后渲染完成的帧号，失败时返回错误信息。
+
+    on_frame(frame) 会在每帧写盘后被调用，可以返回新的（更小的）结束帧；
+    渲染到新的结束帧后 Blender 进程会被提前结束，超出范围的帧不会保留。
+    cancel_event 被 set 时立即结束 Blender（例如租约已被服务器收回）。
+    on_saved(frame, path) 在 on_frame 之后调用，frame 不超过（可能已缩短的）结束帧时才调用，
+    用于边渲染边上传。
+    on_event(event) 接收 BlenderOutputParser 解析出的每个事件（采样进度、每帧耗时等），
+    frame_done 事件先于该帧的 on_frame 送达。
+    Blender 的原始输出实时写入 log_path（按大小轮转），内存中只保留最后若干行。
+    """
     # 获取当前工作目录的绝对路径
     current_dir = os.path.abspath(os.getcwd())
     
@@ -38,12 +53,68 @@ def render_blender(blend_file, output_dir, start_frame, end_frame):
     ]
 
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        logging.info(result.stdout)
+        # Blender 输出中可能有非 UTF-8 字节（文件路径等），不能因为解码失败中断读取
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                   encoding='utf-8', errors='replace')
+        if cancel_event is not None:
+            threading.Thread(target=_terminate_on_cancel, args=(process, cancel_event), daemon=True).start()
+        parser = BlenderOutputParser()
+        blender_log = BlenderLog(log_path, BLENDER_LOG_MAX_BYTES, BLENDER_LOG_BACKUPS, BLENDER_LOG_TAIL_LINES)
+        stopped_early = False
+
+        def handle(event):
+            nonlocal end_frame, stopped_early
+            if on_event is not None:
+                on_event(event)
+            if event["type"] != "frame_done":
+                return
+            frame = event["frame"]
+            if on_frame is not None:
+                new_end_frame = on_frame(frame)
+                if new_end_frame is not None and new_end_frame < end_frame:
+                    logging.info(f"End frame shrunk from {end_frame} to {new_end_frame}")
+                    end_frame = new_end_frame
+            if on_saved is not None and frame <= end_frame:
+                on_saved(frame, event["path"])
+            if on_frame is not None and frame >= end_frame and not stopped_early:
+                # 剩余的帧已分给其他客户端，不必等 Blender 渲染完
+                stopped_early = True
+                process.terminate()
+
+        try:
+            for line in process.stdout:
+                blender_log.write(line)
+                for event in parser.feed(line):
+                    handle(event)
+            for event in parser.finish():
+                handle(event)
+            returncode = process.wait()
+            output = blender_log.tail()
+        finally:
+            blender_log.close()
+            if process.poll() is None:
+                # 读取输出或回调（上报进度、上传）出错时不留下孤儿 Blender 进程
+                process.kill()
+                process.wait()
+            process.stdout.close()
+        logging.debug(output)
+        if cancel_event is not None and cancel_event.is_set():
+            return "Rendering cancelled"
+        if returncode != 0 and not stopped_early:
+            raise subprocess.CalledProcessError(returncode, cmd, output=output)
         
         # 检查是否所有指定的帧都已渲染
         rendered_frames = [f for f in os.listdir(output_dir_abs) if f.startswith("frame_") and f.endswith(".png")]
-        rendered_frame_numbers = [int(f.split("_")[1].split(".")[0]) for f in rendered_frames]
+        rendered_frame_numbers = []
+        for f in rendered_frames:
+            frame_number = frame_number_from_filename(f)
+            if frame_number is None:
+                continue
+            if frame_number > end_frame:
+                # 缩短任务时多渲染出的帧属于其他任务
+                os.remove(os.path.join(output_dir_abs, f))
+            else:
+                rendered_frame_numbers.append(frame_number)
         
         if rendered_frame_numbers:
             return max(rendered_frame_numbers)
@@ -59,6 +130,33 @@ def render_blender(blend_file, output_dir, start_frame, end_frame):
         logging.error(f"Unexpected error during rendering: {str(e)}")
         return str(e)
 
+def calibration_render(output_dir, timeout=600):
+    """渲染 Blender 自带的默认场景一帧并返回耗时（秒），失败时返回 None。
+
+    用于还没有实测帧率的客户端：服务器按各客户端的校准耗时比例估计它们的相对速度。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = [
+        BLENDER_PATH,
+        "-b",
+        "--factory-startup",
+        "-o", os.path.join(os.path.abspath(output_dir), "calibration_####"),
+        "-f", "1"
+    ]
+    started = time.monotonic()
+    try:
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, timeout=timeout)
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.error(f"Calibration render failed: {str(e)}")
+        return None
+    return time.monotonic() - started
+
+def _terminate_on_cancel(process, cancel_event):
+    while process.poll() is None:
+        if cancel_event.wait(0.5):
+            process.terminate()
+            return
+
 def get_blend_file_settings(blend_file):
     settings = get_render_settings(blend_file)
     return settings
@@ -0,0 +1,205 @@
+import os
+import json
+import base64
+import threading
+from config import ROOMS_FOLDER, STATE_FLUSH_DELAY
+from utils.write_behind import WriteBehindFlusher
+
+# 每个字节中置位的个数
+_POPCOUNT = bytes(bin(value).count("1") for value in range(256))
+
+class FrameBitmap:
+    """一个 blend 文件的帧完成位图，第 i 位表示 start_frame + i 帧已完成。
+
+    10 万帧只占约 12KB；完成/缺失帧按区间返回，扫描时整字节跳过全 0 或全 1 的部分。
+    """
+
+    def __init__(self, start_frame, end_frame, data=None):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        size = (end_frame - start_frame) // 8 + 1
+        self._bits = bytearray(data or b"")
+        self._bits.extend(bytes(max(0, size - len(self._bits))))
+
+    def add(self, frame):
+        """标记一帧已完成，返回这一帧之前是否未完成"""
+        if frame < self.start_frame:
+            raise ValueError(f"Frame {frame} is before the first frame {self.start_frame}")
+        if frame > self.end_frame:
+            self.end_frame = frame
+            self._bits.extend(bytes((frame - self.start_frame) // 8 + 1 - len(self._bits)))
+        index, bit = divmod(frame - self.start_frame, 8)
+        if self._bits[index] & (1 << bit):
+            return False
+        self._bits[index] |= 1 << bit
+        return True
+
+    def __contains__(self, frame):
+        if not self.start_frame <= frame <= self.end_frame:
+            return False
+        index, bit = divmod(frame - self.start_frame, 8)
+        return bool(self._bits[index] & (1 << bit))
+
+    def count(self):
+        return sum(self._bits.translate(_POPCOUNT))
+
+    def done_ranges(self):
+        return self._ranges(True)
+
+    def missing_ranges(self):
+        return self._ranges(False)
+
+    def _ranges(self, done):
+        """返回 [[起始帧, 结束帧], ...]，相邻的帧合并为一个区间"""
+        ranges = []
+        skip, full = (0x00, 0xFF) if done else (0xFF, 0x00)
+        frame = self.start_frame
+        for byte in self._bits:
+            if byte == skip:
+                frame += 8
+                continue
+            for bit in range(8):
+                if frame > self.end_frame:
+                    break
+                if byte == full or bool(byte & (1 << bit)) == done:
+                    if ranges and ranges[-1][1] == frame - 1:
+                        ranges[-1][1] = frame
+                    else:
+                        ranges.append([frame, frame])
+                frame += 1
+        return ranges
+
+    def to_dict(self):
+        return {"start_frame": self.start_frame, "end_frame": self.end_frame,
+                "bitmap": base64.b64encode(bytes(self._bits)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["start_frame"], data["end_frame"], base64.b64decode(data["bitmap"]))
+
+class RenderLog:
+    """房间的渲染日志：每个 blend 文件一个 FrameBitmap，外加按任务合并的帧区间。
+
+    区间 [start, end, task_id, client] 记录每段帧由哪个任务、哪个客户端渲染，
+    连续上报的帧会合并进同一个区间，而不是每帧一条记录。
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.runs = {}
+
+    def add(self, blend_file, frame, task_id, client, frame_range=None):
+        bitmap = self.files.get(blend_file)
+        if bitmap is None:
+            start_frame, end_frame = frame_range or (frame, frame)
+            bitmap = self.files[blend_file] = FrameBitmap(min(start_frame, frame), max(end_frame, frame))
+        if not bitmap.add(frame):
+            return False
+        runs = self.runs.setdefault(blend_file, [])
+        last = runs[-1] if runs else None
+        if last is not None and last[1] == frame - 1 and last[2:] == [task_id, client]:
+            last[1] = frame
+        else:
+            runs.append([frame, frame, task_id, client])
+        return True
+
+    def summary(self, blend_file=None, include_runs=True):
+        files = {}
+        for name, bitmap in self.files.items():
+            if blend_file is not None and name != blend_file:
+                continue
+            files[name] = dict(bitmap.to_dict(), done=bitmap.count(),
+                               done_ranges=bitmap.done_ranges(), missing_ranges=bitmap.missing_ranges())
+            if include_runs:
+                files[name]["runs"] = self.runs.get(name, [])
+        return {"files": files}
+
+    def to_dict(self):
+        return {"files": {name: bitmap.to_dict() for name, bitmap in self.files.items()}, "runs": self.runs}
+
+    @classmethod
+    def from_dict(cls, data):
+        render_log = cls()
+        render_log.files = {name: FrameBitmap.from_dict(bitmap) for name, bitmap in data.get("files", {}).items()}
+        render_log.runs = data.get("runs", {})
+        return render_log
+
+def _frame_record(record):
+    """校验一条渲染日志记录，返回 (blend_file, frame, task_id, client)"""
+    if not isinstance(record, dict) or not isinstance(record.get("blend_file"), str):
+        raise ValueError(f"Invalid render log record: {record!r}")
+    try:
+        frame = int(record["frame"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid frame in render log record: {record!r}") from None
+    return record["blend_file"], frame, record.get("task_id"), record.get("client")
+
+class RenderLogStore:
+    """按房间缓存 RenderLog，写入后由 WriteBehindFlusher 合并写到 <room>/log/render_log.json"""
+
+    def __init__(self, rooms_folder=None, flush_delay=STATE_FLUSH_DELAY):
+        self.rooms_folder = rooms_folder or ROOMS_FOLDER
+        self._logs = {}
+        self._lock = threading.Lock()
+        self._flusher = WriteBehindFlusher(self._write, flush_delay)
+
+    def add_frames(self, room_id, records, frame_ranges):
+        """记录一批 {"frame", "task_id", "client", "blend_file"}，返回新完成的帧数。
+
+        frame_ranges 是 blend 文件名到 (起始帧, 结束帧) 的映射，用于确定位图的范围。
+        先校验整批记录，其中任何一条无效时抛出 ValueError，一帧都不记录。
+        """
+        frames = [_frame_record(record) for record in records]
+        with self._lock:
+            render_log = self._load(room_id)
+            # 新位图的范围覆盖这一批的所有帧，已有位图不接受早于起始帧的帧
+            ranges = {}
+            for blend_file, frame, _, _ in frames:
+                bitmap = render_log.files.get(blend_file)
+                if bitmap is None:
+                    start_frame, end_frame = ranges.get(blend_file) or frame_ranges.get(blend_file) or (frame, frame)
+                    ranges[blend_file] = (min(start_frame, frame), end_frame)
+                elif frame < bitmap.start_frame:
+                    raise ValueError(f"Frame {frame} is before the first frame {bitmap.start_frame} of {blend_file}")
+            added = sum(render_log.add(blend_file, frame, task_id, client, ranges.get(blend_file))
+                        for blend_file, frame, task_id, client in frames)
+        if added:
+            self._flusher.mark_dirty(room_id)
+        return added
+
+    def summary(self, room_id, blend_file=None, include_runs=True):
+        with self._lock:
+            return self._load(room_id).summary(blend_file, include_runs)
+
+    def _load(self, room_id):
+        render_log = self._logs.get(room_id)
+        if render_log is None:
+            path = self._path(room_id)
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    render_log = RenderLog.from_dict(json.load(f))
+            else:
+                render_log = RenderLog()
+            self._logs[room_id] = render_log
+        return render_log
+
+    def flush(self):
+        self._flusher.flush()
+
+    def close(self):
+        self._flusher.close()
+
+    def _write(self, room_id):
+        with self._lock:
+            data = json.dumps(self._logs[room_id].to_dict())
+        path = self._path(room_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _path(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "log", "render_log.json")
@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from config import ROOMS_FOLDER, STATE_FLUSH_DELAY
+from utils.blender_output import frame_number_from_filename
+from utils.write_behind import WriteBehindFlusher
+
+CHUNK_SIZE = 1024 * 1024
+# 任务 ID 会成为清单的文件名，只允许这些字符（重复或推测的任务 ID 带 ~ 后缀）
+TASK_ID_PATTERN = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_.~-]*')
+
+class ResultStore:
+    """渲染结果的唯一写入路径和索引。
+
+    结果按 blend 文件分目录保存为 final/<blend 文件名(不含扩展名)>/<file_name>，
+    同一房间的多个 blend 文件、不同房间之间的 frame_0001.png 不会互相覆盖。
+    上传的文件边接收边计算 SHA-256，写到临时文件后一次 os.replace 就位；
+    receive/commit 分成两步时，调用方可以在就位之前决定是否接受这个结果。
+
+    每个任务有一份追加写的清单 <room>/manifests/<task_id>.jsonl；房间的索引
+    final/index.json 把每个结果路径映射到 blend 文件、帧号、大小、校验和和上传的客户端，
+    列出结果只读索引，不扫描目录。索引在内存中维护、由 WriteBehindFlusher 合并落盘，
+    并记录已经并入的各清单的字节偏移，加载时只重放偏移之后新增的清单行。
+    """
+
+    def __init__(self, rooms_folder=None, flush_delay=STATE_FLUSH_DELAY):
+        self.rooms_folder = rooms_folder or ROOMS_FOLDER
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._flusher = WriteBehindFlusher(self._write_index, flush_delay)
+
+    def ingest(self, room_id, task_id, file_name, stream, client_id=None, blend_file=None, sha256=None):
+        """把 stream 的内容保存到房间的结果目录并写入任务清单和索引，返回清单条目。
+
+        给出 sha256 时先校验，不一致抛出 ValueError，已有的同名结果不受影响。
+        """
+        self._manifest_path(room_id, task_id)
+        staged = self.receive(room_id, file_name, stream, blend_file, sha256)
+        return self.commit(staged, task_id, client_id)
+
+    def receive(self, room_id, file_name, stream, blend_file=None, sha256=None):
+        """只把 stream 写到结果目录中的临时文件并校验，返回待提交的结果；
+        由调用方决定 commit（就位）还是 discard（丢弃），不影响已有的同名结果。
+        """
+        path = result_path(file_name, blend_file)
+        final_path = os.path.join(self.rooms_folder, room_id, "final", path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(final_path), f".{file_name}.{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for data in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(data)
+                    f.write(data)
+                    size += len(data)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise ValueError(f"Checksum mismatch for {file_name}")
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {"room_id": room_id, "file_name": file_name, "path": path, "blend_file": blend_file,
+                "tmp_path": tmp_path, "final_path": final_path, "size": size, "sha256": digest.hexdigest()}
+
+    def commit(self, staged, task_id, client_id=None):
+        """把 receive 得到的临时文件 os.replace 就位，写入任务清单和索引，返回清单条目"""
+        room_id = staged["room_id"]
+        self._manifest_path(room_id, task_id)  # 任务 ID 无效时在就位之前抛出 ValueError
+        os.replace(staged["tmp_path"], staged["final_path"])
+        entry = {"file_name": staged["file_name"], "path": staged["path"], "blend_file": staged["blend_file"],
+                 "task_id": task_id, "frame": frame_number_from_filename(staged["file_name"]),
+                 "size": staged["size"], "sha256": staged["sha256"], "client": client_id, "time": time.time()}
+        with self._lock:
+            index = self._load(room_id)
+            offset = self._append(room_id, task_id, entry)
+            _apply(index, entry)
+            index["offsets"][task_id] = offset
+        self._flusher.mark_dirty(room_id)
+        return entry
+
+    def discard(self, staged):
+        if os.path.exists(staged["tmp_path"]):
+            os.remove(staged["tmp_path"])
+
+    def files(self, room_id):
+        """返回 {结果路径: 条目}"""
+        with self._lock:
+            return dict(self._load(room_id)["files"])
+
+    def get(self, room_id, path):
+        with self._lock:
+            return self._load(room_id)["files"].get(path)
+
+    def lookup(self, room_id, blend_file, frame):
+        """返回某 blend 文件某一帧的结果条目，没有时返回 None"""
+        with self._lock:
+            index = self._load(room_id)
+            path = index["frames"].get(blend_file, {}).get(frame)
+            return index["files"].get(path) if path else None
+
+    def full_path(self, room_id, path):
+        return os.path.join(self.rooms_folder, room_id, "final", path)
+
+    def manifest(self, room_id, task_id):
+        """返回任务清单 {file_name: 条目}，同一文件多次上传时以最后一次为准"""
+        entries = {}
+        for entry in self._read_manifest(room_id, task_id)[0]:
+            entries[entry["file_name"]] = entry
+        return entries
+
+    def check_task(self, room_id, task):
+        """按清单核对任务的帧范围，返回 {files, bytes, missing_frames}。
+
+        不在本任务清单中、但索引里已有同一 blend 文件这一帧的结果（推测执行的另一方先上传）不算缺失。
+        """
+        entries = self.manifest(room_id, task['id'])
+        frames = {entry["frame"] for entry in entries.values() if entry["frame"] is not None}
+        with self._lock:
+            indexed = self._load(room_id)["frames"].get(task.get('file_name'), {})
+        missing = [frame for frame in range(task['start_frame'], task['end_frame'] + 1)
+                   if frame not in frames and frame not in indexed]
+        return {"files": len(entries), "bytes": sum(entry["size"] for entry in entries.values()),
+                "missing_frames": missing}
+
+    def task_ids(self, room_id):
+        folder = os.path.join(self.rooms_folder, room_id, "manifests")
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-len(".jsonl")] for name in os.listdir(folder) if name.endswith(".jsonl"))
+
+    def flush(self):
+        self._flusher.flush()
+
+    def close(self):
+        self._flusher.close()
+
+    def _load(self, room_id):
+        # 调用方持有 self._lock
+        index = self._indexes.get(room_id)
+        if index is not None:
+            return index
+        index = {"files": {}, "frames": {}, "offsets": {}}
+        path = self._index_path(room_id)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            index["offsets"] = data.get("offsets", {})
+            for entry in data.get("files", {}).values():
+                _apply(index, entry)
+        # 上次落盘之后追加的清单行
+        for task_id in self.task_ids(room_id):
+            entries, offset = self._read_manifest(room_id, task_id, index["offsets"].get(task_id, 0))
+            for entry in entries:
+                _apply(index, entry)
+            index["offsets"][task_id] = offset
+        self._indexes[room_id] = index
+        return index
+
+    def _read_manifest(self, room_id, task_id, offset=0):
+        """从 offset 开始读取清单，返回 (条目列表, 最后一个完整行之后的偏移)"""
+        path = self._manifest_path(room_id, task_id)
+        entries = []
+        if not os.path.exists(path):
+            return entries, offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 写到一半时崩溃留下的残行
+                offset += len(line)
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries, offset
+
+    def _append(self, room_id, task_id, entry):
+        path = self._manifest_path(room_id, task_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write((json.dumps(entry) + "\n").encode("utf-8"))
+            return f.tell()
+
+    def _write_index(self, room_id):
+        with self._lock:
+            index = self._indexes[room_id]
+            data = json.dumps({"files": index["files"], "offsets": index["offsets"]})
+        path = self._index_path(room_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _index_path(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "final", "index.json")
+
+    def _manifest_path(self, room_id, task_id):
+        if not valid_task_id(task_id):
+            raise ValueError(f"Invalid task id: {task_id!r}")
+        return os.path.join(self.rooms_folder, room_id, "manifests", f"{task_id}.jsonl")
+
+def valid_task_id(task_id):
+    return isinstance(task_id, str) and TASK_ID_PATTERN.fullmatch(task_id) is not None
+
+def result_path(file_name, blend_file=None):
+    """结果在 final 目录中的相对路径：scene.blend 的 frame_0001.png -> scene/frame_0001.png"""
+    if not blend_file:
+        return file_name
+    return f"{os.path.splitext(os.path.basename(blend_file))[0]}/{file_name}"
+
+def _apply(index, entry):
+    path = entry.get("path", entry["file_name"])
+    entry = dict(entry, path=path)
+    index["files"][path] = entry
+    if entry["frame"] is not None:
+        index["frames"].setdefault(entry.get("blend_file"), {})[entry["frame"]] = path
@@ -1,128 +1,846 @@
 import os
-import json
+import copy
 import shutil
 import logging
+import time
+import atexit
+import threading
+import zlib
 from datetime import datetime
-from config import ROOMS_FOLDER, IS_SERVER
+from config import ROOMS_FOLDER, IS_SERVER, TASK_LEASE_SECONDS, REAPER_INTERVAL, STATE_BACKEND, SPECULATIVE_EXECUTION, FAIR_SHARE_BY
 from utils.get_render_settings import get_render_settings
+from utils.state_store import create_state_store
+from utils.chunking import plan_chunks, chunk_frames, estimate_seconds_per_frame
+from utils.throughput import record_sample, record_calibration, client_seconds_per_frame
+from utils.schedule import deadline_timestamp, task_sort_key, deadline_report
+from utils.render_log import RenderLogStore
+from utils.event_bus import EventBus
+from utils.task_index import TaskIndex, UNASSIGNED
+
+# 房间锁分片数，不同房间的请求大多落在不同的锁上
+LOCK_STRIPES = 64
+
+# 正在渲染的任务至少还剩这么多帧时，才会分给空闲的客户端
+STEAL_MIN_FRAMES = 2
+
+class TaskConflictError(ValueError):
+    """任务状态与调用方预期不符（版本号、状态或租约持有者不匹配）"""
+
+    def __init__(self, task, expected):
+        self.task = task
+        self.expected = expected
+        actual = {key: task.get(key) for key in expected}
+        super().__init__(f"Task {task['id']} conflict: expected {expected}, got {actual}")
 
 class RoomManager:
-    def __init__(self):
+    """房间和任务状态以内存为准，持久化交给 state store（JSON 或 SQLite）。
+
+    同一房间的读改写都在该房间的分片锁内完成。任务字典按写时复制替换，
+    每次变化 version 加一，调用方可以用 transition_task 做比较并交换。
+    """
+
+    def __init__(self, store=None):
         self.rooms = {}
+        self.tasks = {}
+        self._task_index = {}  # room_id -> {task_id: 在 tasks[room_id] 中的位置}
+        self._task_queries = {}  # room_id -> TaskIndex，按状态/客户端/文件过滤和聚合统计
+        self._locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._store = store or create_state_store(STATE_BACKEND, ROOMS_FOLDER)
+        self._render_logs = RenderLogStore(ROOMS_FOLDER)
+        self.events = EventBus()  # 任务变化、成员加入、房间状态变化，供 /events 推送
+        self._versions = {}  # room_id -> 房间版本号，任务或房间设置每次变化加一
+        self._reaper_stop = threading.Event()
+        self._reaper = None
+        self._workers = {}  # 共享渲染池中的客户端：client_id -> 登记信息
+        self._workers_lock = threading.Lock()
+        self._all_rooms_loaded = False
+        atexit.register(self.close)
+
+    def close(self):
+        """停止回收线程并强制把内存中的状态全部写盘"""
+        self._reaper_stop.set()
+        self._store.close()
+        self._render_logs.close()
+
+    def start_reaper(self, interval=REAPER_INTERVAL):
+        """启动后台线程，定期把租约过期（客户端掉线、休眠）的任务放回队列"""
+        def run():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    self.reap_expired_leases()
+                except Exception as e:
+                    logging.error(f"Failed to reap expired leases: {str(e)}")
+
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=run, name="lease-reaper", daemon=True)
+            self._reaper.start()
+
+    def reap_expired_leases(self, now=None):
+        now = time.time() if now is None else now
+        requeued = []
+        for room_id in list(self.tasks):
+            with self.room_lock(room_id):
+                requeued.extend(self._reap_room(room_id, now))
+        return requeued
+
+    def flush(self):
+        self._store.flush()
+        self._render_logs.flush()
+
+    def room_lock(self, room_id):
+        return self._locks[zlib.crc32(room_id.encode()) % LOCK_STRIPES]
 
     def create_room(self, room_id, room_settings):
-        if room_id in self.rooms:
-            raise ValueError("Room already exists")
-        
-        # 创建房间目录结构
-        room_path = os.path.join(ROOMS_FOLDER, room_id)
-        os.makedirs(os.path.join(room_path, "queue"), exist_ok=True)
-        os.makedirs(os.path.join(room_path, "log"), exist_ok=True)
-        os.makedirs(os.path.join(room_path, "results"), exist_ok=True)
-        
-        self.rooms[room_id] = room_settings
-        self._save_room_settings(room_id, room_settings)
+        with self.room_lock(room_id):
+            if room_id in self.rooms or self._store.load_room(room_id) is not None:
+                raise ValueError("Room already exists")
+
+            # 创建房间目录结构
+            room_path = os.path.join(ROOMS_FOLDER, room_id)
+            os.makedirs(os.path.join(room_path, "queue"), exist_ok=True)
+            os.makedirs(os.path.join(room_path, "log"), exist_ok=True)
+            os.makedirs(os.path.join(room_path, "results"), exist_ok=True)
+
+            room_settings = copy.deepcopy(room_settings)
+            self._versions[room_id] = room_settings.get('room_version', 0)  # 新房间还没有任务
+            self._save_room_settings(room_id, room_settings)
 
     def join_room(self, room_id, client_id):
-        room_settings = self.get_room_settings(room_id)
-        if room_settings['status'] != 'waiting':
-            raise ValueError("Room is not in waiting status")
-        max_order = max([member['order'] for member in room_settings['members']])
-        room_settings['members'].append({"id": client_id, "order": max_order + 1})
-        self.update_room_settings(room_id, room_settings)
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if room_settings['status'] != 'waiting':
+                raise ValueError("Room is not in waiting status")
+            max_order = max([member['order'] for member in room_settings['members']])
+            room_settings['members'].append({"id": client_id, "order": max_order + 1})
+            self.update_room_settings(room_id, room_settings)
+            self.events.publish(room_id, 'member_joined', {"client_id": client_id, "order": max_order + 1})
+
+    def add_blend_file(self, room_id, file_name, render_settings, priority=None, deadline=None):
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if room_settings['status'] != 'waiting':
+                raise ValueError("Room is not in waiting status")
+            room_settings["blender_files"].append({
+                "file_name": file_name,
+                "upload_order": len(room_settings["blender_files"]),
+                "render_settings": render_settings
+            })
+            self.update_room_settings(room_id, room_settings)
+            if priority is not None or deadline is not None:
+                self.set_schedule(room_id, file_name, priority, deadline)
+
+    def remove_blend_file(self, room_id, file_name):
+        """从房间移除一个 blend 文件及其全部任务，文件不存在时抛出 ValueError"""
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            blender_files = [blender_file for blender_file in room_settings['blender_files']
+                             if blender_file['file_name'] != file_name]
+            if len(blender_files) == len(room_settings['blender_files']):
+                raise ValueError(f"Blend file {file_name} not found in room {room_id}")
+            for upload_order, blender_file in enumerate(blender_files):
+                blender_file['upload_order'] = upload_order
+            room_settings['blender_files'] = blender_files
+            self.update_room_settings(room_id, room_settings)
+
+            tasks = self._load_tasks(room_id)
+            if any(task['file_name'] == file_name for task in tasks):
+                # 整体替换任务列表，索引和存储随之重建
+                self._save_tasks(room_id, [task for task in tasks if task['file_name'] != file_name])
+            logging.info(f"Removed blend file {file_name} from room {room_id}")
 
     def get_room_settings(self, room_id):
-        room_settings_path = os.path.join(ROOMS_FOLDER, room_id, "log", "room_settings.json")
-        if not os.path.exists(room_settings_path):
-            raise ValueError(f"Room settings file not found for room {room_id}")
-        with open(room_settings_path, 'r') as f:
-            return json.load(f)
+        """返回房间设置。与任务字典一样写时复制：返回的字典会被其他线程读取和序列化，
+        不能原地修改，修改时用 _edit_room_settings 取副本，再交给 update_room_settings 替换"""
+        if room_id in self.rooms:
+            return self.rooms[room_id]
+        with self.room_lock(room_id):
+            if room_id in self.rooms:
+                return self.rooms[room_id]
+            # 服务器重启后首次访问，从存储恢复
+            room_settings = self._store.load_room(room_id)
+            if room_settings is None:
+                raise ValueError(f"Room settings file not found for room {room_id}")
+            self.rooms[room_id] = room_settings
+            return room_settings
 
     def update_room_settings(self, room_id, room_settings):
-        if room_id not in self.rooms:
-            raise ValueError("Room not found")
-        self.rooms[room_id] = room_settings
-        self._save_room_settings(room_id, room_settings)
+        with self.room_lock(room_id):
+            self.get_room_settings(room_id)  # 房间不存在时抛出 ValueError
+            self._save_room_settings(room_id, room_settings)
+
+    def _edit_room_settings(self, room_id):
+        # 调用方持有房间锁；返回可以修改的副本
+        return copy.deepcopy(self.get_room_settings(room_id))
 
     def trigger_rendering(self, room_id):
-        room_settings = self.get_room_settings(room_id)
-        if room_settings['status'] != 'waiting':
-            raise ValueError("Room is not in waiting status")
-        
-        room_settings['status'] = 'triggered'
-        self.update_room_settings(room_id, room_settings)
-        
-        # 创建任务
-        self._create_tasks(room_id)
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if room_settings['status'] != 'waiting':
+                raise ValueError("Room is not in waiting status")
+
+            room_settings['status'] = 'triggered'
+            self.update_room_settings(room_id, room_settings)
+            self.events.publish(room_id, 'room_status', {"status": 'triggered'})
+
+            # 创建任务
+            self._create_tasks(room_id)
 
     def get_tasks(self, room_id):
-        tasks_file_path = os.path.join(ROOMS_FOLDER, room_id, "log", "tasks.json")
-        if not os.path.exists(tasks_file_path):
+        """返回任务列表的快照，任务字典不会在原地被修改"""
+        with self.room_lock(room_id):
+            return list(self._load_tasks(room_id))
+
+    def room_version(self, room_id):
+        """房间的版本号，单调递增。重启后取任务和房间设置中记录的最大版本号"""
+        with self.room_lock(room_id):
+            if room_id not in self._versions:
+                room_settings = self.get_room_settings(room_id)
+                self._versions[room_id] = max([room_settings.get('room_version', 0)] +
+                                              [task.get('changed_version', 0) for task in self._load_tasks(room_id)])
+            return self._versions[room_id]
+
+    def get_tasks_versioned(self, room_id):
+        """返回 (版本号, 任务列表快照)，两者在同一把锁内读取"""
+        with self.room_lock(room_id):
+            return self.room_version(room_id), list(self._load_tasks(room_id))
+
+    def query_tasks(self, room_id, status=None, client=None, file_name=None, cursor=None, limit=None):
+        """按状态、客户端（未领取的任务为 "unassigned"）、blend 文件过滤任务，按任务顺序分页。
+
+        cursor 是上一页返回的 next_cursor；没有更多结果时 next_cursor 为 None。
+        """
+        with self.room_lock(room_id):
+            version = self.room_version(room_id)
+            tasks = self._load_tasks(room_id)
+            positions = self._task_queries[room_id].query(status, client, file_name) if tasks else []
+            if cursor is not None:
+                positions = [position for position in positions if position > cursor]
+            next_cursor = None
+            if limit is not None and len(positions) > limit:
+                positions = positions[:limit]
+                next_cursor = positions[-1]
+            return {"version": version, "tasks": [tasks[position] for position in positions],
+                    "next_cursor": next_cursor}
+
+    def get_task_stats(self, room_id):
+        """按 blend 文件和客户端汇总的任务数（按状态）、总帧数、已完成和剩余帧数"""
+        with self.room_lock(room_id):
+            version = self.room_version(room_id)
+            if not self._load_tasks(room_id):
+                return {"version": version, "files": {}, "clients": {}}
+            return dict(self._task_queries[room_id].stats(), version=version)
+
+    def _task_positions(self, room_id, status, file_name=None):
+        """按状态（和 blend 文件）索引出的任务位置，升序；调用方持有房间锁"""
+        if not self._load_tasks(room_id):
             return []
-        with open(tasks_file_path, 'r') as f:
-            return json.load(f)
-    def update_task(self, room_id, task_id, status, client_id):
-        tasks = self.get_tasks(room_id)
-        for task in tasks:
-            if task['id'] == task_id:
-                task['status'] = status
-                task['client'] = client_id
-                break
+        return self._task_queries[room_id].query(status, file_name=file_name)
+
+    def _indexed_tasks(self, room_id, status, file_name=None):
+        tasks = self._load_tasks(room_id)
+        return [tasks[position] for position in self._task_positions(room_id, status, file_name)]
+
+    def _count_tasks(self, room_id, statuses):
+        with self.room_lock(room_id):
+            if not self._load_tasks(room_id):
+                return 0
+            by_status = self._task_queries[room_id].by_status
+            return sum(len(by_status.get(status, ())) for status in statuses)
+
+    def get_task_changes(self, room_id, since):
+        """返回版本号 since 之后变化过的任务。
+
+        since 早于最近一次整体替换任务列表（或晚于当前版本，例如服务器数据被恢复过）时
+        返回 reset=True 和完整列表。
+        """
+        with self.room_lock(room_id):
+            version = self.room_version(room_id)
+            tasks = self._load_tasks(room_id)
+            if since < self.get_room_settings(room_id).get('tasks_reset_version', 0) or since > version:
+                return {"version": version, "reset": True, "tasks": list(tasks)}
+            return {"version": version, "reset": False,
+                    "tasks": [task for task in tasks if task.get('changed_version', 0) > since]}
+
+    def _bump_version(self, room_id):
+        # 调用方持有房间锁
+        self._versions[room_id] = self.room_version(room_id) + 1
+        return self._versions[room_id]
+
+    def get_task(self, room_id, task_id):
+        with self.room_lock(room_id):
+            tasks = self._load_tasks(room_id)
+            position = self._task_index.get(room_id, {}).get(task_id)
+            if position is None:
+                raise ValueError("Task not found")
+            return tasks[position]
+
+    def transition_task(self, room_id, task_id, expected, changes):
+        """比较并交换：task 中 expected 的每个字段都与预期相同时才应用 changes。
+
+        成功时返回新的任务字典（version 加一），否则抛出 TaskConflictError。
+        """
+        with self.room_lock(room_id):
+            task = self._expect(room_id, task_id, expected)
+            return self._replace_task(room_id, task, changes)
+
+    def _expect(self, room_id, task_id, expected):
+        task = self.get_task(room_id, task_id)
+        if any(task.get(key) != value for key, value in expected.items()):
+            raise TaskConflictError(task, expected)
+        return task
+
+    def update_task(self, room_id, task_id, status, client_id, expected_version=None):
+        with self.room_lock(room_id):
+            task = self.get_task(room_id, task_id)
+            expected = {} if expected_version is None else {'version': expected_version}
+            if task['status'] == 'rendering':
+                # 渲染中的任务只有租约持有者可以改变状态（包括标记为 failed），
+                # 租约被回收并转给他人后，原持有者的更新会因 CAS 失败而被拒绝
+                expected.update(status='rendering', client=client_id)
+            changes = {'status': status, 'client': client_id}
+            if status == 'rendering':
+                changes['lease_expires'] = time.time() + TASK_LEASE_SECONDS
+            else:
+                changes['lease_expires'] = None
+            return self.transition_task(room_id, task_id, expected, changes)
+
+    def get_next_task(self, room_id, client_id):
+        """为客户端领取下一个待渲染的任务，并授予一个有时限的租约。
+
+        没有可领取的任务时返回 None。租约已过期的 rendering 任务视为可重新领取。
+        """
+        with self.room_lock(room_id):
+            room_settings = self.get_room_settings(room_id)
+            if room_settings['status'] not in ('triggered', 'rendering'):
+                raise ValueError(f"Room is not rendering. Current status: {room_settings['status']}")
+            if client_id not in [member['id'] for member in room_settings['members']]:
+                raise ValueError(f"Client {client_id} is not a member of room {room_id}")
+
+            return self._grant_task(room_id, room_settings, client_id, time.time())
+
+    def _grant_task(self, room_id, room_settings, client_id, now):
+        # 调用方持有房间锁
+        self._reap_room(room_id, now)
+        task = self._next_pending_task(room_id, room_settings, now)
+        if task is not None:
+            task = self._size_for_client(room_id, room_settings, task, client_id, now)
+            return self._replace_task(room_id, task, {
+                'status': 'rendering',
+                'client': client_id,
+                'lease_expires': now + TASK_LEASE_SECONDS,
+                'started_at': now
+            })
+        # 没有待领取的任务时，从其他成员正在渲染的任务中分走一半剩余帧
+        task = self._steal_task(room_id, client_id, now)
+        if task is None and room_settings.get('speculative', SPECULATIVE_EXECUTION):
+            # 无法再拆分时，为最早开始的任务启动一个推测副本，先完成者胜出
+            task = self._speculate_task(room_id, client_id, now)
+        return task
+
+    def _next_pending_task(self, room_id, room_settings, now):
+        """按截止时间、老化后的优先级挑选下一个待领取任务，同等条件下保持原有顺序"""
+        blender_files = {blender_file['file_name']: blender_file for blender_file in room_settings['blender_files']}
+        tasks = self._load_tasks(room_id)
+        if not tasks:
+            return None
+        # 只看按状态索引出的待领取任务，不遍历整个任务列表
+        positions = self._task_index[room_id]
+        pending = [(positions[task_id], tasks[positions[task_id]])
+                   for task_id in self._task_queries[room_id].by_status.get('triggered', ())]
+        if not pending:
+            return None
+        # 每个文件等待最久的待领取任务决定这个文件是否已经等待太久
+        file_queued_at = {}
+        for _, task in pending:
+            queued_at = task.get('queued_at', now)
+            file_queued_at[task['file_name']] = min(queued_at, file_queued_at.get(task['file_name'], queued_at))
+        return min(pending, key=lambda item: (
+            task_sort_key(room_settings, blender_files.get(item[1]['file_name']), item[1], now,
+                          file_queued_at[item[1]['file_name']]), item[0]))[1]
+
+    def set_schedule(self, room_id, file_name=None, priority=None, deadline=None):
+        """设置房间或某个 blend 文件的优先级和截止时间（ISO 8601 或 Unix 时间戳），渲染开始后也可以修改"""
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if file_name is None:
+                target = room_settings
+            else:
+                target = next((blender_file for blender_file in room_settings['blender_files']
+                               if blender_file['file_name'] == file_name), None)
+                if target is None:
+                    raise ValueError(f"Blend file {file_name} not found in room {room_id}")
+            if priority is not None:
+                target['priority'] = int(priority)
+            if deadline is not None:
+                deadline_timestamp(deadline)  # 格式错误时抛出 ValueError
+                target['deadline'] = deadline
+            self.update_room_settings(room_id, room_settings)
+            return dict(target)
+
+    def register_worker(self, client_id):
+        """把客户端登记到共享渲染池，之后它可以领取任意渲染中房间的任务"""
+        now = time.time()
+        with self._workers_lock:
+            worker = self._workers.setdefault(client_id, {"client_id": client_id, "registered_at": now})
+            worker["last_seen"] = now
+            return dict(worker)
+
+    def unregister_worker(self, client_id):
+        with self._workers_lock:
+            self._workers.pop(client_id, None)
+
+    def get_workers(self):
+        with self._workers_lock:
+            return [dict(worker) for worker in self._workers.values()]
+
+    def get_next_pool_task(self, client_id):
+        """为池中的客户端从最应该被服务的房间领取任务，返回 (room_id, task)，没有任务时返回 (None, None)。
+
+        房间按优先级（room_settings 的 priority，越大越先）排序，同优先级按加权公平份额：
+        正在渲染的任务数除以权重（share_weight，默认 1）越小越先。
+        房间设置 pool 为 False 时不向池中的客户端分配任务。
+        """
+        with self._workers_lock:
+            if client_id not in self._workers:
+                raise ValueError(f"Client {client_id} is not registered with the worker pool")
+            self._workers[client_id]["last_seen"] = time.time()
+
+        for room_id in self._rooms_by_fair_share():
+            with self.room_lock(room_id):
+                room_settings = self.get_room_settings(room_id)
+                if room_settings['status'] not in ('triggered', 'rendering'):
+                    continue
+                task = self._grant_task(room_id, room_settings, client_id, time.time())
+                if task is not None:
+                    return room_id, task
+        return None, None
+
+    def _rooms_by_fair_share(self):
+        rooms = {room_id: room_settings for room_id, room_settings in self._all_rooms().items()
+                 if room_settings['status'] in ('triggered', 'rendering') and room_settings.get('pool', True)}
+        running = {room_id: self._count_tasks(room_id, ('rendering',)) for room_id in rooms}
+
+        def share_group(room_id):
+            if FAIR_SHARE_BY == 'owner':
+                members = sorted(rooms[room_id]['members'], key=lambda member: member['order'])
+                return members[0]['id'] if members else room_id
+            return room_id
+
+        group_running = {}
+        for room_id in rooms:
+            group = share_group(room_id)
+            group_running[group] = group_running.get(group, 0) + running[room_id]
+
+        def rank(room_id):
+            room_settings = rooms[room_id]
+            weight = max(float(room_settings.get('share_weight', 1)), 1e-6)
+            return (-room_settings.get('priority', 0), group_running[share_group(room_id)] / weight,
+                    room_settings.get('create_time', ''), room_id)
+
+        return sorted(rooms, key=rank)
+
+    def _all_rooms(self):
+        if not self._all_rooms_loaded:
+            # 服务器重启后第一次调度时把存储中的房间全部载入内存
+            for room_id in self._store.room_ids():
+                try:
+                    self.get_room_settings(room_id)
+                except ValueError:
+                    pass
+            self._all_rooms_loaded = True
+        return dict(self.rooms)
+
+    def report_progress(self, room_id, task_id, client_id, last_frame, frame_seconds=None):
+        """租约持有者上报已渲染完成的最后一帧，返回最新的任务（end_frame 可能已被缩短）。
+
+        frame_seconds 是 Blender 输出中这一帧的渲染耗时，计入内存中该客户端的帧率，
+        任务完成时才随房间设置一起落盘，逐帧上报不会改变房间版本；
+        上报过逐帧耗时的任务完成时不再按整个任务的耗时重复计入。
+        """
+        with self.room_lock(room_id):
+            task = self._expect(room_id, task_id, {'status': 'rendering', 'client': client_id})
+            changes = {}
+            if last_frame > task.get('last_frame', task['start_frame'] - 1):
+                changes['last_frame'] = min(last_frame, task['end_frame'])
+            if frame_seconds:
+                room_settings = self._edit_room_settings(room_id)
+                if record_sample(room_settings, client_id, task['file_name'], 1, frame_seconds) is not None:
+                    # 只替换内存中的房间设置，不落盘
+                    self.rooms[room_id] = room_settings
+                    if not task.get('frame_timings'):
+                        changes['frame_timings'] = True
+            if changes:
+                task = self._replace_task(room_id, task, changes)
+            return task
+
+    def heartbeat(self, room_id, task_id, client_id, last_frame=None):
+        """续租。只有当前租约持有者可以续租，租约已被回收时抛出 TaskConflictError"""
+        with self.room_lock(room_id):
+            task = self.transition_task(room_id, task_id, {'status': 'rendering', 'client': client_id}, {
+                'lease_expires': time.time() + TASK_LEASE_SECONDS
+            })
+            if last_frame is not None:
+                task = self.report_progress(room_id, task_id, client_id, last_frame)
+            return task
+
+    def record_result(self, room_id, task_id, frame):
+        """记录某任务的一帧结果已上传到服务器，任务被回收时这些帧不会重新渲染。
+
+        返回 False 表示这一帧不需要保存：任务已被取消（推测执行中落败），帧不在任务当前的范围内
+        （后半段已被其他客户端窃取），或者同一帧已由它的推测副本/原任务上传过。
+        """
+        with self.room_lock(room_id):
+            task = self.get_task(room_id, task_id)
+            if task['status'] == 'cancelled':
+                return False
+            peer = self._speculation_peer(room_id, task)
+            if peer is not None and frame in peer.get('uploaded_frames', []):
+                return False
+            if not task['start_frame'] <= frame <= task['end_frame']:
+                return False
+            uploaded = task.get('uploaded_frames', [])
+            if frame in uploaded:
+                return False
+            self._replace_task(room_id, task, {'uploaded_frames': sorted(uploaded + [frame])})
+            return True
+
+    def _reap_room(self, room_id, now):
+        requeued = []
+        tasks = self._load_tasks(room_id)
+        for position in self._task_positions(room_id, 'rendering'):
+            # 按位置读取最新的任务：处理推测执行时可能已经改过后面的任务
+            task = tasks[position]
+            if not self._lease_expired(task, now):
+                continue
+            if task.get('speculative_of') or task.get('speculated_by'):
+                # 推测执行中掉线的一方让位给另一方：副本直接取消，原任务只保留副本开始之前的帧
+                self._resolve_speculation(room_id, self._speculation_peer(room_id, task), now)
+                task = self.get_task(room_id, task['id'])
+                if task['status'] != 'rendering':
+                    continue
+            # 已上传的连续帧保留，只把剩下的帧放回队列
+            resume_frame = task['start_frame']
+            uploaded = set(task.get('uploaded_frames', []))
+            while resume_frame in uploaded and resume_frame <= task['end_frame']:
+                resume_frame += 1
+            logging.warning(f"Lease of task {task['id']} held by {task['client']} expired, "
+                            f"requeueing frames {resume_frame}-{task['end_frame']}")
+            if resume_frame > task['end_frame']:
+                changes = {'status': 'done', 'finished_at': now}
+            else:
+                changes = {'status': 'triggered', 'client': None, 'start_frame': resume_frame,
+                           'last_frame': resume_frame - 1, 'queued_at': now}
+            changes.update(lease_expires=None, expired_client=task['client'])
+            requeued.append(self._replace_task(room_id, task, changes))
+        return requeued
+
+    def _steal_task(self, room_id, client_id, now):
+        candidates = [task for task in self._indexed_tasks(room_id, 'rendering')
+                      if task['client'] != client_id
+                      and not task.get('speculative_of') and not task.get('speculated_by')
+                      and self._remaining_frames(task) >= STEAL_MIN_FRAMES]
+        if not candidates:
+            return None
+        victim = max(candidates, key=self._remaining_frames)
+
+        # 原持有者保留正在渲染的帧以及剩余帧的前一半，下次上报进度时得知新的 end_frame
+        last_frame = victim.get('last_frame', victim['start_frame'] - 1)
+        boundary = last_frame + (self._remaining_frames(victim) + 1) // 2
+        stolen_start, stolen_end = boundary + 1, victim['end_frame']
+        self._replace_task(room_id, victim, {'end_frame': boundary})
+        logging.info(f"Split task {victim['id']}: {victim['client']} keeps up to frame {boundary}, "
+                     f"{client_id} takes {stolen_start}-{stolen_end}")
+
+        return self._add_task(room_id, {
+            "id": self._new_task_id(room_id, victim['file_name'], stolen_start),
+            "file_name": victim['file_name'],
+            "start_frame": stolen_start,
+            "end_frame": stolen_end,
+            "last_frame": stolen_start - 1,
+            "status": "rendering",
+            "client": client_id,
+            "lease_expires": now + TASK_LEASE_SECONDS,
+            "started_at": now,
+            "queued_at": now,
+            "split_from": victim['id'],
+            "version": 0
+        })
+
+    def _size_for_client(self, room_id, room_settings, task, client_id, now):
+        """按客户端在该文件上的渲染速度调整待领取任务的大小，没有速度数据时保持原样"""
+        blender_file = next((blender_file for blender_file in room_settings['blender_files']
+                             if blender_file['file_name'] == task['file_name']), None)
+        seconds_per_frame = blender_file and client_seconds_per_frame(room_settings, client_id, blender_file)
+        if not seconds_per_frame:
+            return task
+
+        size = chunk_frames(seconds_per_frame, self._remaining_seconds(room_id, room_settings),
+                            len(room_settings['members']))
+        end_frame = task['start_frame'] + size - 1
+        if end_frame < task['end_frame']:
+            # 慢的客户端只领取一小块，剩下的帧放回队列
+            self._add_task(room_id, dict(task, id=self._new_task_id(room_id, task['file_name'], end_frame + 1),
+                                         start_frame=end_frame + 1, last_frame=end_frame, version=0,
+                                         queued_at=now))
+            logging.info(f"Shrunk task {task['id']} to frames {task['start_frame']}-{end_frame} for {client_id}")
+            return self._replace_task(room_id, task, {'end_frame': end_frame})
+
+        # 快的客户端把紧接着的待领取任务一并领走
+        while True:
+            following = next((other for other in self._indexed_tasks(room_id, 'triggered', task['file_name'])
+                              if other['start_frame'] == task['end_frame'] + 1), None)
+            if following is None or following['end_frame'] > end_frame:
+                return task
+            self._replace_task(room_id, following, {'status': 'cancelled', 'merged_into': task['id']})
+            logging.info(f"Merged task {following['id']} into {task['id']} for {client_id}")
+            task = self._replace_task(room_id, task, {'end_frame': following['end_frame']})
+
+    def _remaining_seconds(self, room_id, room_settings):
+        """按预估单帧耗时计算房间内尚未渲染的总工作量"""
+        seconds_per_frame = {blender_file['file_name']: estimate_seconds_per_frame(blender_file)
+                             for blender_file in room_settings['blender_files']}
+        return sum(self._remaining_frames(task) * seconds_per_frame.get(task['file_name'], 0)
+                   for task in self._indexed_tasks(room_id, ('triggered', 'rendering')))
+
+    def _new_task_id(self, room_id, file_name, start_frame):
+        task_id = f"{room_id}_{file_name}_{start_frame}"
+        suffix = 1
+        while task_id in self._task_index.get(room_id, {}):
+            suffix += 1
+            task_id = f"{room_id}_{file_name}_{start_frame}~{suffix}"
+        return task_id
+
+    def _speculate_task(self, room_id, client_id, now):
+        candidates = [task for task in self._indexed_tasks(room_id, 'rendering')
+                      if task['client'] != client_id
+                      and not task.get('speculative_of') and not task.get('speculated_by')]
+        if not candidates:
+            return None
+        straggler = min(candidates, key=lambda task: task.get('started_at', now))
+
+        # 副本只渲染原任务尚未完成的帧
+        start_frame = straggler.get('last_frame', straggler['start_frame'] - 1) + 1
+        # 之前的副本被取消后可能再次推测，副本 ID 加序号保持唯一
+        copy_id = f"{straggler['id']}~spec"
+        suffix = 1
+        while copy_id in self._task_index.get(room_id, {}):
+            suffix += 1
+            copy_id = f"{straggler['id']}~spec{suffix}"
+        self._replace_task(room_id, straggler, {'speculated_by': copy_id})
+        logging.info(f"Speculatively duplicating task {straggler['id']} frames {start_frame}-{straggler['end_frame']} "
+                     f"for {client_id}")
+        return self._add_task(room_id, {
+            "id": copy_id,
+            "file_name": straggler['file_name'],
+            "start_frame": start_frame,
+            "end_frame": straggler['end_frame'],
+            "last_frame": start_frame - 1,
+            "status": "rendering",
+            "client": client_id,
+            "lease_expires": now + TASK_LEASE_SECONDS,
+            "started_at": now,
+            "speculative_of": straggler['id'],
+            "version": 0
+        })
+
+    def _speculation_peer(self, room_id, task):
+        peer_id = task.get('speculative_of') or task.get('speculated_by')
+        if peer_id is None:
+            return None
+        return self.get_task(room_id, peer_id)
+
+    def _resolve_speculation(self, room_id, winner, now):
+        """winner 完成（或对方掉线）后处理另一方，并解除两者的推测关系"""
+        loser = self._speculation_peer(room_id, winner)
+        winner = self._replace_task(room_id, winner, {'speculative_of': None, 'speculated_by': None})
+        if loser is None or loser['status'] != 'rendering':
+            return winner
+        if loser.get('speculated_by'):
+            # 原任务落败：副本覆盖的帧由副本负责，原任务只保留副本开始之前的帧
+            end_frame = winner['start_frame'] - 1
+            if end_frame < loser['start_frame']:
+                changes = {'status': 'cancelled', 'lease_expires': None}
+            else:
+                changes = {'end_frame': end_frame}
         else:
-            raise ValueError("Task not found")
-        
-        tasks_file_path = os.path.join(ROOMS_FOLDER, room_id, "log", "tasks.json")
-        with open(tasks_file_path, 'w') as f:
-            json.dump(tasks, f, indent=2)
+            # 副本落败：直接取消，持有者下次心跳时会停止 Blender
+            changes = {'status': 'cancelled', 'lease_expires': None}
+        changes.update(speculative_of=None, speculated_by=None)
+        logging.info(f"Speculative race for {winner['id']} resolved, {loser['id']} updated with {changes}")
+        self._replace_task(room_id, loser, changes)
+        return winner
+
+    def _remaining_frames(self, task):
+        return task['end_frame'] - task.get('last_frame', task['start_frame'] - 1)
+
+    def complete_task(self, room_id, task_id, client_id=None):
+        """将任务标记为完成并释放租约。若指定 client_id，则必须是当前租约持有者。
+
+        推测执行中先完成的一方胜出，另一方被取消或缩短。
+        """
+        expected = {} if client_id is None else {'client': client_id, 'status': 'rendering'}
+        with self.room_lock(room_id):
+            now = time.time()
+            task = self.transition_task(room_id, task_id, expected, {
+                'status': 'done',
+                'lease_expires': None,
+                'finished_at': now
+            })
+            if task.get('speculative_of') or task.get('speculated_by'):
+                task = self._resolve_speculation(room_id, task, now)
+            if task.get('started_at') and task.get('client'):
+                self._record_throughput(room_id, task)
+            return task
+
+    def _record_throughput(self, room_id, task):
+        room_settings = self._edit_room_settings(room_id)
+        if task.get('frame_timings'):
+            # 逐帧计入的帧率只在内存中更新过，任务完成时落盘一次
+            self.update_room_settings(room_id, room_settings)
+            return
+        fps = record_sample(room_settings, task['client'], task['file_name'],
+                            task['end_frame'] - task['start_frame'] + 1, task['finished_at'] - task['started_at'])
+        if fps is not None:
+            logging.info(f"Client {task['client']} renders {task['file_name']} at {fps:.3f} frames/s")
+            self.update_room_settings(room_id, room_settings)
+
+    def report_calibration(self, room_id, client_id, seconds):
+        """记录客户端的校准渲染耗时，在它还没有实测帧率时用于估计任务大小"""
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if (client_id not in [member['id'] for member in room_settings['members']]
+                    and client_id not in self._workers):
+                raise ValueError(f"Client {client_id} is not a member of room {room_id}")
+            record_calibration(room_settings, client_id, seconds)
+            self.update_room_settings(room_id, room_settings)
+
+    def _lease_expired(self, task, now):
+        return (task['status'] == 'rendering'
+                and task.get('lease_expires') is not None
+                and task['lease_expires'] < now)
 
     def _create_tasks(self, room_id):
         room_settings = self.get_room_settings(room_id)
+        segments = [{
+            "file_name": blender_file["file_name"],
+            "start_frame": blender_file["render_settings"]["start_frame"],
+            "end_frame": blender_file["render_settings"]["end_frame"],
+            "seconds_per_frame": estimate_seconds_per_frame(blender_file)
+        } for blender_file in room_settings["blender_files"]]
+
         tasks = []
-        client_count = len(room_settings['members'])
-        client_index = 0
-        
-        for blender_file in room_settings["blender_files"]:
-            file_name = blender_file["file_name"]
-            render_settings = blender_file["render_settings"]
-            start_frame = render_settings["start_frame"]
-            end_frame = render_settings["end_frame"]
-            
-            frames_per_task = 10
-            for i in range(start_frame, end_frame + 1, frames_per_task):
-                task_end_frame = min(i + frames_per_task - 1, end_frame)
-                task = {
-                    "id": f"{room_id}_{file_name}_{i}",
-                    "file_name": file_name,
-                    "start_frame": i,
-                    "end_frame": task_end_frame,
-                    "status": "triggered",
-                    "client": room_settings['members'][client_index]['id']
-                }
-                tasks.append(task)
-                client_index = (client_index + 1) % client_count
-        
-        tasks_file_path = os.path.join(ROOMS_FOLDER, room_id, "log", "tasks.json")
-        with open(tasks_file_path, 'w') as f:
-            json.dump(tasks, f, indent=2)
+        now = time.time()
+        for file_name, start_frame, end_frame in plan_chunks(segments, len(room_settings['members'])):
+            tasks.append({
+                "id": f"{room_id}_{file_name}_{start_frame}",
+                "file_name": file_name,
+                "start_frame": start_frame,
+                "end_frame": end_frame,
+                "last_frame": start_frame - 1,  # 已完成的最后一帧
+                "status": "triggered",
+                "client": None,  # 由客户端通过 get_next_task 领取
+                "lease_expires": None,
+                "queued_at": now,  # 用于优先级老化
+                "version": 0
+            })
+
+        self._save_tasks(room_id, tasks)
+
+    def _load_tasks(self, room_id):
+        if room_id not in self.tasks:
+            tasks = self._store.load_tasks(room_id)
+            if tasks is None:
+                return []
+            self._set_tasks(room_id, tasks)
+        return self.tasks[room_id]
+
+    def _set_tasks(self, room_id, tasks):
+        self.tasks[room_id] = tasks
+        self._task_index[room_id] = {task['id']: position for position, task in enumerate(tasks)}
+        self._task_queries[room_id] = TaskIndex(tasks)
+
+    def _add_task(self, room_id, task):
+        task['changed_version'] = self._bump_version(room_id)
+        tasks = self._load_tasks(room_id)
+        self._task_index[room_id][task['id']] = len(tasks)
+        self._task_queries[room_id].add(task, len(tasks))
+        tasks.append(task)
+        self._store.save_task(room_id, task)
+        self.events.publish(room_id, 'task', task)
+        return task
+
+    def _replace_task(self, room_id, task, changes):
+        # 写时复制：已经交给其他线程的旧字典保持不变
+        new_task = dict(task, **changes)
+        new_task['version'] = task.get('version', 0) + 1
+        new_task['changed_version'] = self._bump_version(room_id)
+        position = self._task_index[room_id][task['id']]
+        self._task_queries[room_id].replace(self.tasks[room_id][position], new_task)
+        self.tasks[room_id][position] = new_task
+        self._store.save_task(room_id, new_task)
+        self.events.publish(room_id, 'task', new_task)
+        return new_task
+
+    def _save_tasks(self, room_id, tasks):
+        version = self._bump_version(room_id)
+        for task in tasks:
+            task['changed_version'] = version
+        self._set_tasks(room_id, tasks)
+        self._store.save_tasks(room_id, tasks)
+        room_settings = self._edit_room_settings(room_id)
+        room_settings['tasks_reset_version'] = version
+        self._save_room_settings(room_id, room_settings)
+        # 整个任务列表被替换，订阅方需要重新拉取
+        self.events.publish(room_id, 'reset', {})
 
     def _save_room_settings(self, room_id, room_settings):
-        room_settings_path = os.path.join(ROOMS_FOLDER, room_id, "log", "room_settings.json")
-        os.makedirs(os.path.dirname(room_settings_path), exist_ok=True)  # 确保目录存在
-        with open(room_settings_path, 'w') as f:
-            json.dump(room_settings, f, indent=2)
+        # 先写好版本号再替换缓存，已经交给其他线程的旧字典保持不变
+        room_settings['room_version'] = self._bump_version(room_id)
+        self.rooms[room_id] = room_settings
+        self._store.save_room(room_id, room_settings)
+
+    def update_render_log(self, room_id, frame_info):
+        return self.update_render_log_batch(room_id, [frame_info])
+
+    def update_render_log_batch(self, room_id, records):
+        """记录一批已渲染的帧 {"frame", "task_id", "client", "blend_file"}，返回新完成的帧数"""
+        room_settings = self.get_room_settings(room_id)
+        frame_ranges = {blender_file['file_name']: (blender_file['render_settings']['start_frame'],
+                                                    blender_file['render_settings']['end_frame'])
+                        for blender_file in room_settings['blender_files']}
+        return self._render_logs.add_frames(room_id, records, frame_ranges)
+
+    def get_render_log(self, room_id, blend_file=None, include_runs=True):
+        """每个 blend 文件的完成位图、已完成/缺失的帧区间，以及每段帧对应的任务和客户端"""
+        self.get_room_settings(room_id)  # 房间不存在时抛出 ValueError
+        return self._render_logs.summary(room_id, blend_file, include_runs)
 
     def get_room_status(self, room_id):
         room_settings = self.get_room_settings(room_id)
-        return {
-            "status": room_settings['status'],
-            "members": len(room_settings['members']),
-            "blender_files": len(room_settings['blender_files'])
-        }
+        with self.room_lock(room_id):
+            # 剩余帧数和领取过任务的客户端取自增量维护的任务索引，不遍历任务列表
+            remaining, clients = {}, set()
+            if self._load_tasks(room_id):
+                index = self._task_queries[room_id]
+                remaining = {file_name: entry["frames_remaining"] for file_name, entry in index.files.items()}
+                clients = {client for client, task_ids in index.by_client.items()
+                           if task_ids and client != UNASSIGNED}
+            return {
+                "status": room_settings['status'],
+                "members": len(room_settings['members']),
+                "blender_files": len(room_settings['blender_files']),
+                # 还没有完成的任务（待领取和渲染中），客户端据此判断是否继续等待
+                "unfinished_tasks": self._count_tasks(room_id, ('triggered', 'rendering')),
+                # 每个有截止时间的 blend 文件按当前渲染速度能否按时完成
+                "deadlines": deadline_report(room_settings, remaining, clients, time.time())
+            }
 
     def start_rendering(self, room_id):
-        room_settings = self.get_room_settings(room_id)
-        if room_settings['status'] != 'triggered':
-            raise ValueError(f"Room is not in triggered status. Current status: {room_settings['status']}")
-        room_settings['status'] = 'rendering'
-        self.update_room_settings(room_id, room_settings)
+        with self.room_lock(room_id):
+            room_settings = self._edit_room_settings(room_id)
+            if room_settings['status'] != 'triggered':
+                raise ValueError(f"Room is not in triggered status. Current status: {room_settings['status']}")
+            room_settings['status'] = 'rendering'
+            self.update_room_settings(room_id, room_settings)
+            self.events.publish(room_id, 'room_status', {"status": 'rendering'})
         logging.info(f"Room {room_id} status updated to 'rendering'")
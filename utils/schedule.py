@@ -0,0 +1,80 @@
+import math
+from datetime import datetime
+from config import TASK_AGING_SECONDS, TASK_MAX_WAIT_SECONDS
+from utils.chunking import estimate_seconds_per_frame
+from utils.throughput import client_seconds_per_frame
+
+def deadline_timestamp(value):
+    """把截止时间（ISO 8601 字符串或 Unix 时间戳）转换为时间戳，未设置时返回 None"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid deadline: {value!r}")
+    return datetime.fromisoformat(value).timestamp()
+
+def effective_schedule(room_settings, blender_file):
+    """blend 文件自己的 priority/deadline 优先，否则继承房间的设置，返回 (priority, deadline 时间戳)"""
+    blender_file = blender_file or {}
+    priority = blender_file.get("priority", room_settings.get("priority", 0))
+    deadline = blender_file.get("deadline", room_settings.get("deadline"))
+    return priority, deadline_timestamp(deadline)
+
+def task_sort_key(room_settings, blender_file, task, now, file_queued_at=None,
+                  aging_seconds=TASK_AGING_SECONDS, max_wait_seconds=TASK_MAX_WAIT_SECONDS):
+    """待领取任务的排序键：最早截止时间优先，同一截止时间内按老化后的优先级。
+
+    queued_at 是任务最近一次进入待领取状态的时间，每等待 aging_seconds 秒优先级加一。
+    file_queued_at 是同一 blend 文件中等待最久的待领取任务的入队时间，它等待超过
+    max_wait_seconds 时该文件的任务排在所有任务之前（等待最久的文件先），
+    避免低优先级或没有截止时间的文件一直被插队。
+    """
+    priority, deadline = effective_schedule(room_settings, blender_file)
+    queued_at = task.get("queued_at", now)
+    waited = max(0.0, now - queued_at)
+    aged_priority = -(priority + waited // aging_seconds)
+    oldest = min(queued_at, file_queued_at) if file_queued_at is not None else queued_at
+    if now - oldest > max_wait_seconds:
+        return (0, oldest, aged_priority)
+    return (1, deadline if deadline is not None else math.inf, aged_priority)
+
+def deadline_report(room_settings, remaining, clients, now):
+    """按截止时间先后估计每个有截止时间的 blend 文件能否按时完成。
+
+    remaining 是每个 blend 文件的剩余帧数，clients 是领取过任务的客户端。
+    渲染速度取房间成员及这些客户端在该文件上的实测/校准速度之和，
+    没有任何数据时按预估单帧耗时和成员数估计。截止时间早的文件先渲染，
+    所以每个文件的预计完成时间包含排在它前面的文件的剩余工作量。
+    """
+    clients = {member["id"] for member in room_settings["members"]} | set(clients)
+    files = []
+    for blender_file in room_settings["blender_files"]:
+        _, deadline = effective_schedule(room_settings, blender_file)
+        files.append((deadline if deadline is not None else math.inf, blender_file))
+    files.sort(key=lambda item: item[0])
+
+    report = []
+    elapsed = 0.0
+    for deadline, blender_file in files:
+        frames = remaining.get(blender_file["file_name"], 0)
+        elapsed += frames / _frames_per_second(room_settings, blender_file, clients)
+        if deadline == math.inf:
+            continue
+        estimated_finish = now + elapsed
+        report.append({
+            "file_name": blender_file["file_name"],
+            "deadline": datetime.fromtimestamp(deadline).isoformat(),
+            "remaining_frames": frames,
+            "estimated_finish": datetime.fromtimestamp(estimated_finish).isoformat(),
+            "reachable": estimated_finish <= deadline
+        })
+    return report
+
+def _frames_per_second(room_settings, blender_file, clients):
+    rates = [1 / seconds_per_frame for seconds_per_frame in
+             (client_seconds_per_frame(room_settings, client_id, blender_file) for client_id in clients)
+             if seconds_per_frame]
+    if rates:
+        return sum(rates)
+    return max(1, len(room_settings["members"])) / estimate_seconds_per_frame(blender_file)
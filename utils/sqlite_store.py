@@ -0,0 +1,148 @@
+import os
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    create_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    room_id TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    member_order INTEGER NOT NULL,
+    PRIMARY KEY (room_id, client_id)
+);
+CREATE INDEX IF NOT EXISTS idx_members_client ON members (client_id);
+CREATE TABLE IF NOT EXISTS blend_files (
+    room_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    upload_order INTEGER NOT NULL,
+    render_settings TEXT NOT NULL,
+    data TEXT,
+    PRIMARY KEY (room_id, file_name)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    room_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    start_frame INTEGER NOT NULL,
+    end_frame INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    client TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (room_id, task_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (room_id, status, seq);
+CREATE INDEX IF NOT EXISTS idx_tasks_client ON tasks (room_id, client);
+"""
+
+# room_settings 中拆到独立表的字段
+ROOM_TABLE_KEYS = ("members", "blender_files")
+
+class SqliteStateStore:
+    """基于 sqlite3（WAL 模式）的状态存储，任务更新是单行事务。"""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            # 旧版本的 blend_files 表没有 data 列，只保存了文件名、上传顺序和渲染设置
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(blend_files)")]
+            if "data" not in columns:
+                self._conn.execute("ALTER TABLE blend_files ADD COLUMN data TEXT")
+            self._conn.commit()
+
+    def load_room(self, room_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+            if row is None:
+                return None
+            room_settings = json.loads(row[0])
+            room_settings["members"] = [
+                {"id": client_id, "order": order}
+                for client_id, order in self._conn.execute(
+                    "SELECT client_id, member_order FROM members WHERE room_id = ? ORDER BY member_order", (room_id,))
+            ]
+            # data 是完整的 blend 文件字典（含 priority、deadline、seconds_per_frame 等）
+            room_settings["blender_files"] = [
+                json.loads(data) if data else
+                {"file_name": file_name, "upload_order": upload_order, "render_settings": json.loads(render_settings)}
+                for file_name, upload_order, render_settings, data in self._conn.execute(
+                    "SELECT file_name, upload_order, render_settings, data FROM blend_files "
+                    "WHERE room_id = ? ORDER BY upload_order", (room_id,))
+            ]
+        return room_settings
+
+    def load_tasks(self, room_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM tasks WHERE room_id = ? ORDER BY seq", (room_id,)).fetchall()
+            if not rows:
+                # 已有的房间还没有任务时返回空列表，调用方可以缓存；房间不存在时返回 None
+                exists = self._conn.execute("SELECT 1 FROM rooms WHERE room_id = ?", (room_id,)).fetchone()
+                return [] if exists else None
+        return [json.loads(row[0]) for row in rows]
+
+    def room_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT room_id FROM rooms ORDER BY room_id")]
+
+    def save_room(self, room_id, room_settings):
+        data = {key: value for key, value in room_settings.items() if key not in ROOM_TABLE_KEYS}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rooms (room_id, status, create_time, data) VALUES (?, ?, ?, ?)",
+                (room_id, room_settings.get("status", ""), room_settings.get("create_time"), json.dumps(data)))
+            self._conn.execute("DELETE FROM members WHERE room_id = ?", (room_id,))
+            self._conn.executemany(
+                "INSERT INTO members (room_id, client_id, member_order) VALUES (?, ?, ?)",
+                [(room_id, member["id"], member["order"]) for member in room_settings.get("members", [])])
+            self._conn.execute("DELETE FROM blend_files WHERE room_id = ?", (room_id,))
+            self._conn.executemany(
+                "INSERT INTO blend_files (room_id, file_name, upload_order, render_settings, data) VALUES (?, ?, ?, ?, ?)",
+                [(room_id, blend_file["file_name"], blend_file["upload_order"], json.dumps(blend_file["render_settings"]),
+                  json.dumps(blend_file))
+                 for blend_file in room_settings.get("blender_files", [])])
+
+    def save_tasks(self, room_id, tasks):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tasks WHERE room_id = ?", (room_id,))
+            self._conn.executemany(
+                "INSERT INTO tasks (room_id, task_id, seq, file_name, start_frame, end_frame, status, client, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._task_row(room_id, seq, task) for seq, task in enumerate(tasks)])
+
+    def save_task(self, room_id, task):
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE tasks SET file_name = ?, start_frame = ?, end_frame = ?, status = ?, client = ?, data = ? "
+                "WHERE room_id = ? AND task_id = ?",
+                (task["file_name"], task["start_frame"], task["end_frame"], task["status"], task.get("client"),
+                 json.dumps(task), room_id, task["id"])).rowcount
+            if not updated:
+                seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), -1) + 1 FROM tasks WHERE room_id = ?", (room_id,)).fetchone()[0]
+                self._conn.execute(
+                    "INSERT INTO tasks (room_id, task_id, seq, file_name, start_frame, end_frame, status, client, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._task_row(room_id, seq, task))
+
+    def flush(self):
+        # 每次写入都已提交，无需额外操作
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _task_row(self, room_id, seq, task):
+        return (room_id, task["id"], seq, task["file_name"], task["start_frame"], task["end_frame"],
+                task["status"], task.get("client"), json.dumps(task))
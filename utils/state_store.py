@@ -0,0 +1,136 @@
+import os
+import json
+import time
+from config import ROOMS_FOLDER, STATE_FLUSH_DELAY, JOURNAL_FSYNC_INTERVAL
+from utils.write_behind import WriteBehindFlusher
+from utils.journal import RoomJournal
+
+class JsonStateStore:
+    """把房间状态保存为 ROOMS_FOLDER/<room>/log 下的 JSON 快照加追加日志。
+
+    每次状态变化先追加到 journal.jsonl（批量 fsync），WriteBehindFlusher 在去抖
+    窗口后把内存状态折叠成快照（原子替换）并清空日志。启动时用快照加日志尾部
+    恢复状态，服务器中途崩溃也不会丢失已记录的任务进度。
+    """
+
+    def __init__(self, rooms_folder=None, flush_delay=STATE_FLUSH_DELAY, fsync_interval=JOURNAL_FSYNC_INTERVAL):
+        self.rooms_folder = rooms_folder or ROOMS_FOLDER
+        self._rooms = {}
+        self._tasks = {}
+        self._replayed = {}
+        self._journal = RoomJournal(self.rooms_folder, fsync_interval)
+        self._flusher = WriteBehindFlusher(self._compact, flush_delay)
+
+    def load_room(self, room_id):
+        if room_id in self._rooms:
+            return self._rooms[room_id]
+        room_settings = self._read_snapshot(self._room_settings_path(room_id))
+        for record in self._journal_records(room_id):
+            if record["op"] == "room":
+                room_settings = record["room"]
+        if room_settings is not None:
+            self._rooms[room_id] = room_settings
+        return room_settings
+
+    def load_tasks(self, room_id):
+        if room_id in self._tasks:
+            return self._tasks[room_id]
+        tasks = self._read_snapshot(self._tasks_path(room_id))
+        positions = {task["id"]: index for index, task in enumerate(tasks or [])}
+        for record in self._journal_records(room_id):
+            if record["op"] == "tasks":
+                tasks = record["tasks"]
+                positions = {task["id"]: index for index, task in enumerate(tasks)}
+            elif record["op"] == "task":
+                tasks = tasks or []
+                task = record["task"]
+                if task["id"] in positions:
+                    tasks[positions[task["id"]]] = task
+                else:
+                    positions[task["id"]] = len(tasks)
+                    tasks.append(task)
+        if tasks is not None:
+            self._tasks[room_id] = tasks
+        return tasks
+
+    def room_ids(self):
+        """返回存储中所有房间的 ID（ROOMS_FOLDER 下有状态文件的目录）"""
+        if not os.path.isdir(self.rooms_folder):
+            return sorted(self._rooms)
+        room_ids = set(self._rooms)
+        for name in os.listdir(self.rooms_folder):
+            if os.path.exists(self._room_settings_path(name)) or os.path.exists(self._journal.path(name)):
+                room_ids.add(name)
+        return sorted(room_ids)
+
+    def save_room(self, room_id, room_settings):
+        self._rooms[room_id] = room_settings
+        self._journal.append(room_id, {"op": "room", "ts": time.time(), "room": room_settings})
+        self._flusher.mark_dirty(room_id)
+
+    def save_tasks(self, room_id, tasks):
+        self._tasks[room_id] = tasks
+        self._journal.append(room_id, {"op": "tasks", "ts": time.time(), "tasks": tasks})
+        self._flusher.mark_dirty(room_id)
+
+    def save_task(self, room_id, task):
+        # 只追加这一个任务的状态变化，快照由压缩线程稍后统一重写
+        self._journal.append(room_id, {"op": "task", "ts": time.time(), "task": task})
+        self._flusher.mark_dirty(room_id)
+
+    def flush(self):
+        self._flusher.flush()
+        self._journal.sync()
+
+    def close(self):
+        self._flusher.close()
+        self._journal.close()
+
+    def _compact(self, room_id):
+        # 确保快照包含日志中的全部记录后再清空日志
+        self.load_room(room_id)
+        self.load_tasks(room_id)
+
+        def write_snapshot():
+            if room_id in self._rooms:
+                self._write_atomic(self._room_settings_path(room_id), self._rooms[room_id])
+            if room_id in self._tasks:
+                self._write_atomic(self._tasks_path(room_id), self._tasks[room_id])
+
+        self._journal.compact(room_id, write_snapshot)
+        self._replayed.pop(room_id, None)
+
+    def _journal_records(self, room_id):
+        if room_id not in self._replayed:
+            self._replayed[room_id] = self._journal.read(room_id)
+        return self._replayed[room_id]
+
+    def _read_snapshot(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)  # 确保目录存在
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _room_settings_path(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "log", "room_settings.json")
+
+    def _tasks_path(self, room_id):
+        return os.path.join(self.rooms_folder, room_id, "log", "tasks.json")
+
+
+def create_state_store(backend, rooms_folder=None):
+    if backend == "json":
+        return JsonStateStore(rooms_folder)
+    if backend == "sqlite":
+        from utils.sqlite_store import SqliteStateStore
+        return SqliteStateStore(os.path.join(rooms_folder or ROOMS_FOLDER, "state.db"))
+    raise ValueError(f"Unknown state backend: {backend}")
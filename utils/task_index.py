@@ -0,0 +1,80 @@
+UNASSIGNED = "unassigned"
+
+class TaskIndex:
+    """一个房间的任务二级索引和聚合统计，随每次任务变化增量维护。
+
+    按状态、客户端、blend 文件记录任务 ID 集合，用于过滤查询；
+    按文件和客户端累计各状态的任务数、总帧数和已完成帧数，用于进度统计，
+    查询时不需要遍历任务列表。
+    """
+
+    def __init__(self, tasks=()):
+        self.positions = {}
+        self.by_status = {}
+        self.by_client = {}
+        self.by_file = {}
+        self.files = {}
+        self.clients = {}
+        for position, task in enumerate(tasks):
+            self.add(task, position)
+
+    def add(self, task, position=None):
+        if position is not None:
+            self.positions[task['id']] = position
+        self.by_status.setdefault(task['status'], set()).add(task['id'])
+        self.by_client.setdefault(task.get('client') or UNASSIGNED, set()).add(task['id'])
+        self.by_file.setdefault(task['file_name'], set()).add(task['id'])
+        self._count(task, 1)
+
+    def remove(self, task):
+        self.by_status[task['status']].discard(task['id'])
+        self.by_client[task.get('client') or UNASSIGNED].discard(task['id'])
+        self.by_file[task['file_name']].discard(task['id'])
+        self._count(task, -1)
+
+    def replace(self, old_task, new_task):
+        self.remove(old_task)
+        self.add(new_task)
+
+    def query(self, status=None, client=None, file_name=None):
+        """返回满足所有过滤条件的任务位置（升序）。status 可以是多个状态的列表"""
+        selected = None
+        for index, values in ((self.by_status, status), (self.by_client, client), (self.by_file, file_name)):
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            ids = set().union(*(index.get(value, set()) for value in values))
+            selected = ids if selected is None else selected & ids
+        if selected is None:
+            return sorted(self.positions.values())
+        return sorted(self.positions[task_id] for task_id in selected)
+
+    def stats(self):
+        return {"files": _copy(self.files), "clients": _copy(self.clients)}
+
+    def _count(self, task, sign):
+        frames_total, frames_done = _frames(task)
+        for table, key in ((self.files, task['file_name']), (self.clients, task.get('client') or UNASSIGNED)):
+            entry = table.setdefault(key, {"tasks": {}, "frames_total": 0, "frames_done": 0, "frames_remaining": 0})
+            entry["tasks"][task['status']] = entry["tasks"].get(task['status'], 0) + sign
+            if not entry["tasks"][task['status']]:
+                del entry["tasks"][task['status']]
+            entry["frames_total"] += sign * frames_total
+            entry["frames_done"] += sign * frames_done
+            entry["frames_remaining"] += sign * (frames_total - frames_done)
+            if not entry["tasks"]:
+                del table[key]
+
+def _frames(task):
+    """任务贡献的 (总帧数, 已完成帧数)。被取消、合并的任务和推测副本不计帧数"""
+    if task['status'] == 'cancelled' or task.get('speculative_of'):
+        return 0, 0
+    frames_total = task['end_frame'] - task['start_frame'] + 1
+    if task['status'] == 'done':
+        return frames_total, frames_total
+    last_frame = task.get('last_frame', task['start_frame'] - 1)
+    return frames_total, max(0, min(last_frame, task['end_frame']) - task['start_frame'] + 1)
+
+def _copy(table):
+    return {key: dict(entry, tasks=dict(entry["tasks"])) for key, entry in table.items()}
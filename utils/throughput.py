@@ -0,0 +1,41 @@
+from config import THROUGHPUT_SMOOTHING
+from utils.chunking import estimate_seconds_per_frame
+
+def record_sample(room_settings, client_id, file_name, frames, seconds, smoothing=THROUGHPUT_SMOOTHING):
+    """把一次任务的帧数和耗时计入该客户端在该文件上的滑动平均帧率，返回新的帧率"""
+    if frames <= 0 or seconds <= 0:
+        return None
+    rates = room_settings.setdefault("throughput", {}).setdefault(client_id, {})
+    sample = frames / seconds
+    previous = rates.get(file_name)
+    rates[file_name] = sample if previous is None else (1 - smoothing) * previous + smoothing * sample
+    return rates[file_name]
+
+def record_calibration(room_settings, client_id, seconds):
+    """记录客户端渲染内置校准场景的耗时（秒）"""
+    room_settings.setdefault("calibration", {})[client_id] = float(seconds)
+
+def client_seconds_per_frame(room_settings, client_id, blender_file):
+    """估计某客户端渲染该文件一帧的耗时，没有任何依据时返回 None。
+
+    优先使用该客户端的实测帧率；没有历史时用校准耗时换算：
+    参照已有实测的其他客户端，否则按房间平均校准耗时缩放文件的预估单帧耗时。
+    """
+    file_name = blender_file["file_name"]
+    throughput = room_settings.get("throughput", {})
+    fps = throughput.get(client_id, {}).get(file_name)
+    if fps:
+        return 1 / fps
+
+    calibration = room_settings.get("calibration", {})
+    own = calibration.get(client_id)
+    if not own:
+        return None
+    # 每个参照客户端给出 "单帧耗时 / 校准耗时"，按本机校准耗时换算
+    ratios = [1 / rates[file_name] / calibration[other]
+              for other, rates in throughput.items()
+              if rates.get(file_name) and calibration.get(other)]
+    if ratios:
+        return own * sum(ratios) / len(ratios)
+    average = sum(calibration.values()) / len(calibration)
+    return estimate_seconds_per_frame(blender_file) * own / average
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from config import ROOMS_FOLDER, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_TTL
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+class IncompleteUploadError(Exception):
+    """提交时还有分块没有上传"""
+
+    def __init__(self, missing):
+        super().__init__(f"{len(missing)} chunks are missing")
+        self.missing = missing
+
+class UploadSessionStore:
+    """分块上传会话：大文件按编号分块上传，可以并行、可以中断后续传。
+
+    会话保存在 <room>/uploads/<upload_id>/ 下：meta.json 记录文件名、大小和分块大小，
+    每个分块写成 <index>.chunk（先写临时文件再重命名，不会留下半个分块）。
+    服务器重启后会话仍然有效。提交时按顺序拼接分块并计算 SHA-256，
+    与客户端给出的校验和一致才原子地移动到目标目录。
+    """
+
+    def __init__(self, rooms_folder=None, ttl=UPLOAD_SESSION_TTL):
+        self.rooms_folder = rooms_folder or ROOMS_FOLDER
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._session_locks = {}  # upload_id -> Lock，同一会话的提交互斥，不同会话互不阻塞
+
+    def create(self, room_id, file_name, size, chunk_size=None):
+        chunk_size = int(chunk_size or UPLOAD_CHUNK_SIZE)
+        size = int(size)
+        if size < 0 or chunk_size <= 0:
+            raise ValueError("size must be >= 0 and chunk_size > 0")
+        self.cleanup_expired(room_id)
+        upload_id = uuid.uuid4().hex
+        meta = {"upload_id": upload_id, "room_id": room_id, "file_name": file_name, "size": size,
+                "chunk_size": chunk_size, "total_chunks": max(1, -(-size // chunk_size)),
+                "created": time.time()}
+        folder = self._folder(room_id, upload_id)
+        os.makedirs(folder)
+        with open(os.path.join(folder, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+        return meta
+
+    def get(self, room_id, upload_id):
+        """返回会话信息，附带缺失的分块编号和已接收的字节数"""
+        meta = self._meta(room_id, upload_id)
+        missing, received = [], 0
+        for index in range(meta["total_chunks"]):
+            path = self._chunk_path(room_id, upload_id, index)
+            if os.path.exists(path):
+                received += os.path.getsize(path)
+            else:
+                missing.append(index)
+        return dict(meta, missing=missing, received_bytes=received)
+
+    def write_chunk(self, room_id, upload_id, index, stream, checksum=None):
+        """从 stream 读取第 index 块并保存，长度必须与分块大小一致（最后一块为剩余长度）。
+
+        checksum 是该分块的 SHA-256，给出时不一致则拒绝。同一块重复上传会覆盖旧数据。
+        """
+        meta = self._meta(room_id, upload_id)
+        if not 0 <= index < meta["total_chunks"]:
+            raise ValueError(f"Chunk index {index} out of range 0-{meta['total_chunks'] - 1}")
+        expected = min(meta["chunk_size"], meta["size"] - index * meta["chunk_size"])
+        path = self._chunk_path(room_id, upload_id, index)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    data = stream.read(1024 * 1024)
+                    if not data:
+                        break
+                    written += len(data)
+                    if written > expected:
+                        break
+                    digest.update(data)
+                    f.write(data)
+            if written != expected:
+                raise ValueError(f"Chunk {index} should be {expected} bytes, got {written}")
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise ValueError(f"Checksum mismatch for chunk {index}")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return written
+
+    def commit(self, room_id, upload_id, target_dir, checksum=None):
+        """拼接所有分块到 target_dir/<file_name>，返回最终路径。
+
+        先写到目标目录中的临时文件并校验 SHA-256，再用 os.replace 原子替换，
+        读取方不会看到未写完的文件。成功后删除会话目录。
+        """
+        with self._session_lock(upload_id):
+            session = self.get(room_id, upload_id)
+            if session["missing"]:
+                raise IncompleteUploadError(session["missing"])
+            os.makedirs(target_dir, exist_ok=True)
+            final_path = os.path.join(target_dir, session["file_name"])
+            tmp_path = f"{final_path}.{upload_id}.tmp"
+            digest = hashlib.sha256()
+            try:
+                with open(tmp_path, 'wb') as out:
+                    for index in range(session["total_chunks"]):
+                        with open(self._chunk_path(room_id, upload_id, index), 'rb') as chunk:
+                            for data in iter(lambda: chunk.read(1024 * 1024), b""):
+                                digest.update(data)
+                                out.write(data)
+                    out.flush()
+                    os.fsync(out.fileno())
+                if checksum and digest.hexdigest() != checksum.lower():
+                    raise ValueError("Checksum mismatch for the assembled file")
+                os.replace(tmp_path, final_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            shutil.rmtree(self._folder(room_id, upload_id), ignore_errors=True)
+            with self._lock:
+                self._session_locks.pop(upload_id, None)
+            return final_path
+
+    def abort(self, room_id, upload_id):
+        self._meta(room_id, upload_id)
+        shutil.rmtree(self._folder(room_id, upload_id), ignore_errors=True)
+        with self._lock:
+            self._session_locks.pop(upload_id, None)
+
+    def cleanup_expired(self, room_id, now=None):
+        """删除超过 ttl 秒没有新分块的会话"""
+        now = now or time.time()
+        uploads = os.path.join(self.rooms_folder, room_id, "uploads")
+        if not os.path.isdir(uploads):
+            return
+        for upload_id in os.listdir(uploads):
+            folder = os.path.join(uploads, upload_id)
+            try:
+                last_activity = max(os.path.getmtime(os.path.join(folder, name)) for name in os.listdir(folder))
+            except (OSError, ValueError):
+                continue
+            if now - last_activity > self.ttl:
+                shutil.rmtree(folder, ignore_errors=True)
+                with self._lock:
+                    self._session_locks.pop(upload_id, None)
+
+    def _session_lock(self, upload_id):
+        with self._lock:
+            return self._session_locks.setdefault(upload_id, threading.Lock())
+
+    def _meta(self, room_id, upload_id):
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise KeyError(f"Upload session {upload_id} not found")
+        path = os.path.join(self._folder(room_id, upload_id), "meta.json")
+        if not os.path.exists(path):
+            raise KeyError(f"Upload session {upload_id} not found")
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _folder(self, room_id, upload_id):
+        return os.path.join(self.rooms_folder, room_id, "uploads", upload_id)
+
+    def _chunk_path(self, room_id, upload_id, index):
+        return os.path.join(self._folder(room_id, upload_id), f"{index}.chunk")
@@ -0,0 +1,64 @@
+import time
+import logging
+import threading
+
+class WriteBehindFlusher:
+    """把多次写入合并后在后台线程中落盘。
+
+    调用方用 mark_dirty(key) 标记需要持久化的对象，后台线程在 delay 秒的
+    去抖窗口后统一调用 write_func(key)。close() 会强制把剩余的脏数据写完。
+    """
+
+    def __init__(self, write_func, delay=1.0):
+        self._write_func = write_func
+        self._delay = delay
+        self._dirty = set()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def mark_dirty(self, key):
+        with self._cond:
+            self._dirty.add(key)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self):
+        """立即写出所有脏数据"""
+        with self._flush_lock:
+            with self._cond:
+                keys, self._dirty = self._dirty, set()
+            for key in sorted(keys):
+                try:
+                    self._write_func(key)
+                except Exception as e:
+                    logging.error(f"Failed to flush {key}: {str(e)}")
+                    with self._cond:
+                        self._dirty.add(key)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+        if self._thread is not None:
+            self._thread.join(timeout=self._delay + 5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closed:
+                    self._cond.wait()
+                # 去抖：等待窗口期内的后续写入一起落盘，close() 可提前唤醒
+                deadline = time.monotonic() + self._delay
+                while not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
@@ -0,0 +1,73 @@
+import os
+import zipfile
+
+# 这些格式本身已经压缩过，再用 deflate 只会浪费 CPU
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.exr', '.mp4', '.mov', '.mkv', '.zip', '.gz', '.7z'}
+
+CHUNK_SIZE = 1024 * 1024
+
+class _StreamBuffer:
+    """ZipFile 写入的目标：只追加、不可 seek，写入的数据由生成器取走后清空"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """边读文件边生成 ZIP 数据，内存占用与文件总大小无关。
+
+    entries 是 (文件路径, 压缩包内路径) 的可迭代对象。已压缩的格式按 stored 写入，
+    其余用 deflate；单个文件或总大小超过 4GB 时自动使用 ZIP64。
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+        for path, arcname in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            extension = os.path.splitext(path)[1].lower()
+            zinfo.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    chunk = buffer.drain()
+                    if chunk:
+                        yield chunk
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+    # 中央目录在 ZipFile 关闭时写出
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk
+
+def parse_frame_ranges(value):
+    """"1-10,15,20-22" -> [(1, 10), (15, 15), (20, 22)]，格式错误时抛出 ValueError"""
+    ranges = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        ranges.append((int(start), int(end or start)))
+    return ranges
+
+def frame_in_ranges(frame, ranges):
+    return frame is not None and any(start <= frame <= end for start, end in ranges)
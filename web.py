@@ -5,7 +5,7 @@ import requests
 import zipfile
 import io
 from datetime import datetime
-from client import create_room, join_room, trigger_rendering, start_rendering, download_render_results, get_client_id, BASE_URL, upload_blend_file, render_loop
+from client import create_room, join_room, trigger_rendering, start_rendering, download_render_results, get_client_id, BASE_URL, upload_blend_file, render_loop, fetch_task_stats
 import time
 import logging
 import threading
@@ -20,6 +20,10 @@ logger = logging.getLogger(__name__)
 # 添加一个全局变量来存储渲染状态
 render_status = {"completed": False}
 
+# 每个浏览器会话当前的长轮询代数，切换房间时加一，旧的长轮询看到代数变化后退出
+watch_generations = {}
+watch_generations_lock = threading.Lock()
+
 # 新增函数：检查端口是否被占用
 def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -141,7 +145,8 @@ def get_render_results(room_id):
     download_render_results(room_id)
     final_dir = os.path.join("render", room_id, "final")
     if os.path.exists(final_dir):
-        files = [os.path.join(final_dir, f) for f in os.listdir(final_dir) if os.path.isfile(os.path.join(final_dir, f))]
+        # 结果按 blend 文件分目录保存
+        files = [os.path.join(root, f) for root, _, names in os.walk(final_dir) for f in sorted(names)]
         return gr.update(value=files, visible=True)
     else:
         return gr.update(value=None, visible=False)
@@ -180,16 +185,18 @@ def update_render_progress(room_id, progress, current_task, current_frame):
     return f"渲染进度: {progress:.2f}%, 当前任务: {current_task}, 前帧: {current_frame}"
 
 def check_render_status(room_id):
-    response = requests.get(f"{BASE_URL}/get_tasks", params={"room_id": room_id})
-    if response.status_code == 200:
-        tasks = response.json()["tasks"]
-        all_completed = all(task["status"] in ["done", "failed"] for task in tasks)
-        if all_completed:
+    stats = fetch_task_stats(room_id)
+    if stats is not None:
+        counts = {}
+        for file_stats in stats["files"].values():
+            for status, count in file_stats["tasks"].items():
+                counts[status] = counts.get(status, 0) + count
+        total = sum(counts.values())
+        completed = sum(counts.get(status, 0) for status in ["done", "failed", "cancelled"])
+        if completed == total:
             return "🎉 所有渲染任务已完成！"
         else:
-            in_progress = sum(1 for task in tasks if task["status"] == "rendering")
-            completed = sum(1 for task in tasks if task["status"] in ["done", "failed"])
-            total = len(tasks)
+            in_progress = counts.get("rendering", 0)
             return f"渲染进行中... {completed}/{total} 任务完成，{in_progress} 任务进行中"
     return "无法获取渲染状态"
 
@@ -309,6 +316,39 @@ if __name__ == "__main__":
 
         demo.load(update_status, inputs=[current_room_id, current_client_id], outputs=[room_info, tasks_info, render_results, download_status_text])
 
+        def watch_status(room_id, client_id, request: gr.Request):
+            """进入房间后长轮询房间事件，有任务变化、成员加入或新结果时才刷新界面。
+
+            同一会话切换到其他房间（或离开房间）时代数改变，这里的循环在下一次轮询返回后退出。
+            """
+            session = request.session_hash
+            with watch_generations_lock:
+                generation = watch_generations[session] = watch_generations.get(session, 0) + 1
+
+            def watching():
+                return watch_generations.get(session) == generation
+
+            yield update_status(room_id, client_id)
+            since = None
+            while room_id and watching():
+                params = {"room_id": room_id} if since is None else {"room_id": room_id, "since": since}
+                try:
+                    response = requests.get(f"{BASE_URL}/events/poll", params=params, timeout=60)
+                except requests.RequestException as e:
+                    logger.error(f"Failed to poll room events: {e}")
+                    time.sleep(5)
+                    continue
+                if response.status_code != 200 or not watching():
+                    return
+                body = response.json()
+                since = body["last_id"]
+                if body["events"]:
+                    yield update_status(room_id, client_id)
+
+        # 长轮询不占用事件的并发名额，否则新房间的 watch_status 要排在旧房间的长轮询之后，旧的永远等不到代数变化
+        current_room_id.change(watch_status, inputs=[current_room_id, current_client_id], outputs=[room_info, tasks_info, render_results, download_status_text],
+                               concurrency_limit=None)
+
         def start_render_with_updates(room_id, client_id):
             if start_rendering(room_id):
                 threading.Thread(target=render_loop, args=(room_id, client_id)).start()